@@ -5,7 +5,7 @@ a = Analysis(
     ['model_test_ui.py'],
     pathex=[],
     binaries=[('E:\\anaconda3\\envs\\esp_robot_env\\Lib\\site-packages\\xgboost\\lib\\xgboost.dll', 'xgboost\\lib')],
-    datas=[('.\\windows_label.csv', '.'), ('.\\label_encoder.joblib', '.'), ('.\\xgboost_model.joblib', '.')],
+    datas=[('.\\windows_label.csv', '.'), ('.\\model.bundle', '.'), ('.\\label_encoder.joblib', '.'), ('.\\xgboost_model.joblib', '.')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
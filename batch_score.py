@@ -0,0 +1,217 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar_log import read_log
+from feature_engine import (DATA_BUFFER_SECONDS, FEATURE_WINDOW_SECONDS, FINAL_FEATURE_COLUMNS, MIN_BUFFER_ROWS,
+                            RAW_DATA_COLUMNS, RESOURCE_COLUMNS, ROLLING_COLUMNS)
+from model_bundle import BUNDLE_PATH, load_bundle
+from offline_features import prefix_sums, rolling_window_sums, window_starts
+
+DEFAULT_BATCH_SIZE = 65536
+OUTPUT_DIR = 'scores'
+# 与 RollingFeatureEngine 的默认容量一致，缓冲区满时丢弃最旧的数据
+BUFFER_CAPACITY = 256
+
+
+def live_features(df, idle_means, capacity=BUFFER_CAPACITY, buffer_seconds=DATA_BUFFER_SECONDS,
+                  window_seconds=FEATURE_WINDOW_SECONDS):
+    """
+    对整个采集文件一次算出实时监控每个tick的特征，规则与 RollingFeatureEngine 相同：
+    滑窗为 (t - 10s, t]，不按会话切分 (与实时程序一样只看时间)；资源使用率取当前行减去空闲基准，
+    GPU基准为-1时使用原始值；30s缓冲区内不足 MIN_BUFFER_ROWS 行时为收集中。
+    返回 (特征 (n, 特征数) float64, 是否可预测, 缓冲区行数)
+    """
+    times_ns = df['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    n = len(times_ns)
+    same_session = np.zeros(n, dtype=np.int64)
+    # 环形缓冲区最多保存 capacity 行
+    oldest = np.maximum(np.arange(n) + 1 - capacity, 0)
+    window_start = np.maximum(window_starts(times_ns, same_session, window_seconds), oldest)
+    buffer_start = np.maximum(window_starts(times_ns, same_session, buffer_seconds), oldest)
+    buffered = np.arange(n) + 1 - buffer_start
+
+    features = np.empty((n, len(FINAL_FEATURE_COLUMNS)), dtype=np.float64)
+    for col in ROLLING_COLUMNS:
+        features[:, FINAL_FEATURE_COLUMNS.index(f'{col}_freq')] = rolling_window_sums(
+            prefix_sums(df[col].to_numpy()), window_start)
+    for col in RESOURCE_COLUMNS:
+        value = df[col].to_numpy(dtype=np.float64)
+        baseline = idle_means[col]
+        if col in ('gpu_percent', 'gpu_vram_percent') and baseline == -1:
+            features[:, FINAL_FEATURE_COLUMNS.index(col)] = value
+        else:
+            features[:, FINAL_FEATURE_COLUMNS.index(col)] = value - baseline
+    return features, buffered >= MIN_BUFFER_ROWS, buffered
+
+
+def score_features(bundle, features, ready, batch_size=DEFAULT_BATCH_SIZE, engine='xgboost'):
+    """
+    对可预测的行分批打分，返回 (n, 类别数) 的float32概率，收集中的行为NaN。
+    engine='xgboost' 使用XGBoost的多线程预测 (与 TreeEnsemble 逐位一致)，'tree' 使用 TreeEnsemble。
+    """
+    proba = np.full((len(features), len(bundle.classes)), np.nan, dtype=np.float32)
+    rows = np.flatnonzero(ready)
+    for start in range(0, len(rows), batch_size):
+        chunk = rows[start:start + batch_size]
+        X = features[chunk].astype(np.float32)
+        if engine == 'xgboost':
+            proba[chunk] = bundle.booster.inplace_predict(X)
+        else:
+            proba[chunk] = bundle.engine.predict_proba(X)
+    return proba
+
+
+def score_log(df, bundle, idle_means=None, batch_size=DEFAULT_BATCH_SIZE, engine='xgboost'):
+    """对一个采集日志 (read_log 的结果) 打分，返回 (逐秒结果DataFrame, 各阶段耗时)"""
+    idle_means = idle_means or bundle.idle_means
+    df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    start = time.perf_counter()
+    features, ready, buffered = live_features(df, idle_means)
+    feature_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    proba = score_features(bundle, features, ready, batch_size, engine)
+    score_seconds = time.perf_counter() - start
+
+    classes = np.array(bundle.classes, dtype=object)
+    out = pd.DataFrame({
+        'timestamp': df['timestamp'],
+        'status': np.where(ready, 'ok', 'collecting'),
+        'buffered': buffered,
+        'model_label': np.where(ready, classes[np.nan_to_num(proba).argmax(axis=1)], ''),
+    })
+    for k, name in enumerate(bundle.classes):
+        out[f'p_{name}'] = proba[:, k]
+    if 'label' in df:
+        out['recorded_label'] = df['label'].to_numpy()
+    return out, {'features': feature_seconds, 'score': score_seconds}
+
+
+def output_path(path, output_dir=OUTPUT_DIR):
+    name = os.path.basename(os.path.normpath(path)).split('.')[0]
+    return os.path.join(output_dir, f'{name}.scores.csv')
+
+
+def idle_means_from_log(df):
+    """与训练时一样使用该文件自身 idle 行的均值作为基准"""
+    idle = df.loc[df['label'] == 'idle', RESOURCE_COLUMNS]
+    if idle.empty:
+        raise ValueError("文件中没有 idle 行，无法计算空闲基准")
+    return {col: float(idle[col].mean()) for col in RESOURCE_COLUMNS}
+
+
+# ---------- 测试 ----------
+def check_parity(path='test_data/system_log_9_23.csv', bundle_path=BUNDLE_PATH, limit=None):
+    """
+    把采集文件逐行送入实时监控的 MonitorPipeline.step (RollingFeatureEngine + TreeEnsemble)，
+    与批量结果逐行比较：收集中/可预测状态、模型标签、概率和特征必须一致。
+    """
+    from pipeline import FakeRecorder, MonitorPipeline
+    from window_matcher import WindowMatcher
+    bundle = load_bundle(bundle_path)
+    df = read_log(path).sort_values('timestamp', kind='stable').reset_index(drop=True)
+    if limit:
+        df = df.iloc[:limit]
+    batch, _ = score_log(df, bundle)
+    features, _, _ = live_features(df, bundle.idle_means)
+
+    raw = df[RAW_DATA_COLUMNS].to_numpy(dtype=np.float64)
+    seconds = (df['timestamp'] - df['timestamp'].iloc[0]).dt.total_seconds().to_numpy()
+    pipeline = MonitorPipeline(FakeRecorder(list(raw)), bundle.engine, WindowMatcher({}), dict(bundle.idle_means))
+    start = time.perf_counter()
+    live = [pipeline.step(i, seconds[i]) for i in range(len(df))]
+    live_seconds = time.perf_counter() - start
+
+    mismatches = 0
+    for i, result in enumerate(live):
+        expected_status = batch['status'].iloc[i]
+        if result.status != expected_status:
+            mismatches += 1
+            continue
+        if result.status == 'ok':
+            proba = batch.loc[i, [f'p_{c}' for c in bundle.classes]].to_numpy(dtype=np.float32)
+            if (result.model_label != batch['model_label'].iloc[i] or not np.array_equal(result.probabilities, proba)
+                    or not np.allclose(result.features, features[i], rtol=1e-12, atol=1e-9)):
+                mismatches += 1
+    assert mismatches == 0, f"{mismatches}/{len(df)} 行与实时监控不一致"
+    print(f"与实时监控逐行一致: {len(df)} 行 ({(batch['status'] == 'ok').sum()} 行可预测)；"
+          f"逐行回放 {len(df) / live_seconds:,.0f} 行/秒")
+    return len(df)
+
+
+def synthetic_recording(n_rows, seed=0):
+    """在 offline_features.synthetic_log 的基础上加入资源使用率列"""
+    from offline_features import synthetic_log
+    rng = np.random.default_rng(seed)
+    df = synthetic_log(n_rows, seed)
+    for col in RESOURCE_COLUMNS:
+        df[col] = rng.uniform(0, 100, n_rows)
+    return df
+
+
+def benchmark(n_rows=1_000_000, bundle_path=BUNDLE_PATH):
+    """合成日志上的吞吐量 (行/秒)：特征计算与打分分别计时"""
+    bundle = load_bundle(bundle_path, lazy=False)
+    bundle.booster
+    df = synthetic_recording(n_rows)
+    for engine in ('xgboost', 'tree'):
+        rows = n_rows if engine == 'xgboost' else min(n_rows, 100_000)
+        out, timings = score_log(df.iloc[:rows], bundle, engine=engine)
+        total = timings['features'] + timings['score']
+        print(f"{engine:8s}: {rows:,} 行, 特征 {timings['features']:.2f}s, 打分 {timings['score']:.2f}s, "
+              f"合计 {rows / total:,.0f} 行/秒")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对采集日志批量计算实时监控的特征并打分，输出逐秒预测与概率")
+    parser.add_argument('paths', nargs='*', help="采集日志 (csv/csv.gz/列式日志段) 或目录，默认为 train_data/ 与 test_data/")
+    parser.add_argument('--model', default=BUNDLE_PATH)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--idle', choices=['bundle', 'file'], default='bundle',
+                        help="空闲基准：模型包中的训练基准 (与实时程序启动时相同)，或该文件自身idle行的均值")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--engine', choices=['xgboost', 'tree'], default='xgboost')
+    parser.add_argument('--check', action='store_true', help="与实时监控逐行比较")
+    parser.add_argument('--benchmark', type=int, nargs='?', const=1_000_000, default=None,
+                        help="在N行合成日志上测量吞吐量")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        check_parity(bundle_path=args.model)
+        return
+    if args.benchmark:
+        benchmark(args.benchmark, args.model)
+        return
+    from data_processs import discover_files
+    paths = []
+    for path in args.paths or ['train_data', 'test_data']:
+        is_log_dir = os.path.isdir(path) and os.path.exists(os.path.join(path, 'schema.json'))
+        paths += discover_files(path) if os.path.isdir(path) and not is_log_dir else [path]
+
+    bundle = load_bundle(args.model)
+    # 先加载模型，不计入吞吐量
+    bundle.booster if args.engine == 'xgboost' else bundle.engine
+    os.makedirs(args.output_dir, exist_ok=True)
+    total_rows = total_seconds = 0
+    for path in paths:
+        df = read_log(path)
+        idle_means = idle_means_from_log(df) if args.idle == 'file' else None
+        out, timings = score_log(df, bundle, idle_means, args.batch_size, args.engine)
+        out.to_csv(output_path(path, args.output_dir), index=False)
+        seconds = timings['features'] + timings['score']
+        total_rows += len(out)
+        total_seconds += seconds
+        line = f"{path}: {len(out)} 行, {len(out) / seconds:,.0f} 行/秒"
+        if 'recorded_label' in out:
+            ok = out['status'] == 'ok'
+            line += f", 与记录标签一致 {(out.loc[ok, 'model_label'] == out.loc[ok, 'recorded_label']).mean():.4f}"
+        print(line)
+    if total_seconds:
+        print(f"合计 {total_rows} 行, {total_rows / total_seconds:,.0f} 行/秒 (特征+打分)，结果保存在 {args.output_dir}/")
+
+
+if __name__ == "__main__":
+    main()
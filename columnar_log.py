@@ -0,0 +1,292 @@
+import calendar
+import datetime
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_engine import RAW_DATA_COLUMNS
+
+# 列式日志段：一个目录，包含 schema.json 和每列一个定长二进制文件 <列名>.bin (小端、无表头)。
+# timestamp 为本地时间的epoch毫秒 (int64，与CSV中的本地时间字符串含义相同)，
+# label 为字典编码 (uint8)，字典保存在 schema.json 的 labels 中。
+SEGMENT_SUFFIX = '.col'
+FORMAT_VERSION = 1
+
+TIMESTAMP_COLUMN = 'timestamp'
+LABEL_COLUMN = 'label'
+LOG_COLUMNS = [TIMESTAMP_COLUMN] + RAW_DATA_COLUMNS + [LABEL_COLUMN]
+
+# 采集程序写入时使用的列类型：输入与使用率为每秒速率，float32足够；网络/磁盘字节数较大，使用float64
+RECORD_DTYPES = {TIMESTAMP_COLUMN: '<i8', LABEL_COLUMN: '|u1'}
+RECORD_DTYPES.update({col: '<f8' if col.endswith('_per_sec') else '<f4' for col in RAW_DATA_COLUMNS})
+
+
+def local_epoch_ms(dt):
+    """本地时间 (naive datetime) -> epoch毫秒，不做时区换算"""
+    return calendar.timegm(dt.timetuple()) * 1000 + dt.microsecond // 1000
+
+
+class ColumnarWriter:
+    """
+    向列式日志段追加定长记录。每列一个文件，追加写入；记录先在内存中缓存，满 flush_rows 条后按列批量写出。
+    writerow 的参数与CSV行相同：[timestamp (datetime/epoch毫秒), 各数据列..., label]。
+    """
+    def __init__(self, path, dtypes=RECORD_DTYPES, columns=LOG_COLUMNS, flush_rows=1):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.schema_path = os.path.join(path, 'schema.json')
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(self.schema_path):
+            # 继续写入已有的段，沿用其列定义和标签字典
+            schema = read_schema(path)
+            self.columns = [c['name'] for c in schema['columns']]
+            self.dtypes = {c['name']: c['dtype'] for c in schema['columns']}
+            self.labels = list(schema['labels'])
+            truncate_segment(path)
+        else:
+            self.columns = list(columns)
+            self.dtypes = {col: dtypes[col] for col in self.columns}
+            self.labels = []
+            self._write_schema()
+        self._label_codes = {label: i for i, label in enumerate(self.labels)}
+        self._files = {col: open(os.path.join(path, f'{col}.bin'), 'ab') for col in self.columns}
+        self._pending = []
+
+    def _write_schema(self):
+        schema = {
+            'format_version': FORMAT_VERSION,
+            'columns': [{'name': col, 'dtype': self.dtypes[col]} for col in self.columns],
+            'timestamp_unit': 'ms',
+            'labels': self.labels,
+        }
+        tmp_path = self.schema_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(schema, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.schema_path)
+
+    def _encode_label(self, label):
+        code = self._label_codes.get(label)
+        if code is None:
+            code = len(self.labels)
+            if code > np.iinfo(self.dtypes[LABEL_COLUMN]).max:
+                raise ValueError(f"标签种类超过 {self.dtypes[LABEL_COLUMN]} 的范围")
+            self.labels.append(label)
+            self._label_codes[label] = code
+            # 先更新字典再写入数据，读取时不会遇到未知的编码
+            self._write_schema()
+        return code
+
+    def writerow(self, row):
+        timestamp = row[0]
+        if isinstance(timestamp, datetime.datetime):
+            timestamp = local_epoch_ms(timestamp)
+        self._pending.append([timestamp] + list(row[1:-1]) + [self._encode_label(row[-1])])
+        if len(self._pending) >= self.flush_rows:
+            self.flush()
+
+    def write_arrays(self, arrays, labels):
+        """按列追加一批记录：arrays 为 {列名: ndarray}，timestamp 为epoch毫秒，label 列为 labels 中的下标"""
+        self.flush()
+        codes = np.array([self._encode_label(label) for label in labels], dtype=self.dtypes[LABEL_COLUMN])
+        for col in self.columns:
+            values = arrays[col]
+            if col == LABEL_COLUMN:
+                values = codes[values] if len(codes) else np.zeros(len(values), dtype=codes.dtype)
+            f = self._files[col]
+            f.write(np.asarray(values, dtype=self.dtypes[col]).tobytes())
+            f.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        columns = list(zip(*self._pending))
+        self._pending.clear()
+        for col, values in zip(self.columns, columns):
+            f = self._files[col]
+            f.write(np.asarray(values, dtype=self.dtypes[col]).tobytes())
+            f.flush()
+
+    def close(self):
+        self.flush()
+        for f in self._files.values():
+            f.close()
+
+
+def read_schema(path):
+    with open(os.path.join(path, 'schema.json'), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _column_rows(path, column):
+    size = os.path.getsize(os.path.join(path, f"{column['name']}.bin"))
+    return size // np.dtype(column['dtype']).itemsize
+
+
+def segment_rows(path, schema=None):
+    """段中完整记录的条数 (各列行数的最小值，写入中断时多出的部分不计入)"""
+    schema = schema or read_schema(path)
+    return min(_column_rows(path, column) for column in schema['columns'])
+
+
+def truncate_segment(path, rows=None):
+    """将各列截断到相同的完整行数 (给出 rows 时最多保留前 rows 行)，用于写入中断后继续追加"""
+    schema = read_schema(path)
+    rows = segment_rows(path, schema) if rows is None else min(rows, segment_rows(path, schema))
+    for column in schema['columns']:
+        size = rows * np.dtype(column['dtype']).itemsize
+        column_path = os.path.join(path, f"{column['name']}.bin")
+        if os.path.getsize(column_path) != size:
+            os.truncate(column_path, size)
+    return rows
+
+
+def read_segment(path, mmap=True):
+    """
+    读取列式日志段，返回 ({列名: ndarray}, labels)。
+    mmap=True 时各列为只读内存映射 (零拷贝)，否则一次性读入内存。
+    """
+    schema = read_schema(path)
+    rows = segment_rows(path, schema)
+    arrays = {}
+    for column in schema['columns']:
+        column_path = os.path.join(path, f"{column['name']}.bin")
+        dtype = np.dtype(column['dtype'])
+        if rows == 0:
+            arrays[column['name']] = np.zeros(0, dtype=dtype)
+        elif mmap:
+            arrays[column['name']] = np.memmap(column_path, dtype=dtype, mode='r', shape=(rows,))
+        else:
+            arrays[column['name']] = np.fromfile(column_path, dtype=dtype, count=rows)
+    return arrays, schema['labels']
+
+
+def to_dataframe(arrays, labels, categorical=True):
+    """
+    将 read_segment 的结果转换为与CSV相同列的DataFrame：timestamp为datetime64[ms]，
+    label 为Categorical (categorical=False 时为字符串)。数值列不复制。
+    """
+    data = {}
+    for name, values in arrays.items():
+        if name == TIMESTAMP_COLUMN:
+            data[name] = values.view('datetime64[ms]')
+        elif name == LABEL_COLUMN:
+            label = pd.Categorical.from_codes(np.asarray(values).astype(np.int16), categories=labels)
+            data[name] = label if categorical else np.asarray(label, dtype=object)
+        else:
+            data[name] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def read_log(path, categorical=False):
+    """读取采集日志 (CSV、.csv.gz 或列式日志段)，返回timestamp已解析为datetime的DataFrame"""
+    if os.path.isdir(path):
+        return to_dataframe(*read_segment(path), categorical=categorical)
+    df = pd.read_csv(path)
+    df[TIMESTAMP_COLUMN] = pd.to_datetime(df[TIMESTAMP_COLUMN])
+    return df
+
+
+def _lossless_dtype(values):
+    """为CSV中的一列选择不丢失精度的最窄类型：整数列按取值范围选择，浮点列保持float64"""
+    if values.dtype.kind in 'iu':
+        low, high = (values.min(), values.max()) if len(values) else (0, 0)
+        for dtype in ('|u1', '<u2', '<u4', '<u8') if low >= 0 else ('|i1', '<i2', '<i4', '<i8'):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return dtype
+    return '<f8'
+
+
+def convert_csv(csv_path, segment_path=None, chunk_rows=100_000):
+    """把已有的CSV采集日志转换为列式日志段 (各列使用无损的最窄类型)，返回段路径"""
+    if segment_path is None:
+        segment_path = csv_path.split('.csv')[0] + SEGMENT_SUFFIX
+    if os.path.exists(segment_path):
+        raise FileExistsError(f"{segment_path} 已存在")
+    df = pd.read_csv(csv_path)
+    dtypes = {TIMESTAMP_COLUMN: '<i8', LABEL_COLUMN: '|u1'}
+    dtypes.update({col: _lossless_dtype(df[col].to_numpy()) for col in df.columns
+                   if col not in (TIMESTAMP_COLUMN, LABEL_COLUMN)})
+    writer = ColumnarWriter(segment_path, dtypes=dtypes, columns=list(df.columns), flush_rows=chunk_rows)
+    timestamps = pd.to_datetime(df[TIMESTAMP_COLUMN]).to_numpy(dtype='datetime64[ms]').view(np.int64)
+    # 按列整块写入，不逐行经过 writerow
+    for label in pd.unique(df[LABEL_COLUMN]):
+        writer._encode_label(label)
+    codes = df[LABEL_COLUMN].map(writer._label_codes).to_numpy()
+    for col in writer.columns:
+        values = timestamps if col == TIMESTAMP_COLUMN else codes if col == LABEL_COLUMN else df[col].to_numpy()
+        writer._files[col].write(np.asarray(values, dtype=writer.dtypes[col]).tobytes())
+    writer.close()
+    return segment_path
+
+
+def _disk_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(p) for p in glob.glob(os.path.join(path, '*')))
+    return os.path.getsize(path)
+
+
+def check_roundtrip(csv_path='train_data/system_log_9_22.csv'):
+    """CSV -> 列式日志段 -> DataFrame 的结果应与直接读取CSV完全相同"""
+    import tempfile
+    with tempfile.TemporaryDirectory() as root:
+        segment = convert_csv(csv_path, os.path.join(root, 'log' + SEGMENT_SUFFIX))
+        ours = read_log(segment)
+        theirs = read_log(csv_path)
+        assert list(ours.columns) == list(theirs.columns)
+        for col in theirs.columns:
+            assert (ours[col].to_numpy() == theirs[col].to_numpy()).all(), f"{col} 不一致"
+
+        # 采集程序的写入路径：逐行写入、中断后 (某列多出半行) 继续追加
+        writer = ColumnarWriter(os.path.join(root, 'rec' + SEGMENT_SUFFIX))
+        start = datetime.datetime(2025, 9, 22, 20, 0, 0)
+        for i in range(10):
+            writer.writerow([start + datetime.timedelta(seconds=i)] + [float(i)] * len(RAW_DATA_COLUMNS)
+                            + ['coding' if i % 2 else 'idle'])
+        writer.close()
+        with open(os.path.join(root, 'rec' + SEGMENT_SUFFIX, 'cpu_percent.bin'), 'ab') as f:
+            f.write(b'\x00\x00')
+        writer = ColumnarWriter(os.path.join(root, 'rec' + SEGMENT_SUFFIX))
+        writer.writerow([start + datetime.timedelta(seconds=10)] + [10.0] * len(RAW_DATA_COLUMNS) + ['video'])
+        writer.close()
+        df = read_log(os.path.join(root, 'rec' + SEGMENT_SUFFIX))
+        assert len(df) == 11 and list(df['label'][:3]) == ['idle', 'coding', 'idle'] and df['label'].iloc[-1] == 'video'
+        assert df['timestamp'].iloc[-1] == pd.Timestamp('2025-09-22 20:00:10')
+        assert (df['cpu_percent'].to_numpy() == np.arange(11)).all()
+    return len(theirs)
+
+
+def benchmark(pattern='train_data/*.csv', repeat=5):
+    """对比CSV与列式日志段的加载耗时 (读取并解析时间戳) 和磁盘占用"""
+    import tempfile
+    paths = sorted(glob.glob(pattern))
+    with tempfile.TemporaryDirectory() as root:
+        segments = [convert_csv(p, os.path.join(root, os.path.basename(p).split('.csv')[0] + SEGMENT_SUFFIX))
+                    for p in paths]
+        results = {}
+        for name, items in (('csv', paths), ('columnar', segments)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                rows = sum(len(read_log(p)) for p in items)
+            elapsed = (time.perf_counter() - start) / repeat
+            size = sum(_disk_size(p) for p in items)
+            results[name] = (elapsed, size)
+            print(f"{name:8s}: {len(items)} 个文件 {rows} 行, 加载 {elapsed * 1000:7.2f} ms, 磁盘占用 {size / 1024:8.1f} KiB")
+    csv_time, csv_size = results['csv']
+    col_time, col_size = results['columnar']
+    print(f"加载快 {csv_time / col_time:.0f} 倍, 体积为CSV的 {col_size / csv_size:.0%}")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == 'convert':
+        for csv_path in sys.argv[2:]:
+            print(f"{csv_path} -> {convert_csv(csv_path)}")
+    else:
+        print(f"往返一致性校验通过: {check_roundtrip()} 行")
+        benchmark()
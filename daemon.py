@@ -0,0 +1,388 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from pipeline import MonitorPipeline
+from window_matcher import WINDOWS_LABEL_PATH, WindowMatcher, load_windows_dictionary
+
+DEFAULT_PORT = 8765
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'digit_spirit.sock')
+# 订阅者的发送缓冲区超过该字节数 (读取跟不上) 时断开该订阅者，避免内存无限增长
+MAX_CLIENT_BUFFER = 1 << 20
+
+
+def result_to_dict(result, classes, feature_names):
+    """PredictionResult -> 可JSON序列化的字典"""
+    state = {
+        'status': result.status, 'label': result.label, 'model_label': result.model_label,
+        'window_title': result.window_title, 'process_name': result.process_name,
+        'buffered': result.buffered, 'tick': result.tick, 'timestamp': result.timestamp,
+    }
+    if result.probabilities is not None:
+        state['probabilities'] = {c: float(p) for c, p in zip(classes, result.probabilities)}
+    if result.features is not None:
+        state['features'] = {name: float(v) for name, v in zip(feature_names, result.features)}
+    if result.error:
+        state['error'] = result.error
+    return state
+
+
+class StateServer:
+    """
+    把流水线的最新结果提供给本机的其他程序，一个事件循环服务所有客户端。
+    每个结果只序列化一次，之后对每个订阅者只是一次非阻塞写入，额外开销与客户端数量近似线性且很小。
+    协议 (每行一个请求/响应，UTF-8 JSON)：
+      get / {"cmd": "get"}              返回当前状态
+      subscribe / {"cmd": "subscribe"}  先返回当前状态，之后每个tick推送一行，直到断开
+      stats / {"cmd": "stats"}          服务统计
+    同一端口也接受 HTTP：GET /state、GET /stats 返回JSON，GET /stream 为 text/event-stream 推送。
+    """
+    def __init__(self, classes=(), feature_names=(), max_client_buffer=MAX_CLIENT_BUFFER):
+        self.classes = list(classes)
+        self.feature_names = list(feature_names)
+        self.max_client_buffer = max_client_buffer
+        self.latest = {'status': 'starting'}
+        self._latest_line = self._encode(self.latest)
+        self.subscribers = {}  # writer -> 'ndjson' | 'sse'
+        self.clients = 0
+        self.published = 0
+        self.slow_disconnects = 0
+        self.broadcast_seconds = 0.0
+        self.loop = None
+        self.ready = threading.Event()
+        self._servers = []
+
+    @staticmethod
+    def _encode(state):
+        return (json.dumps(state, ensure_ascii=False, separators=(',', ':')) + '\n').encode()
+
+    # ---------- 发布 (流水线线程调用) ----------
+    def publish(self, result):
+        state = result_to_dict(result, self.classes, self.feature_names)
+        self.loop.call_soon_threadsafe(self._broadcast, state, self._encode(state))
+
+    def _broadcast(self, state, line):
+        start = time.perf_counter()
+        self.latest, self._latest_line = state, line
+        self.published += 1
+        sse = None
+        for writer, fmt in list(self.subscribers.items()):
+            if writer.transport.get_write_buffer_size() > self.max_client_buffer:
+                self.slow_disconnects += 1
+                self._drop(writer)
+                continue
+            if fmt == 'sse':
+                sse = sse or b'data: ' + line + b'\n'
+                writer.write(sse)
+            else:
+                writer.write(line)
+        self.broadcast_seconds += time.perf_counter() - start
+
+    def _drop(self, writer):
+        self.subscribers.pop(writer, None)
+        writer.close()
+
+    def stats(self):
+        return {'clients': self.clients, 'subscribers': len(self.subscribers), 'published': self.published,
+                'slow_disconnects': self.slow_disconnects,
+                'broadcast_us': self.broadcast_seconds / self.published * 1e6 if self.published else 0.0}
+
+    # ---------- 客户端 ----------
+    async def _handle(self, reader, writer):
+        self.clients += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode('utf-8', 'replace').strip()
+                if text.startswith(('GET ', 'HEAD ')):
+                    await self._handle_http(text, reader, writer)
+                    break
+                if not text:
+                    continue
+                try:
+                    cmd = json.loads(text).get('cmd') if text.startswith('{') else text
+                except (ValueError, AttributeError):
+                    cmd = None
+                if cmd == 'get':
+                    writer.write(self._latest_line)
+                elif cmd == 'stats':
+                    writer.write(self._encode(self.stats()))
+                elif cmd == 'subscribe':
+                    writer.write(self._latest_line)
+                    self.subscribers[writer] = 'ndjson'
+                else:
+                    writer.write(self._encode({'error': f"unknown request: {text[:100]}"}))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients -= 1
+            self.subscribers.pop(writer, None)
+            writer.close()
+
+    async def _handle_http(self, request_line, reader, writer):
+        while (await reader.readline()).strip():  # 跳过请求头
+            pass
+        path = request_line.split()[1] if len(request_line.split()) > 1 else '/'
+        if path == '/stream':
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n\r\n'
+                         + b'data: ' + self._latest_line + b'\n')
+            self.subscribers[writer] = 'sse'
+            await reader.read()  # 保持连接直到客户端断开
+            return
+        if path in ('/', '/state'):
+            body, status = self._latest_line, '200 OK'
+        elif path == '/stats':
+            body, status = self._encode(self.stats()), '200 OK'
+        else:
+            body, status = self._encode({'error': 'not found'}), '404 Not Found'
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+                     f'Connection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+
+    # ---------- 运行 ----------
+    async def serve(self, port=None, socket_path=None, host='127.0.0.1'):
+        """在本机TCP端口和/或Unix域套接字上服务，直到 shutdown()"""
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        if socket_path:
+            if socket_in_use(socket_path):
+                raise RuntimeError(f"another daemon is already serving on {socket_path}")
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)  # 上次异常退出残留的套接字文件
+            self._servers.append(await asyncio.start_unix_server(self._handle, path=socket_path))
+        if port is not None:
+            server = await asyncio.start_server(self._handle, host, port)
+            self.port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+        self.ready.set()
+        try:
+            await self._stopped.wait()
+        finally:
+            for server in self._servers:
+                server.close()
+            for writer in list(self.subscribers):
+                self._drop(writer)
+            if socket_path and os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+    def shutdown(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+
+def pump(pipeline, server, device=None):
+    """把流水线的每个结果交给服务端 (和下位机输出)，流水线或服务停止时返回"""
+    server.ready.wait()
+    while True:
+        result = pipeline.results.get()
+        if result is None:
+            break
+        if device is not None:
+            device.update(result)
+        try:
+            server.publish(result)
+        except RuntimeError:  # 事件循环已关闭
+            break
+
+
+def run_daemon(pipeline, server, port=None, socket_path=None, device=None):
+    """启动流水线和服务，阻塞直到 Ctrl+C"""
+    pipeline.start()
+    thread = threading.Thread(target=pump, args=(pipeline, server, device), name='daemon-pump', daemon=True)
+    thread.start()
+    try:
+        asyncio.run(server.serve(port, socket_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+        thread.join(timeout=2)
+        if device is not None:
+            device.close()
+
+
+# ---------- 客户端工具 ----------
+def connect(port=None, socket_path=None, timeout=5.0):
+    if socket_path:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+    else:
+        sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+    return sock
+
+
+def socket_in_use(socket_path):
+    """Unix域套接字上是否有守护进程在应答 (文件不存在或连接被拒绝时为False)"""
+    if not os.path.exists(socket_path):
+        return False
+    try:
+        connect(socket_path=socket_path, timeout=1.0).close()
+    except OSError:
+        return False
+    return True
+
+
+def query(cmd='get', port=None, socket_path=None):
+    """发送一个请求并返回响应字典"""
+    with connect(port, socket_path) as sock:
+        sock.sendall(cmd.encode() + b'\n')
+        return json.loads(sock.makefile('rb').readline())
+
+
+def subscribe(port=None, socket_path=None):
+    """逐条返回推送的状态字典的生成器"""
+    with connect(port, socket_path, timeout=None) as sock:
+        sock.sendall(b'subscribe\n')
+        for line in sock.makefile('rb'):
+            yield json.loads(line)
+
+
+# ---------- 测试 ----------
+def check_daemon(n_clients=200, interval=0.02, duration=1.5):
+    """
+    假采集器 + 假模型以 interval 运行，n_clients 个订阅者同时连接 (TCP与Unix域套接字各一半)，
+    检查每个订阅者按顺序收到相同的结果，get/stats/HTTP 请求正常，并报告每个订阅者的额外开销。
+    """
+    import selectors
+    import urllib.request
+    from feature_engine import FINAL_FEATURE_COLUMNS, RAW_DATA_COLUMNS
+    from pipeline import _TEST_IDLE_MEANS, FakeModel, FakeRecorder
+
+    idle_row = [0.0] * len(RAW_DATA_COLUMNS)
+    typing_row = list(idle_row)
+    typing_row[RAW_DATA_COLUMNS.index('keyboard_counts')] = 5
+    recorder = FakeRecorder([idle_row] * 20 + [typing_row] * 20, [("Visual Studio Code", "Code.exe")])
+    pipeline = MonitorPipeline(recorder, FakeModel(), WindowMatcher({}), _TEST_IDLE_MEANS, interval=interval)
+    server = StateServer(FakeModel.classes, FINAL_FEATURE_COLUMNS)
+    use_unix = hasattr(socket, 'AF_UNIX') and sys.platform != 'win32'
+    # 异常退出时 TemporaryDirectory 也会在解释器退出前删除目录
+    socket_dir = tempfile.TemporaryDirectory() if use_unix else None
+    socket_path = os.path.join(socket_dir.name, 'daemon.sock') if use_unix else None
+    loop_thread = threading.Thread(target=lambda: asyncio.run(server.serve(0, socket_path)), daemon=True)
+    loop_thread.start()
+    assert server.ready.wait(5)
+    port = server.port
+
+    pipeline.start()
+    pump_thread = threading.Thread(target=pump, args=(pipeline, server), daemon=True)
+    pump_thread.start()
+
+    selector = selectors.DefaultSelector()
+    received = {}
+    for i in range(n_clients):
+        sock = connect(socket_path=socket_path) if use_unix and i % 2 else connect(port)
+        sock.sendall(b'{"cmd": "subscribe"}\n')
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, i)
+        received[i] = [b'']
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for key, _ in selector.select(timeout=0.1):
+            data = key.fileobj.recv(1 << 16)
+            lines = received[key.data]
+            lines[-1] += data
+            parts = lines.pop().split(b'\n')
+            lines.extend(parts)
+
+    state = query('get', port)
+    stats = query('stats', socket_path=socket_path) if use_unix else query('stats', port)
+    http_state = json.loads(urllib.request.urlopen(f'http://127.0.0.1:{port}/state', timeout=5).read())
+    assert state['status'] in ('collecting', 'ok') and http_state['tick'] >= state['tick'] - 1
+    assert stats['subscribers'] == n_clients, stats
+    if use_unix:
+        # 已有守护进程应答时第二个守护进程拒绝启动，不会顶替它的套接字；残留的套接字文件不算占用
+        try:
+            asyncio.run(StateServer(FakeModel.classes, FINAL_FEATURE_COLUMNS).serve(None, socket_path))
+            raise AssertionError("第二个守护进程顶替了正在运行的守护进程")
+        except RuntimeError:
+            pass
+        assert query('get', socket_path=socket_path)['tick'] >= state['tick']
+        stale_path = os.path.join(socket_dir.name, 'stale.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(stale_path)
+        stale.close()
+        assert not socket_in_use(stale_path)
+
+    pipeline.stop()
+    pump_thread.join(timeout=2)
+    for key in list(selector.get_map().values()):
+        key.fileobj.close()
+    server.shutdown()
+    loop_thread.join(timeout=5)
+    if socket_dir is not None:
+        socket_dir.cleanup()
+
+    streams = []
+    for lines in received.values():
+        states = [json.loads(line) for line in lines if line.strip()]
+        ticks = [s['tick'] for s in states if s['status'] != 'starting']
+        assert ticks == sorted(ticks) and len(ticks) > 10, "订阅者收到的结果缺失或乱序"
+        streams.append(ticks)
+    common = set.intersection(*(set(t[1:]) for t in streams))
+    assert len(common) > 10, "各订阅者收到的结果不一致"
+    labels = {line for lines in received.values() for line in lines if b'"label":"coding"' in line}
+    assert labels, "没有收到模型结果"
+    print(f"守护进程检查通过: {n_clients} 个订阅者, 每个收到 {min(map(len, streams))}-{max(map(len, streams))} 条, "
+          f"广播一条结果 {stats['broadcast_us']:.0f}us (每个订阅者 {stats['broadcast_us'] / n_clients:.2f}us), "
+          f"慢客户端断开 {stats['slow_disconnects']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="无界面的实时监控守护进程：一个采集器和一个模型，通过本机套接字提供当前状态")
+    parser.add_argument('--model', default='model.bundle')
+    parser.add_argument('--dictionary', default=WINDOWS_LABEL_PATH, help="字典规则 (title,label)")
+    parser.add_argument('--port', type=int, default=None, help=f"本机TCP端口 (同时支持HTTP)，Windows下默认 {DEFAULT_PORT}")
+    parser.add_argument('--socket', default=None, help=f"Unix域套接字路径，非Windows平台默认 {DEFAULT_SOCKET}")
+    parser.add_argument('--interval', type=float, default=1.0, help="采样周期 (秒)")
+    parser.add_argument('--metrics-port', type=int, default=0, help="同时在该端口提供性能指标 (见 metrics.py)")
+    parser.add_argument('--device', default=None, help="同时把平滑后的状态发送给下位机 (串口或 tcp:host:port，见 device_output.py)")
+    parser.add_argument('--check', action='store_true', help="用假采集器运行多客户端检查")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        check_daemon()
+        return
+    if args.port is None and args.socket is None:
+        if sys.platform == 'win32' or not hasattr(socket, 'AF_UNIX'):
+            args.port = DEFAULT_PORT
+        else:
+            args.socket = DEFAULT_SOCKET
+    if args.socket and socket_in_use(args.socket):
+        print(f"Error: another daemon is already serving on {args.socket}")
+        sys.exit(1)
+
+    from feature_engine import FINAL_FEATURE_COLUMNS
+    from model_bundle import load_bundle
+    from model_test import Recorder, get_foreground_window, win32gui
+    bundle = load_bundle(args.model, FINAL_FEATURE_COLUMNS, lazy=False)
+    metrics = None
+    if args.metrics_port:
+        from metrics import Metrics
+        metrics = Metrics()
+        metrics.serve(args.metrics_port)
+    recorder = Recorder(window_probe=get_foreground_window if win32gui is not None else None)
+    pipeline = MonitorPipeline(recorder, bundle.engine, WindowMatcher(load_windows_dictionary(args.dictionary)),
+                               dict(bundle.idle_means), interval=args.interval, metrics=metrics)
+    server = StateServer(bundle.classes, bundle.feature_names)
+    where = [f"127.0.0.1:{args.port}"] if args.port is not None else []
+    where += [args.socket] if args.socket else []
+    print(f"Monitoring daemon (model version {bundle.model_version}) listening on {', '.join(where)}")
+    device = None
+    if args.device:
+        from device_output import DeviceOutput
+        device = DeviceOutput(args.device, bundle.classes, metrics=metrics).start()
+    run_daemon(pipeline, server, args.port, args.socket, device)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,248 @@
+import argparse
+import concurrent.futures
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import time
+
 import pandas as pd
 
+from columnar_log import LOG_COLUMNS, SEGMENT_SUFFIX, read_log, read_schema
+from dataset_store import STORE_DIR, build_store
+from offline_features import DEFAULT_WINDOWS, SESSION_GAP_SECONDS, add_window_features
+
+# 预处理逻辑 (基准扣除、会话切分、滑窗特征) 有改动时递增，旧的缓存随之失效
+PIPELINE_VERSION = 2
+
+CACHE_DIR = '.preprocess_cache'
+LOG_PATTERNS = ('system_log*.csv', 'system_log*.csv.gz', 'system_log*' + SEGMENT_SUFFIX)
+
+
 def process_dataframe(df):
     columns_to_process = ['cpu_percent', 'ram_percent', 'gpu_percent', 'gpu_vram_percent']
+    idle_means = {}
     for col in columns_to_process:
         # 检查列是否存在于DataFrame中，避免出错
         if col in df.columns:
-            df[col] -= df.loc[df['label']=='idle',col].mean()
+            idle_means[col] = df.loc[df['label']=='idle',col].mean()
+            df[col] = df[col] - idle_means[col]
+    # 记录扣除的基准 (随pickle缓存保存)，写入数据集和模型包
+    df.attrs['idle_means'] = idle_means
+    df.attrs['idle_rows'] = int((df['label'] == 'idle').sum())
     return df
 
-# 1. 将所有需要处理的文件路径放入一个列表
-file_paths = [
-    #'train_data/system_log_9_5.csv',
-    #'train_data/system_log_9_8.csv',
-    #'train_data/system_log_9_9.csv',
-    #'train_data/system_log_9_13.csv',
-    'train_data/system_log_9_22.csv',
-    #'train_data/system_log_9_23.csv',
-    'train_data/system_log_9_24.csv',
-]
-
-file_paths_test = [
-    'test_data/system_log_9_23.csv',
-]
-# 2. 使用列表推导式和循环来读取和处理所有文件
-processed_dfs = [process_dataframe(pd.read_csv(file)) for file in file_paths]
-
-processed_df_test = [process_dataframe(pd.read_csv(file) )for file in file_paths_test]
-
-# 3. 合并所有处理好的DataFrame
-combined_df = pd.concat(processed_dfs, ignore_index=True)
-combined_df_test = pd.concat(processed_df_test, ignore_index=True)
-# 4. 保存结果
-combined_df.to_csv('system_log.csv', index=False)
-combined_df_test.to_csv('system_log_test.csv', index=False)
-print("数据处理完成，并已保存到 system_log.csv/system_log_test.csv")
\ No newline at end of file
+
+def log_columns(path):
+    """只读取表头/schema，返回采集日志的列名"""
+    if os.path.isdir(path):
+        return [c['name'] for c in read_schema(path)['columns']]
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def discover_files(data_dir, exclude=()):
+    """
+    找出目录下所有采集日志 (含.csv.gz和列式日志段)，按文件名排序；exclude 为要跳过的文件名通配符。
+    缺少必需列的旧格式日志 (如没有网络/磁盘列) 会被跳过并给出警告。
+    """
+    paths = set()
+    for pattern in LOG_PATTERNS:
+        paths.update(glob.glob(os.path.join(data_dir, pattern)))
+    selected = []
+    for path in sorted(paths):
+        if any(fnmatch.fnmatch(os.path.basename(path), ex) for ex in exclude):
+            continue
+        missing = [col for col in LOG_COLUMNS if col not in log_columns(path)]
+        if missing:
+            print(f"Warning: skipping {path}, missing columns: {missing}")
+            continue
+        selected.append(path)
+    return selected
+
+
+def _member_files(path):
+    """CSV为文件本身，列式日志段为目录下的全部文件"""
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, '*')))
+    return [path]
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    for member in _member_files(path):
+        h.update(os.path.basename(member).encode())
+        with open(member, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class PreprocessCache:
+    """
+    每个采集文件的预处理结果 (pickle) 按 内容哈希 + 流水线版本 + 窗口长度 缓存。
+    index.json 记录每个文件上次的大小、修改时间和哈希，二者不变时不再重新计算哈希。
+    """
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+
+    def digest(self, path):
+        stats = [os.stat(member) for member in _member_files(path)]
+        size, mtime_ns = sum(st.st_size for st in stats), max(st.st_mtime_ns for st in stats)
+        entry = self.index.get(os.path.abspath(path))
+        if entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+            return entry['sha256']
+        digest = file_digest(path)
+        self.index[os.path.abspath(path)] = {'size': size, 'mtime_ns': mtime_ns, 'sha256': digest}
+        return digest
+
+    def artefact_path(self, path, windows):
+        key = hashlib.sha256(
+            f"{self.digest(path)}|v{PIPELINE_VERSION}|{SESSION_GAP_SECONDS}|{sorted(windows)}".encode()).hexdigest()
+        name = os.path.basename(path).split('.')[0]
+        return os.path.join(self.cache_dir, f'{name}-{key[:16]}.pkl')
+
+    def save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def prune(self, keep):
+        """删除不再被任何文件引用的旧缓存"""
+        keep = {os.path.abspath(p) for p in keep}
+        for path in glob.glob(os.path.join(self.cache_dir, '*.pkl')):
+            if os.path.abspath(path) not in keep:
+                os.remove(path)
+
+
+def process_file(path, artefact_path, windows=DEFAULT_WINDOWS):
+    """单个采集文件：扣除idle基准 -> 按时间排序 -> 会话切分与滑窗特征，结果写入缓存 (在工作进程中执行)"""
+    df = process_dataframe(read_log(path))
+    df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    add_window_features(df, windows)
+    # 先写临时文件再替换，中断时不会留下半个缓存
+    tmp_path = f'{artefact_path}.{os.getpid()}.tmp'
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, artefact_path)
+    return len(df)
+
+
+def load_processed(paths, cache, windows=DEFAULT_WINDOWS, jobs=None):
+    """返回各文件的预处理结果列表，只有新增或内容变化的文件会在进程池中重新计算"""
+    artefacts = [cache.artefact_path(path, windows) for path in paths]
+    missing = [(path, artefact) for path, artefact in zip(paths, artefacts) if not os.path.exists(artefact)]
+    if missing:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(process_file, path, artefact, windows): path for path, artefact in missing}
+            for future in concurrent.futures.as_completed(futures):
+                print(f"  已处理 {futures[future]} ({future.result()} 行)")
+    print(f"  {len(paths) - len(missing)} 个文件命中缓存, {len(missing)} 个文件重新计算")
+    return [pd.read_pickle(artefact) for artefact in artefacts], artefacts
+
+
+def idle_baseline(frames):
+    """各文件扣除的空闲基准按idle行数加权平均；没有idle行时返回None"""
+    total = sum(df.attrs.get('idle_rows', 0) for df in frames)
+    if total == 0:
+        return None
+    columns = frames[0].attrs['idle_means']
+    return {col: sum(df.attrs['idle_means'][col] * df.attrs['idle_rows'] for df in frames if df.attrs.get('idle_rows'))
+            / total for col in columns}
+
+
+def combine(frames, sources=None):
+    """按时间先后合并各文件的结果，会话编号依次顺延；给出 sources 时添加来源文件列 source"""
+    if sources is not None:
+        frames = [df.assign(source=source) for df, source in zip(frames, sources)]
+    frames = sorted((df for df in frames if len(df)), key=lambda df: df['timestamp'].iloc[0])
+    offset = 0
+    for df in frames:
+        df['session_id'] += offset
+        offset = df['session_id'].iloc[-1] + 1
+    return pd.concat(frames, ignore_index=True)
+
+
+def finalize(df, label_encoder=None):
+    """与 offline_features.build_features 相同的收尾：相对秒数、标签编码、NaN填0"""
+    from sklearn.preprocessing import LabelEncoder
+    df = df.copy()
+    df['timestamp'] = (df['timestamp'] - df['timestamp'].min()).dt.total_seconds()
+    if label_encoder is None:
+        label_encoder = LabelEncoder()
+        df['label'] = label_encoder.fit_transform(df['label'])
+    else:
+        df['label'] = label_encoder.transform(df['label'])
+    df.fillna(0, inplace=True)
+    return df, label_encoder
+
+
+def build(paths, log_path, processed_path, cache, windows=DEFAULT_WINDOWS, jobs=None,
+          store_path=None, classes=None):
+    """
+    合并一组采集文件，写出扣除基准后的日志 (log_path)、特征数据 (processed_path)
+    以及内存映射数据集 (store_path，见 dataset_store.py)。返回 (缓存路径列表, 数据集)
+    """
+    if not paths:
+        print(f"警告: 没有找到 {log_path} 的输入文件，跳过")
+        return [], None
+    frames, artefacts = load_processed(paths, cache, windows, jobs)
+    combined = combine(frames, [os.path.basename(p) for p in paths])
+    store = build_store(combined, store_path, classes, idle_means=idle_baseline(frames)) if store_path else None
+    combined = combined.drop(columns='source')
+    if log_path:
+        raw_columns = [col for col in frames[0].columns if col != 'session_id' and '_freq' not in col]
+        combined[raw_columns].to_csv(log_path, index=False)
+    if processed_path:
+        finalize(combined)[0].to_csv(processed_path, index=False)
+    return artefacts, store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="预处理 train_data/ 与 test_data/ 下的采集日志，结果按文件缓存")
+    parser.add_argument('--train-dir', default='train_data')
+    parser.add_argument('--test-dir', default='test_data')
+    parser.add_argument('--exclude', nargs='*', default=[], help="跳过的文件名通配符，如 system_log_9_5.csv")
+    parser.add_argument('--windows', nargs='+', type=int, default=list(DEFAULT_WINDOWS), help="滑窗长度 (秒)")
+    parser.add_argument('--jobs', type=int, default=None, help="并行进程数，默认为CPU核数")
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--output', default='system_log.csv')
+    parser.add_argument('--output-test', default='system_log_test.csv')
+    parser.add_argument('--processed', default='processed_system.csv')
+    parser.add_argument('--processed-test', default='processed_system_test.csv')
+    parser.add_argument('--store', default=os.path.join(STORE_DIR, 'train'), help="训练集的内存映射数据集目录")
+    parser.add_argument('--store-test', default=os.path.join(STORE_DIR, 'test'), help="测试集的内存映射数据集目录")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    cache = PreprocessCache(args.cache_dir)
+    keep = []
+    classes = None
+    for name, data_dir, log_path, processed_path, store_path in (
+            ('训练集', args.train_dir, args.output, args.processed, args.store),
+            ('测试集', args.test_dir, args.output_test, args.processed_test, args.store_test)):
+        paths = discover_files(data_dir, args.exclude)
+        print(f"{name}: {len(paths)} 个文件")
+        if store_path:
+            os.makedirs(os.path.dirname(os.path.abspath(store_path)), exist_ok=True)
+        artefacts, store = build(paths, log_path, processed_path, cache, args.windows, args.jobs,
+                                 store_path, classes)
+        keep += artefacts
+        if store is not None and classes is None:
+            # 测试集沿用训练集的标签编码
+            classes = store.classes
+    cache.save_index()
+    cache.prune(keep)
+    print(f"数据处理完成 ({time.perf_counter() - start:.2f}s)，已保存到 "
+          f"{args.output}/{args.output_test} 与 {args.processed}/{args.processed_test}")
+
+
+if __name__ == "__main__":
+    main()
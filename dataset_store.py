@@ -0,0 +1,321 @@
+import datetime
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from feature_engine import FINAL_FEATURE_COLUMNS
+
+# 数据集目录的格式版本
+STORE_VERSION = 1
+STORE_DIR = 'dataset_store'
+
+_FEATURES_FILE = 'features.f32'
+_LABELS_FILE = 'labels.u1'
+_TIMESTAMPS_FILE = 'timestamps.i8'
+_META_FILE = 'meta.json'
+
+
+def _to_epoch_ms(values):
+    """datetime64 或 pandas 时间列 -> int64 epoch毫秒 (本地时间，不做时区换算)"""
+    return np.asarray(values).astype('datetime64[ms]').view(np.int64)
+
+
+def _parse_time(value):
+    """select() 的时间参数：datetime / 'YYYY-mm-dd[ HH:MM:SS]' 字符串 / epoch毫秒"""
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(np.datetime64(value, 'ms').view(np.int64))
+
+
+class StoreWriter:
+    """
+    分块写入数据集目录：append() 依次追加若干行 (特征、标签、时间戳、采集会话编号、来源文件)，
+    close() 时写入meta.json并整体替换目标目录。内存占用只与单块大小有关。
+    会话索引中的每一段为同一来源文件、同一采集会话内标签连续不变的一段行。
+    """
+    def __init__(self, path, classes, feature_names=FINAL_FEATURE_COLUMNS, idle_means=None):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        self.classes = list(classes)
+        self.feature_names = list(feature_names)
+        self.idle_means = idle_means
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self._files = {name: open(os.path.join(self.tmp_path, name), 'wb')
+                       for name in (_FEATURES_FILE, _LABELS_FILE, _TIMESTAMPS_FILE)}
+        self.rows = 0
+        self.sessions = []
+        self.sources = set()
+        self._last = None  # 上一行的 (会话编号, 标签编码, 来源)，用于跨块延续会话段
+
+    def encode(self, labels):
+        """标签字符串 -> uint8编码"""
+        import pandas as pd
+        codes = pd.Categorical(labels, categories=self.classes).codes
+        if (codes < 0).any():
+            missing = sorted(set(np.asarray(labels, dtype=object)[codes < 0]))
+            raise ValueError(f"标签 {missing} 不在类别列表中")
+        return codes.astype(np.uint8)
+
+    def append(self, features, codes, timestamps_ms, session_id, source=''):
+        """features 为 (n, 特征数) 数组，codes 为标签编码，timestamps_ms 为epoch毫秒，source 为来源文件名 (标量或数组)"""
+        n = len(codes)
+        if n == 0:
+            return
+        features = np.nan_to_num(np.asarray(features, dtype=np.float32), nan=0.0)
+        codes = np.asarray(codes, dtype=np.uint8)
+        timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+        session_id = np.asarray(session_id, dtype=np.int64)
+        sources = np.asarray(source, dtype=object)
+        if sources.ndim == 0:
+            sources = np.full(n, source, dtype=object)
+        self._files[_FEATURES_FILE].write(np.ascontiguousarray(features).tobytes())
+        self._files[_LABELS_FILE].write(codes.tobytes())
+        self._files[_TIMESTAMPS_FILE].write(timestamps_ms.tobytes())
+
+        # 会话索引：来源、采集会话或标签变化处切段
+        breaks = np.flatnonzero((session_id[1:] != session_id[:-1]) | (codes[1:] != codes[:-1])
+                                | (sources[1:] != sources[:-1])) + 1
+        first = (int(session_id[0]), int(codes[0]), str(sources[0]))
+        if self._last == first:
+            # 与上一块的最后一段相连，延续该段
+            starts = breaks
+            self.sessions[-1]['end'] = self.rows + (int(breaks[0]) if len(breaks) else n)
+            self.sessions[-1]['last_ms'] = int(timestamps_ms[(breaks[0] if len(breaks) else n) - 1])
+        else:
+            starts = np.r_[0, breaks]
+        ends = np.r_[starts[1:], n] if len(starts) else starts
+        for s, e in zip(starts, ends):
+            self.sessions.append({
+                'start': self.rows + int(s), 'end': self.rows + int(e), 'label': self.classes[codes[s]],
+                'source': str(sources[s]), 'session_id': int(session_id[s]),
+                'first_ms': int(timestamps_ms[s]), 'last_ms': int(timestamps_ms[e - 1]),
+            })
+        self._last = (int(session_id[-1]), int(codes[-1]), str(sources[-1]))
+        self.sources.update(map(str, set(sources)))
+        self.rows += n
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        meta = {
+            'version': STORE_VERSION, 'rows': self.rows, 'feature_names': self.feature_names,
+            'classes': self.classes, 'sources': sorted(self.sources), 'sessions': self.sessions,
+            'idle_means': self.idle_means,
+        }
+        with open(os.path.join(self.tmp_path, _META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        # 先写到临时目录再整体替换，中断时不会留下半个数据集
+        old_path = self.path + '.old'
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(self.tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return DatasetStore(self.path)
+
+
+def build_store(df, path, classes=None, feature_columns=FINAL_FEATURE_COLUMNS, idle_means=None):
+    """
+    由预处理后的DataFrame (data_processs.combine 的结果，timestamp为datetime，label为字符串，
+    含 session_id 与 source 列) 生成数据集目录；idle_means 为预处理时扣除的空闲基准
+    """
+    if classes is None:
+        classes = sorted(df['label'].unique())
+    writer = StoreWriter(path, classes, feature_columns, idle_means)
+    writer.append(df[list(feature_columns)].to_numpy(dtype=np.float64), writer.encode(df['label']),
+                  _to_epoch_ms(df['timestamp'].to_numpy()), df['session_id'].to_numpy(),
+                  df['source'].to_numpy() if 'source' in df else '')
+    return writer.close()
+
+
+class DatasetStore:
+    """
+    内存映射的训练数据集：float32特征矩阵、uint8标签编码、int64时间戳 (epoch毫秒)，以及会话索引。
+    打开时只读取meta.json，数组按需从磁盘映射，按会话/标签/日期选择时只做索引运算。
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, _META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['version'] != STORE_VERSION:
+            raise ValueError(f"数据集版本 {meta['version']} 与当前版本 {STORE_VERSION} 不一致，请重新生成")
+        self.meta = meta
+        self.feature_names = meta['feature_names']
+        self.classes = meta['classes']
+        self.idle_means = meta.get('idle_means')
+        self.sessions = meta['sessions']
+        self.n_rows = meta['rows']
+        self._session_starts = np.array([s['start'] for s in self.sessions], dtype=np.int64)
+        self._session_ends = np.array([s['end'] for s in self.sessions], dtype=np.int64)
+        self._X = self._y = self._timestamps = None
+
+    def __len__(self):
+        return self.n_rows
+
+    # ---------- 数组 (只读内存映射) ----------
+    def _map(self, name, dtype, shape):
+        if self.n_rows == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode='r', shape=shape)
+
+    @property
+    def X(self):
+        if self._X is None:
+            self._X = self._map(_FEATURES_FILE, np.float32, (self.n_rows, len(self.feature_names)))
+        return self._X
+
+    @property
+    def y(self):
+        if self._y is None:
+            self._y = self._map(_LABELS_FILE, np.uint8, (self.n_rows,))
+        return self._y
+
+    @property
+    def timestamps(self):
+        if self._timestamps is None:
+            self._timestamps = self._map(_TIMESTAMPS_FILE, np.int64, (self.n_rows,))
+        return self._timestamps
+
+    # ---------- 选择 ----------
+    def select_sessions(self, labels=None, sources=None, start=None, end=None):
+        """返回满足条件的会话在会话索引中的下标；时间条件为与 [start, end) 有重叠"""
+        start_ms, end_ms = _parse_time(start), _parse_time(end)
+        selected = []
+        for i, s in enumerate(self.sessions):
+            if labels is not None and s['label'] not in labels:
+                continue
+            if sources is not None and s['source'] not in sources:
+                continue
+            if start_ms is not None and s['last_ms'] < start_ms:
+                continue
+            if end_ms is not None and s['first_ms'] >= end_ms:
+                continue
+            selected.append(i)
+        return np.array(selected, dtype=np.int64)
+
+    def select(self, labels=None, sessions=None, sources=None, start=None, end=None):
+        """
+        按标签、会话下标、来源文件、时间范围 [start, end) 选择行，返回升序的行号数组。
+        各会话内的时间是有序的，时间边界用searchsorted在会话内定位。
+        """
+        if sessions is None:
+            sessions = self.select_sessions(labels, sources, start, end)
+        elif labels is not None or sources is not None:
+            sessions = np.intersect1d(sessions, self.select_sessions(labels, sources))
+        sessions = np.asarray(sessions, dtype=np.int64)
+        starts, ends = self._session_starts[sessions].copy(), self._session_ends[sessions].copy()
+        start_ms, end_ms = _parse_time(start), _parse_time(end)
+        if start_ms is not None or end_ms is not None:
+            ts = self.timestamps
+            for k in range(len(sessions)):
+                block = ts[starts[k]:ends[k]]
+                if start_ms is not None:
+                    starts[k] += np.searchsorted(block, start_ms, side='left')
+                if end_ms is not None:
+                    ends[k] = starts[k] + np.searchsorted(ts[starts[k]:ends[k]], end_ms, side='left')
+        lengths = np.maximum(ends - starts, 0)
+        if lengths.sum() == 0:
+            return np.zeros(0, dtype=np.int64)
+        # 拼接各段 [start, end) 的行号
+        offsets = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+        return np.arange(lengths.sum(), dtype=np.int64) + offsets
+
+    def read_chunk(self, start, end):
+        """
+        用普通文件读取 [start, end) 行的 (X, y) 副本。与内存映射不同，读过的页不会留在本进程的常驻内存中，
+        适合顺序扫描比内存大的数据集。
+        """
+        end = min(end, self.n_rows)
+        count = max(end - start, 0)
+        k = len(self.feature_names)
+        X = np.fromfile(os.path.join(self.path, _FEATURES_FILE), dtype=np.float32,
+                        count=count * k, offset=start * k * 4).reshape(count, k)
+        y = np.fromfile(os.path.join(self.path, _LABELS_FILE), dtype=np.uint8, count=count, offset=start)
+        return X, y
+
+    def take(self, rows=None):
+        """返回 (X, y)；rows为None时为整个数据集的内存映射 (不复制)"""
+        if rows is None:
+            return self.X, self.y
+        return self.X[rows], self.y[rows]
+
+    def groups(self, rows=None):
+        """每行所属会话在会话索引中的下标，用于按会话分组的交叉验证"""
+        group = np.repeat(np.arange(len(self.sessions), dtype=np.int64), self._session_ends - self._session_starts)
+        return group if rows is None else group[rows]
+
+    def decode(self, codes):
+        return np.asarray(self.classes, dtype=object)[np.asarray(codes)]
+
+    def to_dataframe(self, rows=None):
+        """转换为DataFrame (特征列、timestamp、label字符串)，供notebook中查看或画图"""
+        import pandas as pd
+        X, y = self.take(rows)
+        df = pd.DataFrame(np.asarray(X), columns=self.feature_names, copy=False)
+        ts = self.timestamps if rows is None else self.timestamps[rows]
+        df.insert(0, 'timestamp', np.asarray(ts).view('datetime64[ms]'))
+        df['label'] = self.decode(y)
+        return df
+
+
+def session_table(store):
+    """会话索引的文字表格，每行一个会话段"""
+    def fmt(ms):
+        return (datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=ms)).strftime('%Y-%m-%d %H:%M:%S')
+    return [f"{i:4d} {s['label']:8s} {s['end'] - s['start']:7d}行 {fmt(s['first_ms'])} ~ {fmt(s['last_ms'])} {s['source']}"
+            for i, s in enumerate(store.sessions)]
+
+
+def check_store(train_dir='train_data'):
+    """由 train_data 生成数据集，与 data_processs 的DataFrame结果比较，并测量选择耗时和内存占用"""
+    import tempfile
+    import data_processs
+    with tempfile.TemporaryDirectory() as root:
+        cache = data_processs.PreprocessCache(os.path.join(root, 'cache'))
+        paths = data_processs.discover_files(train_dir)
+        frames, _ = data_processs.load_processed(paths, cache)
+        df = data_processs.combine(frames, [os.path.basename(p) for p in paths])
+        start = time.perf_counter()
+        build_store(df, os.path.join(root, 'train'))
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = DatasetStore(os.path.join(root, 'train'))
+        X, y = store.take()
+        open_time = time.perf_counter() - start
+        expected = df[FINAL_FEATURE_COLUMNS].fillna(0).to_numpy(dtype=np.float64)
+        assert np.array_equal(np.asarray(X), expected.astype(np.float32)), "特征矩阵不一致"
+        assert list(store.decode(y)) == list(df['label']), "标签不一致"
+        assert (store.groups() >= 0).all() and len(store.groups()) == len(store)
+
+        # 选择：按标签、按日期范围，结果与DataFrame上的布尔筛选一致
+        start = time.perf_counter()
+        rows_label = store.select(labels=['coding', 'video'])
+        rows_date = store.select(start='2025-09-22 21:00:00', end='2025-09-24 12:00:00')
+        rows_both = store.select(labels=['idle'], start='2025-09-09')
+        select_time = time.perf_counter() - start
+        ts = df['timestamp']
+        assert np.array_equal(rows_label, np.flatnonzero(df['label'].isin(['coding', 'video'])))
+        assert np.array_equal(rows_date, np.flatnonzero((ts >= '2025-09-22 21:00:00') & (ts < '2025-09-24 12:00:00')))
+        assert np.array_equal(rows_both, np.flatnonzero((df['label'] == 'idle') & (ts >= '2025-09-09')))
+
+        float64_bytes = df[FINAL_FEATURE_COLUMNS].astype(np.float64).memory_usage(index=False).sum()
+        print(f"{len(store)} 行, {len(store.sessions)} 个会话段, 生成 {build_time * 1000:.1f}ms, "
+              f"打开 {open_time * 1000:.2f}ms, 3次选择 {select_time * 1000:.2f}ms")
+        print(f"特征矩阵 {X.nbytes / 1024:.0f} KiB (float32) vs DataFrame {float64_bytes / 1024:.0f} KiB (float64)")
+        return store.n_rows
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1:
+        store = DatasetStore(sys.argv[1])
+        print(f"{store.path}: {len(store)} 行, 特征 {len(store.feature_names)} 列, 类别 {store.classes}")
+        print('\n'.join(session_table(store)))
+    else:
+        print(f"数据集校验通过: {check_store()} 行")
@@ -0,0 +1,605 @@
+import argparse
+import collections
+import errno
+import os
+import select
+import socket
+import threading
+import time
+
+import numpy as np
+
+# 下位机使用固定的状态编号，与模型的类别顺序无关
+STATE_CODES = {'unknown': 0, 'idle': 1, 'coding': 2, 'browsing': 3, 'video': 4, 'gaming': 5}
+CODE_STATES = {code: state for state, code in STATE_CODES.items()}
+
+# 帧格式：A5 5A | 类型 | 序号 (0-255循环) | 负载长度 | 负载 | 校验 (类型到负载各字节的异或)
+FRAME_SYNC = b'\xa5\x5a'
+MSG_STATE = 0x01      # 状态变化，负载为 [状态编号, 置信度 0-100]
+MSG_HEARTBEAT = 0x02  # 心跳，负载同上 (当前状态)
+MAX_PAYLOAD = 32
+
+DEFAULT_BAUDRATE = 115200
+DEFAULT_HEARTBEAT = 30.0
+
+
+def encode_frame(msg_type, seq, payload):
+    body = bytes([msg_type, seq & 0xFF, len(payload)]) + bytes(payload)
+    checksum = 0
+    for b in body:
+        checksum ^= b
+    return FRAME_SYNC + body + bytes([checksum])
+
+
+class FrameDecoder:
+    """下位机一侧的参考解码器：逐字节重新同步，校验失败的帧丢弃并计数"""
+    def __init__(self):
+        self.buffer = bytearray()
+        self.errors = 0
+
+    def feed(self, data):
+        """返回解出的 [(类型, 序号, 负载bytes)]"""
+        self.buffer += data
+        frames = []
+        while True:
+            start = self.buffer.find(FRAME_SYNC)
+            if start < 0:
+                del self.buffer[:max(len(self.buffer) - 1, 0)]
+                return frames
+            del self.buffer[:start]
+            if len(self.buffer) < 5:
+                return frames
+            length = self.buffer[4]
+            if length > MAX_PAYLOAD:
+                self.errors += 1
+                del self.buffer[:1]
+                continue
+            end = 5 + length + 1
+            if len(self.buffer) < end:
+                return frames
+            checksum = 0
+            for b in self.buffer[2:end - 1]:
+                checksum ^= b
+            if checksum != self.buffer[end - 1]:
+                self.errors += 1
+                del self.buffer[:1]
+                continue
+            frames.append((self.buffer[2], self.buffer[3], bytes(self.buffer[5:end - 1])))
+            del self.buffer[:end]
+
+
+class StateFilter:
+    """
+    对每个tick的预测做平滑，只在状态真正改变时给出新状态：
+    各类别概率做指数滑动平均 (alpha)，候选状态的平均概率达到 enter 且比当前状态高出 margin，
+    并连续保持 min_dwell 个tick才切换。字典规则命中时 (最终标签与模型预测不同) 该tick按规则标签的独热概率计。
+    """
+    def __init__(self, classes, alpha=0.3, enter=0.55, margin=0.15, min_dwell=2):
+        self.labels = list(classes)
+        self.alpha = alpha
+        self.enter = enter
+        self.margin = margin
+        self.min_dwell = min_dwell
+        self.reset()
+
+    def reset(self):
+        self.scores = None
+        self.state = None
+        self.confidence = 0.0
+        self._candidate = None
+        self._dwell = 0
+
+    def _index(self, label):
+        if label not in self.labels:
+            self.labels.append(label)
+            if self.scores is not None:
+                self.scores = np.append(self.scores, 0.0)
+        return self.labels.index(label)
+
+    def update(self, label, model_label=None, probabilities=None):
+        """输入一个tick的预测，状态改变时返回新状态，否则返回None"""
+        index = self._index(label)
+        if probabilities is None or label != model_label:
+            p = np.zeros(len(self.labels))
+            p[index] = 1.0
+        else:
+            p = np.zeros(len(self.labels))
+            p[:len(probabilities)] = probabilities
+        if self.scores is None:
+            self.scores = p
+        else:
+            self.scores += self.alpha * (p - self.scores)
+
+        best = int(np.argmax(self.scores))
+        current = self.labels.index(self.state) if self.state is not None else None
+        if current is not None:
+            self.confidence = float(self.scores[current])
+        if best == current or self.scores[best] < self.enter or (
+                current is not None and self.scores[best] - self.scores[current] < self.margin):
+            self._candidate, self._dwell = None, 0
+            return None
+        if best != self._candidate:
+            self._candidate, self._dwell = best, 0
+        self._dwell += 1
+        if self._dwell < self.min_dwell:
+            return None
+        self.state = self.labels[best]
+        self.confidence = float(self.scores[best])
+        self._candidate, self._dwell = None, 0
+        return self.state
+
+
+# ---------- 传输 ----------
+class _SocketTransport:
+    """tcp:host:port 或 unix:/path"""
+    def __init__(self, target):
+        kind, _, address = target.partition(':')
+        if kind == 'unix':
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(2)
+            self.sock.connect(address)
+        else:
+            host, _, port = address.rpartition(':')
+            self.sock = socket.create_connection((host or '127.0.0.1', int(port)), timeout=2)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def write(self, data):
+        try:
+            return self.sock.send(data)
+        except BlockingIOError:
+            return 0
+
+    def discard_input(self):
+        """丢弃对端发来的数据；对端关闭连接时抛出 ConnectionError"""
+        try:
+            if not self.sock.recv(4096):
+                raise ConnectionError("device closed the connection")
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+class _TtyTransport:
+    """POSIX 串口或pty：非阻塞打开并设为原始模式"""
+    def __init__(self, path, baudrate):
+        import termios
+        import tty
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        try:
+            tty.setraw(self.fd)
+            attrs = termios.tcgetattr(self.fd)
+            speed = getattr(termios, f'B{baudrate}', None)
+            if speed is not None:
+                attrs[4] = attrs[5] = speed
+            termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        except termios.error:
+            pass  # 不是终端设备 (例如FIFO)，按普通文件描述符写入
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, data):
+        try:
+            return os.write(self.fd, data)
+        except BlockingIOError:
+            return 0
+
+    def discard_input(self):
+        try:
+            os.read(self.fd, 4096)
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _SerialTransport:
+    """其他平台 (如Windows的COM口) 使用 pyserial，write_timeout=0 即非阻塞写"""
+    def __init__(self, path, baudrate):
+        import serial
+        self.port = serial.Serial(path, baudrate, timeout=0, write_timeout=0)
+
+    def fileno(self):
+        return None
+
+    def write(self, data):
+        import serial
+        try:
+            return self.port.write(data) or 0
+        except serial.SerialTimeoutException:
+            return 0
+
+    def discard_input(self):
+        self.port.reset_input_buffer()
+
+    def close(self):
+        self.port.close()
+
+
+def open_transport(target, baudrate=DEFAULT_BAUDRATE):
+    """target 为 tcp:host:port、unix:/path，或串口设备 (/dev/ttyUSB0、COM3 等)"""
+    if target.startswith(('tcp:', 'unix:')):
+        return _SocketTransport(target)
+    if os.name == 'posix':
+        return _TtyTransport(target, baudrate)
+    return _SerialTransport(target, baudrate)
+
+
+class DeviceOutput:
+    """
+    把平滑后的状态发送给下位机：只在状态改变时发送STATE帧，无变化时每 heartbeat 秒发送一次心跳。
+    帧放入最多 max_queue 帧的发送队列，由后台线程以非阻塞方式写出；队列满时丢弃最旧的帧，
+    update() 从不阻塞调用方。连接断开时按指数退避重连，重连后立即重发当前状态。
+    给出 metrics (metrics.Metrics) 时记录发送/丢弃的帧数，并导出每小时消息数。
+    """
+    def __init__(self, target, classes, state_filter=None, heartbeat=DEFAULT_HEARTBEAT, max_queue=64,
+                 baudrate=DEFAULT_BAUDRATE, metrics=None, retry_max=10.0, clock=time.monotonic):
+        self.target = target
+        self.filter = state_filter or StateFilter(classes)
+        self.heartbeat = heartbeat
+        self.baudrate = baudrate
+        self.metrics = metrics
+        self.retry_max = retry_max
+        self.clock = clock
+        self._queue = collections.deque(maxlen=max_queue)
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._transport = None
+        self._out = b''
+        self._seq = 0
+        self._last_sent = None
+        self._stop = False
+        self._thread = None
+        self.started = None
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.transitions = 0
+        self.heartbeats = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.error = None
+        if metrics is not None:
+            metrics.add_collector(self.collector)
+
+    def start(self):
+        if self._thread is None:
+            self.started = self.clock()
+            self._last_sent = self.started
+            self._thread = threading.Thread(target=self._run, name='device-output', daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self, timeout=2.0):
+        """发送 unknown 状态 (监控已停止) 后关闭"""
+        if self._thread is not None:
+            self._enqueue(MSG_STATE, 'unknown', 0.0)
+            deadline = time.monotonic() + timeout
+            while (self._queue or self._out) and self._transport is not None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self._stop = True
+            self._wake()
+            self._thread.join(timeout)
+            self._thread = None
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._wake_r.fileno() >= 0:
+            self._wake_r.close()
+            self._wake_w.close()
+
+    # ---------- 生产者 ----------
+    def reset(self):
+        """监控停止：清空平滑状态并通知下位机状态未知"""
+        self.filter.reset()
+        self._enqueue(MSG_STATE, 'unknown', 0.0)
+
+    def update(self, result):
+        """
+        输入流水线的一个 PredictionResult；状态改变时返回新状态。
+        平滑按tick计数，应依次传入流水线产生的每个结果 (见 MonitorPipeline.drain)，而不是只传入最新的一个。
+        """
+        if result.status != 'ok':
+            return None
+        state = self.filter.update(result.label, result.model_label, result.probabilities)
+        if state is not None:
+            self.transitions += 1
+            self._enqueue(MSG_STATE, state, self.filter.confidence)
+        return state
+
+    def _enqueue(self, msg_type, state, confidence):
+        code = STATE_CODES.get(state, 0)
+        with self._lock:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+                if self.metrics is not None:
+                    self.metrics.count('device_dropped_total')
+            self._queue.append((msg_type, code, min(max(int(round(confidence * 100)), 0), 100)))
+        self._wake()
+
+    def _queued_state(self, state):
+        """发送队列的最后一帧是否已经是该状态"""
+        with self._lock:
+            return bool(self._queue) and self._queue[-1][:2] == (MSG_STATE, STATE_CODES.get(state, 0))
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    # ---------- 后台发送线程 ----------
+    def _run(self):
+        retry = 0.5
+        next_retry = 0.0
+        readable_device = False
+        while not self._stop:
+            now = self.clock()
+            if self._transport is None and time.monotonic() >= next_retry:
+                try:
+                    self._transport = open_transport(self.target, self.baudrate)
+                    self._out = b''
+                    retry = 0.5
+                    if self.reconnects and self.filter.state is not None and not self._queued_state(self.filter.state):
+                        # 下位机可能刚重新上电，先告诉它当前状态
+                        self._enqueue(MSG_STATE, self.filter.state, self.filter.confidence)
+                    self.reconnects += 1
+                except OSError as e:
+                    self.error = e
+                    next_retry = time.monotonic() + retry
+                    retry = min(retry * 2, self.retry_max)
+
+            if (self._transport is not None and not self._queue and not self._out
+                    and now - self._last_sent >= self.heartbeat):
+                self.heartbeats += 1
+                self._enqueue(MSG_HEARTBEAT, self.filter.state or 'unknown', self.filter.confidence)
+
+            if self._transport is not None:
+                try:
+                    if readable_device:
+                        self._transport.discard_input()
+                    self._flush()
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        self.error = e
+                        print(f"Warning: device output to {self.target} failed, reconnecting. Error: {e}")
+                        self._transport.close()
+                        self._transport = None
+                        next_retry = time.monotonic() + retry
+
+            # 等待新消息、设备可写或下一次心跳/重连
+            pending = bool(self._out or self._queue) and self._transport is not None
+            fileno = self._transport.fileno() if self._transport is not None else None
+            if self._transport is None:
+                timeout = max(next_retry - time.monotonic(), 0.01)
+            elif pending:
+                timeout = 0.01 if fileno is None else 1.0
+            else:
+                timeout = max(self.heartbeat - (self.clock() - self._last_sent), 0.01)
+            # 同时监听设备的输入，对端关闭连接时能立即发现
+            readers = [self._wake_r] + ([fileno] if fileno is not None else [])
+            writers = [fileno] if pending and fileno is not None else []
+            readable, _, _ = select.select(readers, writers, [], min(timeout, 1.0))
+            readable_device = fileno is not None and fileno in readable
+            if self._wake_r in readable:
+                try:
+                    while self._wake_r.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+    def _flush(self):
+        while True:
+            if not self._out:
+                with self._lock:
+                    if not self._queue:
+                        return
+                    msg_type, code, confidence = self._queue.popleft()
+                self._out = encode_frame(msg_type, self._seq, [code, confidence])
+                self._seq = (self._seq + 1) & 0xFF
+            sent = self._transport.write(self._out)
+            if not sent:
+                return
+            self.bytes_sent += sent
+            self._out = self._out[sent:]
+            if not self._out:
+                self.messages_sent += 1
+                self._last_sent = self.clock()
+                if self.metrics is not None:
+                    self.metrics.count('device_messages_total')
+
+    # ---------- 统计 ----------
+    def stats(self):
+        elapsed = self.clock() - self.started if self.started is not None else 0.0
+        return {'messages_sent': self.messages_sent, 'bytes_sent': self.bytes_sent, 'transitions': self.transitions,
+                'heartbeats': self.heartbeats, 'dropped': self.dropped, 'reconnects': self.reconnects,
+                'queued': len(self._queue), 'state': self.filter.state,
+                'messages_per_hour': self.messages_sent / elapsed * 3600 if elapsed > 0 else 0.0}
+
+    def collector(self):
+        s = self.stats()
+        return [('device_messages_per_hour', {}, s['messages_per_hour']),
+                ('device_reconnects_total', {}, s['reconnects']), ('device_queued', {}, s['queued'])]
+
+
+def from_environment(classes, metrics=None):
+    """按环境变量 DIGIT_SPIRIT_DEVICE (串口设备或 tcp:host:port / unix:/path) 启用，未设置时返回None"""
+    target = os.environ.get('DIGIT_SPIRIT_DEVICE')
+    if not target:
+        return None
+    baudrate = int(os.environ.get('DIGIT_SPIRIT_DEVICE_BAUD', DEFAULT_BAUDRATE))
+    print(f"Device output: {target}")
+    return DeviceOutput(target, classes, baudrate=baudrate, metrics=metrics).start()
+
+
+# ---------- 测试 ----------
+def _noisy_sequence(n_segments=12, segment_ticks=300, flip_rate=0.15, seed=0):
+    """真实状态每 segment_ticks 个tick变化一次，模型输出带单tick误判和概率噪声"""
+    rng = np.random.default_rng(seed)
+    classes = ['coding', 'gaming', 'idle', 'video']
+    # 相邻两段的状态不同
+    segments = np.cumsum(np.concatenate([[rng.integers(len(classes))],
+                                         rng.integers(1, len(classes), n_segments - 1)])) % len(classes)
+    truth = np.repeat(segments, segment_ticks)
+    predicted = truth.copy()
+    flips = rng.random(len(truth)) < flip_rate
+    predicted[flips] = rng.integers(0, len(classes), flips.sum())
+    proba = rng.dirichlet(np.ones(len(classes)) * 0.5, len(truth)) * 0.4
+    proba[np.arange(len(truth)), predicted] += 0.6
+    return classes, truth, predicted, proba
+
+
+def check_filter():
+    """带15%单tick误判的预测：原始标签频繁跳变，过滤后的状态变化次数与真实变化相同且延迟很小"""
+    classes, truth, predicted, proba = _noisy_sequence()
+    state_filter = StateFilter(classes)
+    states = []
+    for label, p in zip(predicted, proba):
+        state_filter.update(classes[label], classes[label], p)
+        states.append(state_filter.state)
+    raw_changes = int(np.sum(predicted[1:] != predicted[:-1]))
+    true_changes = np.flatnonzero(truth[1:] != truth[:-1]) + 1
+    filtered = [i for i in range(1, len(states)) if states[i] != states[i - 1] and states[i - 1] is not None]
+    assert len(filtered) == len(true_changes), f"过滤后变化 {len(filtered)} 次，真实 {len(true_changes)} 次"
+    delays = [f - t for f, t in zip(filtered, true_changes)]
+    assert all(0 <= d <= 10 for d in delays), delays
+    agreement = np.mean([s == classes[t] for s, t in zip(states, truth)])
+    print(f"平滑: 原始标签跳变 {raw_changes} 次 -> 状态变化 {len(filtered)} 次 (真实 {len(true_changes)} 次), "
+          f"切换延迟 {min(delays)}-{max(delays)} tick, 与真实状态一致 {agreement:.1%}")
+    return len(truth), len(filtered)
+
+
+class _Result:
+    status = 'ok'
+
+    def __init__(self, label, proba):
+        self.label = self.model_label = label
+        self.probabilities = proba
+
+
+def _read_frames(fd_or_sock, decoder, duration):
+    frames = []
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        readable, _, _ = select.select([fd_or_sock], [], [], 0.02)
+        if readable:
+            data = fd_or_sock.recv(4096) if isinstance(fd_or_sock, socket.socket) else os.read(fd_or_sock, 4096)
+            if not data:
+                break
+            frames += decoder.feed(data)
+    return frames
+
+
+def check_pty(heartbeat=0.2):
+    """通过pty发送：状态帧只在变化时出现，空闲时按心跳间隔发送，解码器无校验错误"""
+    import pty
+    master, slave = pty.openpty()
+    path = os.ttyname(slave)
+    classes, truth, predicted, proba = _noisy_sequence(n_segments=4, segment_ticks=60)
+    output = DeviceOutput(path, classes, heartbeat=heartbeat).start()
+    decoder = FrameDecoder()
+    frames = []
+    for label, p in zip(predicted, proba):
+        output.update(_Result(classes[label], p))
+    frames += _read_frames(master, decoder, heartbeat * 5.5)
+    output.close()
+    frames += _read_frames(master, decoder, 0.2)
+    os.close(master)
+    os.close(slave)
+    states = [CODE_STATES[payload[0]] for msg_type, _, payload in frames if msg_type == MSG_STATE]
+    heartbeats = [f for f in frames if f[0] == MSG_HEARTBEAT]
+    expected = [classes[truth[i * 60]] for i in range(4)] + ['unknown']
+    assert states == expected, (states, expected)
+    assert decoder.errors == 0 and 4 <= len(heartbeats) <= 6, (decoder.errors, len(heartbeats))
+    assert all(CODE_STATES[p[0]] == expected[-2] for _, _, p in heartbeats)
+    seqs = [seq for _, seq, _ in frames]
+    assert seqs == list(range(len(frames))), seqs
+    print(f"pty: {len(truth)} 个tick -> {len(states)} 个状态帧 + {len(heartbeats)} 个心跳, 统计 {output.stats()}")
+
+
+def check_socket():
+    """socket回环：对端不读取时 update() 不阻塞、队列有界；对端断开后重连并重发当前状态"""
+    listener = socket.create_server(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    classes = ['coding', 'gaming', 'idle', 'video']
+    output = DeviceOutput(f'tcp:127.0.0.1:{port}', classes, StateFilter(classes, min_dwell=1, alpha=1.0),
+                          heartbeat=60, max_queue=16).start()
+    conn, _ = listener.accept()
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+
+    # 1. 对端不读取：大量状态变化，调用方的耗时不受影响
+    worst = 0.0
+    for i in range(200_000):
+        label = classes[i % 2]
+        start = time.perf_counter()
+        output.update(_Result(label, np.eye(len(classes))[i % 2]))
+        worst = max(worst, time.perf_counter() - start)
+    assert len(output._queue) <= 16 and output.dropped > 0
+    assert worst < 0.05, f"update() 阻塞了 {worst * 1000:.1f} ms"
+
+    # 2. 读取积压的数据后断开，发送线程应立即发现、重连并重发当前状态
+    decoder = FrameDecoder()
+    conn.setblocking(False)
+    backlog = []
+    while True:
+        readable, _, _ = select.select([conn], [], [], 0.2)
+        if not readable:
+            break
+        data = conn.recv(1 << 16)
+        if not data:
+            break
+        backlog += decoder.feed(data)
+    conn.close()
+    listener.settimeout(5)
+    conn, _ = listener.accept()
+    frames = _read_frames(conn, FrameDecoder(), 0.3)
+    assert frames and frames[0][0] == MSG_STATE and CODE_STATES[frames[0][2][0]] == output.filter.state, frames[:3]
+    stats = output.stats()
+    output.close()
+    conn.close()
+    listener.close()
+    assert stats['reconnects'] >= 2 and decoder.errors == 0
+    print(f"socket: 对端不读取时 update() 最长 {worst * 1e6:.0f} us, 丢弃 {stats['dropped']} 帧, "
+          f"断开后重连 {stats['reconnects'] - 1} 次并重发当前状态")
+
+
+def check_device():
+    ticks, changes = check_filter()
+    if hasattr(os, 'openpty'):
+        check_pty()
+    check_socket()
+    per_hour = (changes + ticks / DEFAULT_HEARTBEAT) / ticks * 3600
+    print(f"每小时消息数: 每秒推送 3600 条 -> 平滑+心跳约 {per_hour:.0f} 条")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="把实时预测的状态发送给下位机 (串口或套接字)")
+    parser.add_argument('--check', action='store_true', help="运行平滑、pty与socket回环检查")
+    parser.add_argument('--listen', type=int, default=0, help="在该TCP端口模拟下位机，打印收到的帧")
+    args = parser.parse_args(argv)
+    if args.listen:
+        listener = socket.create_server(('127.0.0.1', args.listen))
+        print(f"Simulated device listening on 127.0.0.1:{args.listen}")
+        while True:
+            conn, _ = listener.accept()
+            decoder = FrameDecoder()
+            for data in iter(lambda: conn.recv(4096), b''):
+                for msg_type, seq, payload in decoder.feed(data):
+                    kind = 'STATE' if msg_type == MSG_STATE else 'HEARTBEAT'
+                    print(f"{time.strftime('%H:%M:%S')} #{seq:3d} {kind:9s} {CODE_STATES.get(payload[0])} "
+                          f"{payload[1]}%")
+            conn.close()
+    else:
+        check_device()
+
+
+if __name__ == "__main__":
+    main()
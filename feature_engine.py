@@ -0,0 +1,217 @@
+import time
+import numpy as np
+
+# 特征列，确保与模型训练时一致
+FINAL_FEATURE_COLUMNS = [
+    'cpu_percent', 'ram_percent', 'gpu_percent', 'gpu_vram_percent',
+    'mouse_left_click_freq', 'mouse_right_click_freq', 'mouse_scroll_freq',
+    'keyboard_counts_freq', 'mouse_distance_freq','bytes_sent_per_sec_freq', 'bytes_recv_per_sec_freq', 'packets_sent_per_sec_freq', 'packets_recv_per_sec_freq',
+    'read_bytes_per_sec_freq', 'write_bytes_per_sec_freq'
+]
+
+# 原始数据列
+RAW_DATA_COLUMNS = [
+    'mouse_distance', 'mouse_left_click', 'mouse_right_click',
+    'mouse_scroll', 'keyboard_counts', 'cpu_percent',
+    'ram_percent', 'gpu_percent', 'gpu_vram_percent','bytes_sent_per_sec', 'bytes_recv_per_sec', 'packets_sent_per_sec', 'packets_recv_per_sec',
+    'read_bytes_per_sec', 'write_bytes_per_sec'
+]
+
+# 资源使用率列 (取最新值并减去空闲基准)
+RESOURCE_COLUMNS = ['cpu_percent', 'ram_percent', 'gpu_percent', 'gpu_vram_percent']
+
+# 需要做10s滑窗求和的列 (结果列名为 f'{col}_freq')
+ROLLING_COLUMNS = [col for col in RAW_DATA_COLUMNS if col not in RESOURCE_COLUMNS]
+
+# RAW_DATA_COLUMNS 中哪些是计数增量 (需按实际采样间隔换算为每秒速率)，其余为使用率
+COUNTER_MASK = [col in ROLLING_COLUMNS for col in RAW_DATA_COLUMNS]
+
+DATA_BUFFER_SECONDS = 30
+FEATURE_WINDOW_SECONDS = 10
+MIN_BUFFER_ROWS = 5
+
+_RESOURCE_IDX = np.array([RAW_DATA_COLUMNS.index(c) for c in RESOURCE_COLUMNS])
+_ROLLING_IDX = np.array([RAW_DATA_COLUMNS.index(c) for c in ROLLING_COLUMNS])
+# 特征向量中各部分所在的位置
+_OUT_RESOURCE_IDX = np.array([FINAL_FEATURE_COLUMNS.index(c) for c in RESOURCE_COLUMNS])
+_OUT_ROLLING_IDX = np.array([FINAL_FEATURE_COLUMNS.index(f'{c}_freq') for c in ROLLING_COLUMNS])
+
+
+class RollingFeatureEngine:
+    """
+    定长环形缓冲区实现的滑窗特征引擎。
+    每个采样进入或离开窗口时只对累加和做一次加减，每次tick为O(1)，且不分配DataFrame。
+    """
+    def __init__(self, capacity=256, buffer_seconds=DATA_BUFFER_SECONDS,
+                 window_seconds=FEATURE_WINDOW_SECONDS):
+        self.capacity = capacity
+        self.buffer_seconds = buffer_seconds
+        self.window_seconds = window_seconds
+
+        self._rows = np.zeros((capacity, len(RAW_DATA_COLUMNS)), dtype=np.float64)
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._sums = np.zeros(len(ROLLING_COLUMNS), dtype=np.float64)
+        self._features = np.zeros(len(FINAL_FEATURE_COLUMNS), dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        # 以单调递增的序号表示位置，下标为 序号 % capacity
+        self._head = 0          # 下一个写入位置
+        self._buffer_start = 0  # 30s缓冲区中最旧的一条
+        self._window_start = 0  # 10s滑窗中最旧的一条
+        self._sums[:] = 0.0
+
+    def __len__(self):
+        """缓冲区(30s)中的数据条数，对应旧实现中的 len(self.data_buffer)"""
+        return self._head - self._buffer_start
+
+    def _evict_window(self, cutoff):
+        while self._window_start < self._head and self._times[self._window_start % self.capacity] <= cutoff:
+            self._sums -= self._rows[self._window_start % self.capacity, _ROLLING_IDX]
+            self._window_start += 1
+        if self._window_start == self._head:
+            # 窗口为空时清零，避免浮点累加误差长期积累
+            self._sums[:] = 0.0
+
+    def push(self, raw_data, timestamp=None):
+        """追加一条原始数据 (顺序同 RAW_DATA_COLUMNS)，timestamp为秒"""
+        if timestamp is None:
+            timestamp = time.time()
+
+        # 缓冲区已满时强制丢弃最旧的一条
+        if self._head - self._buffer_start == self.capacity:
+            if self._window_start == self._buffer_start:
+                self._sums -= self._rows[self._window_start % self.capacity, _ROLLING_IDX]
+                self._window_start += 1
+            self._buffer_start += 1
+
+        slot = self._head % self.capacity
+        self._rows[slot] = raw_data
+        self._times[slot] = timestamp
+        self._sums += self._rows[slot, _ROLLING_IDX]
+        self._head += 1
+
+        # 与旧实现一致：只保留 timestamp > now - N 秒的数据
+        # 10s窗口是30s缓冲区的尾部，先移出窗口再移出缓冲区，保证累加和只减一次
+        self._evict_window(timestamp - self.window_seconds)
+        buffer_cutoff = timestamp - self.buffer_seconds
+        while self._buffer_start < self._window_start and self._times[self._buffer_start % self.capacity] <= buffer_cutoff:
+            self._buffer_start += 1
+
+    def is_ready(self):
+        return len(self) >= MIN_BUFFER_ROWS
+
+    def features(self, idle_means, out=None):
+        """
+        按 FINAL_FEATURE_COLUMNS 的顺序返回特征向量。
+        资源使用率取最新一条减去空闲基准，基准为-1时表示不可用，直接使用原始值。
+        """
+        if out is None:
+            out = self._features
+        latest = self._rows[(self._head - 1) % self.capacity]
+        out[_OUT_ROLLING_IDX] = self._sums
+        for i, col in enumerate(RESOURCE_COLUMNS):
+            value = latest[_RESOURCE_IDX[i]]
+            baseline = idle_means[col]
+            if col in ('gpu_percent', 'gpu_vram_percent') and baseline == -1:
+                out[_OUT_RESOURCE_IDX[i]] = value
+            else:
+                out[_OUT_RESOURCE_IDX[i]] = value - baseline
+        return out
+
+    def feature_dict(self, idle_means):
+        return dict(zip(FINAL_FEATURE_COLUMNS, self.features(idle_means).tolist()))
+
+
+class PandasFeatureBuffer:
+    """旧版 predict_loop 中基于DataFrame的实现，仅用于一致性校验和性能对比"""
+    def __init__(self):
+        import pandas as pd
+        self.pd = pd
+        self.data_buffer = pd.DataFrame(columns=RAW_DATA_COLUMNS + ['timestamp'])
+
+    def push(self, raw_data, timestamp):
+        pd = self.pd
+        current_time = pd.Timestamp(timestamp, unit='s')
+        new_row = pd.DataFrame([raw_data], columns=RAW_DATA_COLUMNS)
+        new_row['timestamp'] = current_time
+        self.data_buffer = pd.concat([self.data_buffer, new_row], ignore_index=True)
+        self.data_buffer = self.data_buffer[self.data_buffer['timestamp'] > (current_time - pd.Timedelta(seconds=DATA_BUFFER_SECONDS))]
+        self.current_time = current_time
+
+    def __len__(self):
+        return len(self.data_buffer)
+
+    def features(self, idle_means):
+        pd = self.pd
+        recent_data = self.data_buffer[self.data_buffer['timestamp'] > (self.current_time - pd.Timedelta(seconds=FEATURE_WINDOW_SECONDS))]
+        latest_resources = self.data_buffer.iloc[-1]
+        feature_vector = {f'{col}_freq': recent_data[col].sum() for col in ROLLING_COLUMNS}
+        feature_vector.update({
+            'cpu_percent': latest_resources['cpu_percent'] - idle_means['cpu_percent'],
+            'ram_percent': latest_resources['ram_percent'] - idle_means['ram_percent'],
+            'gpu_percent': latest_resources['gpu_percent'] - idle_means['gpu_percent'] if idle_means['gpu_percent'] != -1 else latest_resources['gpu_percent'],
+            'gpu_vram_percent': latest_resources['gpu_vram_percent'] - idle_means['gpu_vram_percent'] if idle_means['gpu_vram_percent'] != -1 else latest_resources['gpu_vram_percent']
+        })
+        return np.array([feature_vector[c] for c in FINAL_FEATURE_COLUMNS], dtype=np.float64)
+
+
+def _synthetic_ticks(n, seed=0):
+    """生成带抖动和偶发断档的1Hz采样，用于校验和测速"""
+    rng = np.random.default_rng(seed)
+    t = 1_700_000_000.0
+    for _ in range(n):
+        t += 1.0 + rng.normal(0, 0.05)
+        if rng.random() < 0.01:
+            t += rng.uniform(5, 40)  # 模拟卡顿/暂停
+        row = rng.integers(0, 50, len(RAW_DATA_COLUMNS)).astype(np.float64)
+        row[0] = rng.uniform(0, 3000)
+        yield row.tolist(), t
+
+
+def check_parity(n=2000, idle_means=None):
+    """逐tick对比环形缓冲区与旧pandas实现的特征向量"""
+    if idle_means is None:
+        idle_means = {'cpu_percent': 6.0, 'ram_percent': 60.0, 'gpu_percent': -1, 'gpu_vram_percent': 15.0}
+    engine = RollingFeatureEngine()
+    reference = PandasFeatureBuffer()
+    for i, (row, t) in enumerate(_synthetic_ticks(n)):
+        engine.push(row, t)
+        reference.push(row, t)
+        assert len(engine) == len(reference), f"tick {i}: 缓冲区长度不一致 {len(engine)} != {len(reference)}"
+        if len(reference) < MIN_BUFFER_ROWS:
+            continue
+        ours, theirs = engine.features(idle_means), reference.features(idle_means)
+        assert np.allclose(ours, theirs, rtol=1e-9, atol=1e-6), f"tick {i}: 特征不一致\n{ours}\n{theirs}"
+    return n
+
+
+def benchmark(n=5000):
+    """对比两种实现每个tick的耗时与内存分配"""
+    import tracemalloc
+    idle_means = {'cpu_percent': 6.0, 'ram_percent': 60.0, 'gpu_percent': 25.0, 'gpu_vram_percent': 15.0}
+    ticks = list(_synthetic_ticks(n + 200))  # 最后200个tick用于测量内存分配
+    results = {}
+    for name, impl in (('ring_buffer', RollingFeatureEngine()), ('pandas', PandasFeatureBuffer())):
+        count = n if name == 'ring_buffer' else min(n, 500)
+        start = time.perf_counter()
+        for row, t in ticks[:count]:
+            impl.push(row, t)
+            if len(impl) >= MIN_BUFFER_ROWS:
+                impl.features(idle_means)
+        per_tick = (time.perf_counter() - start) / count
+
+        tracemalloc.start()
+        for row, t in ticks[count:count + 200]:
+            impl.push(row, t)
+            impl.features(idle_means)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = (per_tick, peak)
+        print(f"{name:12s}: {per_tick * 1e6:9.1f} us/tick, 200个tick内峰值分配 {peak / 1024:8.1f} KiB")
+    return results
+
+
+if __name__ == "__main__":
+    print(f"一致性校验通过: {check_parity()} ticks")
+    benchmark()
@@ -0,0 +1,380 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+from model_bundle import BUNDLE_PATH, load_bundle
+
+DEFAULT_PORT = 8766
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT_MS = 2.0
+PROTOCOL_VERSION = 1
+
+
+def request_dtype(n_features):
+    """请求帧：请求编号 (uint32，由客户端分配，仅在本连接内唯一) + 按 FINAL_FEATURE_COLUMNS 排列的float32特征"""
+    return np.dtype([('id', '<u4'), ('x', '<f4', (n_features,))])
+
+
+def response_dtype(n_classes):
+    """响应帧：请求编号 + 预测类别下标 (uint16) + 填充 + 各类别float32概率"""
+    return np.dtype([('id', '<u4'), ('label', '<u2'), ('pad', '<u2'), ('proba', '<f4', (n_classes,))])
+
+
+class MicroBatcher:
+    """
+    把各连接上并发到达的请求合并为微批次：攒够 max_batch 行立即打分，否则在第一条请求到达
+    max_wait 秒后打分。每个批次只调用一次批量预测，结果按连接分组后每个连接写一次。
+    预测在事件循环线程中同步执行，执行期间到达的请求自然合并进下一个批次。
+    """
+    def __init__(self, predict, n_classes, max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT_MS / 1000):
+        self.predict = predict
+        self.response_dtype = response_dtype(n_classes)
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = []
+        self.pending_rows = 0
+        self._timer = None
+        # 统计
+        self.batches = 0
+        self.rows = 0
+        self.max_batch_seen = 0
+        self.predict_seconds = 0.0
+
+    def submit(self, writer, frames):
+        self.pending.append((writer, frames))
+        self.pending_rows += len(frames)
+        if self.pending_rows >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self.pending, self.pending_rows = self.pending, [], 0
+        if not pending:
+            return
+        frames = np.concatenate([f for _, f in pending]) if len(pending) > 1 else pending[0][1]
+        start = time.perf_counter()
+        proba = np.concatenate([self.predict(frames['x'][i:i + self.max_batch])
+                                for i in range(0, len(frames), self.max_batch)])
+        self.predict_seconds += time.perf_counter() - start
+        self.batches += -(-len(frames) // self.max_batch)
+        self.rows += len(frames)
+        self.max_batch_seen = max(self.max_batch_seen, min(len(frames), self.max_batch))
+
+        out = np.zeros(len(frames), dtype=self.response_dtype)
+        out['id'] = frames['id']
+        out['label'] = proba.argmax(axis=1)
+        out['proba'] = proba
+        # 同一连接的响应拼在一起写一次
+        offset = 0
+        by_writer = {}
+        for writer, f in pending:
+            by_writer.setdefault(writer, []).append(out[offset:offset + len(f)].tobytes())
+            offset += len(f)
+        for writer, chunks in by_writer.items():
+            if not writer.is_closing():
+                writer.write(b''.join(chunks))
+
+    def stats(self):
+        return {'batches': self.batches, 'rows': self.rows,
+                'mean_batch': self.rows / self.batches if self.batches else 0.0,
+                'max_batch': self.max_batch_seen,
+                'predict_us_per_row': self.predict_seconds / self.rows * 1e6 if self.rows else 0.0}
+
+
+class InferenceServer:
+    """
+    集中打分服务。连接建立后服务端先发送一行JSON (协议版本、类别、特征列、模型版本、帧大小)，
+    之后客户端发送定长的二进制请求帧 (可以连续发送多个，不必等待响应)，服务端按帧返回定长的响应帧。
+    """
+    def __init__(self, bundle, engine='tree', max_batch=DEFAULT_MAX_BATCH, max_wait=DEFAULT_MAX_WAIT_MS / 1000):
+        self.bundle = bundle
+        n_features, n_classes = len(bundle.feature_names), len(bundle.classes)
+        self.request_dtype = request_dtype(n_features)
+        if engine == 'xgboost':
+            booster = bundle.booster
+            predict = booster.inplace_predict
+        else:
+            predict = bundle.engine.predict_proba
+        self.batcher = MicroBatcher(predict, n_classes, max_batch, max_wait)
+        self.hello = (json.dumps({
+            'protocol': PROTOCOL_VERSION, 'classes': bundle.classes, 'feature_names': bundle.feature_names,
+            'model_version': bundle.model_version, 'request_bytes': self.request_dtype.itemsize,
+            'response_bytes': self.batcher.response_dtype.itemsize,
+        }, ensure_ascii=False) + '\n').encode()
+        self.connections = 0
+        self.port = None
+        self.ready = None
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        writer.write(self.hello)
+        size = self.request_dtype.itemsize
+        buffer = b''
+        try:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    break
+                buffer += data
+                n = len(buffer) // size
+                if n:
+                    frames = np.frombuffer(buffer[:n * size], dtype=self.request_dtype).copy()
+                    buffer = buffer[n * size:]
+                    self.batcher.submit(writer, frames)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self, port=DEFAULT_PORT, socket_path=None, host='127.0.0.1', stop=None):
+        """服务直到 stop (asyncio.Event) 被设置，未给出时一直运行"""
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            server = await asyncio.start_unix_server(self._handle, path=socket_path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+            self.port = server.sockets[0].getsockname()[1]
+        async with server:
+            if self.ready is not None:
+                self.ready()
+            if stop is None:
+                await server.serve_forever()
+            else:
+                await stop.wait()
+
+
+def _server_process(conn, bundle_path, engine, max_batch, max_wait):
+    """负载测试用的服务端子进程：把端口发回父进程，收到任意消息后停止并返回统计"""
+    server = InferenceServer(load_bundle(bundle_path, lazy=False), engine, max_batch, max_wait)
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        server.ready = lambda: conn.send(server.port)
+        waiter = threading.Thread(target=lambda: (conn.recv(), loop.call_soon_threadsafe(stop.set)), daemon=True)
+        waiter.start()
+        await server.serve(0, stop=stop)
+
+    asyncio.run(run())
+    conn.send(server.batcher.stats())
+
+
+# ---------- 负载生成 ----------
+async def _load_connection(port, n_clients, duration, X, latencies, start_at, seed):
+    """一个连接承载 n_clients 个每秒发送一次的模拟客户端，发送时刻在一秒内均匀错开"""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    hello = json.loads(await reader.readline())
+    req_dtype = request_dtype(len(hello['feature_names']))
+    resp_dtype = response_dtype(len(hello['classes']))
+    loop = asyncio.get_running_loop()
+    rng = np.random.default_rng(seed)
+    period = 1.0 / n_clients
+    sent = np.zeros(int(duration * n_clients) + 1)
+    received = 0
+
+    async def receive():
+        nonlocal received
+        buffer = b''
+        while received < len(sent):
+            data = await reader.read(1 << 16)
+            if not data:
+                break
+            now = loop.time()
+            buffer += data
+            n = len(buffer) // resp_dtype.itemsize
+            if n:
+                ids = np.frombuffer(buffer[:n * resp_dtype.itemsize], dtype=resp_dtype)['id']
+                buffer = buffer[n * resp_dtype.itemsize:]
+                latencies.extend(now - sent[ids])
+                received += n
+
+    receiver = asyncio.create_task(receive())
+    next_id = 0
+    next_time = start_at + rng.uniform(0, period)
+    while next_id < len(sent):
+        delay = next_time - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        now = loop.time()
+        # 已经到期的请求 (包括落后时积压的) 一次写出
+        due = min(len(sent) - next_id, max(1, int((now - next_time) / period) + 1))
+        frames = np.zeros(due, dtype=req_dtype)
+        frames['id'] = np.arange(next_id, next_id + due)
+        frames['x'] = X[rng.integers(0, len(X), due)]
+        sent[next_id:next_id + due] = now
+        writer.write(frames.tobytes())
+        next_id += due
+        next_time += due * period
+    try:
+        await asyncio.wait_for(receiver, timeout=5)
+    except asyncio.TimeoutError:
+        receiver.cancel()
+    writer.close()
+    return received
+
+
+async def _load(port, clients, duration, connections, X):
+    latencies = []
+    connections = max(1, min(connections, clients))
+    loop = asyncio.get_running_loop()
+    start_at = loop.time() + 0.2
+    per_connection = [clients // connections + (i < clients % connections) for i in range(connections)]
+    received = await asyncio.gather(*(_load_connection(port, n, duration, X, latencies, start_at, i)
+                                      for i, n in enumerate(per_connection)))
+    return np.asarray(latencies), sum(received), loop.time() - start_at
+
+
+def load_test(bundle_path, clients, duration, max_batch, max_wait, engine='tree', connections=100, X=None):
+    """在子进程中启动服务端，模拟 clients 个1Hz客户端运行 duration 秒，返回结果字典"""
+    if X is None:
+        X = sample_features(bundle_path)
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_server_process, args=(child, bundle_path, engine, max_batch, max_wait),
+                                      daemon=True)
+    process.start()
+    port = parent.recv()
+    latencies, received, elapsed = asyncio.run(_load(port, clients, duration, connections, X))
+    parent.send('stop')
+    stats = parent.recv()
+    process.join(timeout=5)
+    expected = sum(int(duration * n) + 1 for n in
+                   [clients // connections + (i < clients % connections) for i in range(min(connections, clients))])
+    return {
+        'clients': clients, 'max_batch': max_batch, 'max_wait_ms': max_wait * 1000,
+        'requests': expected, 'responses': received, 'throughput': received / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50) * 1000) if len(latencies) else float('nan'),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000) if len(latencies) else float('nan'),
+        'mean_batch': stats['mean_batch'], 'predict_us_per_row': stats['predict_us_per_row'],
+    }
+
+
+def sample_features(bundle_path=BUNDLE_PATH, path='processed_system_test.csv', n=10_000):
+    """负载测试使用的特征：优先取测试集中的真实行，没有时使用随机值"""
+    bundle = load_bundle(bundle_path)
+    if os.path.exists(path):
+        import pandas as pd
+        return pd.read_csv(path, usecols=bundle.feature_names, nrows=n)[bundle.feature_names].to_numpy(np.float32)
+    return np.random.default_rng(0).uniform(0, 100, (n, len(bundle.feature_names))).astype(np.float32)
+
+
+def print_sweep(rows):
+    print(f"{'批大小':>6s} {'等待ms':>7s} {'请求':>7s} {'响应':>7s} {'吞吐/s':>8s} {'p50ms':>7s} {'p99ms':>7s} "
+          f"{'平均批':>7s} {'us/行':>6s}")
+    for r in rows:
+        print(f"{r['max_batch']:6d} {r['max_wait_ms']:7.1f} {r['requests']:7d} {r['responses']:7d} "
+              f"{r['throughput']:8.0f} {r['p50_ms']:7.2f} {r['p99_ms']:7.2f} {r['mean_batch']:7.1f} "
+              f"{r['predict_us_per_row']:6.1f}")
+
+
+# ---------- 测试 ----------
+def check_server(bundle_path=BUNDLE_PATH, n=3000):
+    """并发的多个连接各自连续发送请求，服务端合并为批次后返回的概率与直接批量预测逐位一致"""
+    bundle = load_bundle(bundle_path, lazy=False)
+    X = sample_features(bundle_path, n=n)
+    X = X[np.arange(n) % len(X)]
+    expected = bundle.engine.predict_proba(X)
+    server = InferenceServer(bundle, max_batch=64, max_wait=0.002)
+
+    async def client(rows):
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        hello = json.loads(await reader.readline())
+        assert hello['feature_names'] == bundle.feature_names
+        frames = np.zeros(len(rows), dtype=server.request_dtype)
+        frames['id'], frames['x'] = rows, X[rows]
+        for chunk in np.array_split(frames, 10):
+            writer.write(chunk.tobytes())
+            await asyncio.sleep(0)
+        data = await reader.readexactly(len(rows) * hello['response_bytes'])
+        writer.close()
+        return np.frombuffer(data, dtype=server.batcher.response_dtype)
+
+    async def run():
+        stop = asyncio.Event()
+        ready = asyncio.Event()
+        server.ready = ready.set
+        task = asyncio.create_task(server.serve(0, stop=stop))
+        await ready.wait()
+        parts = np.array_split(np.arange(n), 30)
+        results = await asyncio.gather(*(client(rows) for rows in parts))
+        stop.set()
+        await task
+        return results
+
+    for rows, out in zip(np.array_split(np.arange(n), 30), asyncio.run(run())):
+        assert np.array_equal(out['id'], rows), "响应顺序或编号错误"
+        assert np.array_equal(out['proba'], expected[rows]), "批量打分与直接预测不一致"
+        assert np.array_equal(out['label'], expected[rows].argmax(axis=1))
+    stats = server.batcher.stats()
+    assert stats['mean_batch'] > 1
+    print(f"服务端检查通过: {n} 个请求, {stats['batches']} 个批次 (平均 {stats['mean_batch']:.1f} 行)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="集中打分服务：合并多个客户端的特征向量为微批次，一次批量预测后分别返回")
+    sub = parser.add_subparsers(dest='command')
+    serve = sub.add_parser('serve', help="运行服务端")
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT, help="本机TCP端口")
+    serve.add_argument('--socket', default=None, help="改为使用Unix域套接字")
+    serve.add_argument('--host', default='127.0.0.1')
+    load = sub.add_parser('loadgen', help="模拟大量1Hz客户端，测量不同批大小与等待时间下的延迟和吞吐量")
+    load.add_argument('--clients', type=int, default=2000)
+    load.add_argument('--duration', type=float, default=5.0, help="每组参数运行的秒数")
+    load.add_argument('--connections', type=int, default=100, help="模拟客户端分摊到的连接数")
+    load.add_argument('--batch', type=int, nargs='+', default=[1, 16, 64, 256])
+    load.add_argument('--wait-ms', type=float, nargs='+', default=[0.0, 1.0, 5.0])
+    load.add_argument('--output', default=None, help="结果保存为JSON")
+    for p in (serve, load):
+        p.add_argument('--model', default=BUNDLE_PATH)
+        p.add_argument('--engine', choices=['tree', 'xgboost'], default='tree')
+    serve.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH)
+    serve.add_argument('--max-wait-ms', type=float, default=DEFAULT_MAX_WAIT_MS, help="批次中第一条请求最多等待的时间")
+    parser.add_argument('--check', action='store_true', help="检查批量打分结果并运行一次小规模负载测试")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        check_server()
+        print_sweep([load_test(BUNDLE_PATH, 500, 2.0, b, w / 1000, connections=50)
+                     for b, w in ((1, 0.0), (64, 2.0))])
+        return
+    if args.command == 'serve':
+        server = InferenceServer(load_bundle(args.model, lazy=False), args.engine, args.max_batch,
+                                 args.max_wait_ms / 1000)
+        print(f"Inference server (model version {server.bundle.model_version}) listening on "
+              f"{args.socket or f'{args.host}:{args.port}'}")
+        try:
+            asyncio.run(server.serve(args.port, args.socket, args.host))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'loadgen':
+        X = sample_features(args.model)
+        rows = []
+        for max_batch in args.batch:
+            for wait_ms in args.wait_ms:
+                rows.append(load_test(args.model, args.clients, args.duration, max_batch, wait_ms / 1000,
+                                      args.engine, args.connections, X))
+                print_sweep(rows[-1:])
+        print()
+        print_sweep(rows)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(rows, f, indent=1)
+    else:
+        parser.print_help(sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
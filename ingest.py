@@ -0,0 +1,650 @@
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import queue
+import re
+import select
+import socket
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from columnar_log import (LABEL_COLUMN, LOG_COLUMNS, RECORD_DTYPES, SEGMENT_SUFFIX, TIMESTAMP_COLUMN, ColumnarWriter,
+                          local_epoch_ms, truncate_segment)
+
+DEFAULT_PORT = 8767
+INGEST_DIR = 'ingest_data'
+PROTOCOL_VERSION = 1
+# 帧头：魔数、序号 (每台主机从1开始连续递增)、压缩后的负载长度
+FRAME_HEADER = struct.Struct('<4sQI')
+FRAME_MAGIC = b'DSF1'
+# 服务端拒绝某一帧时回复：相同的帧头格式，长度为随后的错误信息字节数
+REJECT_MAGIC = b'DSR1'
+# 负载 (zlib压缩前)：行数、标签字典JSON长度，之后是标签字典和按 LOG_COLUMNS 顺序排列的各列数组
+PAYLOAD_HEADER = struct.Struct('<IH')
+MAX_FRAME_BYTES = 16 << 20
+MAX_FRAME_ROWS = 100_000
+_HOST_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+# 合理的时间范围 (本地时间epoch毫秒)，超出时视为损坏的数据
+_MIN_TIMESTAMP = local_epoch_ms(datetime.datetime(2000, 1, 1))
+_MAX_TIMESTAMP = local_epoch_ms(datetime.datetime(2100, 1, 1))
+
+
+class FrameError(ValueError):
+    """帧不符合协议或schema"""
+
+
+def encode_rows(rows, level=3):
+    """把若干行 [timestamp (datetime), 各数据列..., label] 编码为压缩负载"""
+    labels = sorted({row[-1] for row in rows})
+    codes = {label: i for i, label in enumerate(labels)}
+    columns = list(zip(*rows))
+    parts = []
+    for col, values in zip(LOG_COLUMNS, columns):
+        if col == TIMESTAMP_COLUMN:
+            values = [local_epoch_ms(v) if isinstance(v, datetime.datetime) else v for v in values]
+        elif col == LABEL_COLUMN:
+            values = [codes[v] for v in values]
+        parts.append(np.asarray(values, dtype=RECORD_DTYPES[col]).tobytes())
+    label_json = json.dumps(labels, ensure_ascii=False).encode()
+    return zlib.compress(PAYLOAD_HEADER.pack(len(rows), len(label_json)) + label_json + b''.join(parts), level)
+
+
+def decode_payload(payload):
+    """
+    解压并校验负载，返回 ({列名: ndarray}, 标签列表)；不合法时抛出 FrameError。
+    时间戳来自采集端的本地时钟，NTP校时或夏令时回拨时可能倒退，因此不要求帧内递增 (读取时会按时间排序)。
+    """
+    try:
+        raw = zlib.decompress(payload)
+    except zlib.error as e:
+        raise FrameError(f"无法解压: {e}")
+    if len(raw) < PAYLOAD_HEADER.size:
+        raise FrameError("负载过短")
+    n_rows, label_len = PAYLOAD_HEADER.unpack_from(raw)
+    if not 0 < n_rows <= MAX_FRAME_ROWS:
+        raise FrameError(f"行数 {n_rows} 超出范围")
+    offset = PAYLOAD_HEADER.size
+    try:
+        labels = json.loads(raw[offset:offset + label_len])
+    except ValueError:
+        raise FrameError("标签字典不是合法的JSON")
+    if not isinstance(labels, list) or not all(isinstance(l, str) for l in labels) or len(labels) > 255:
+        raise FrameError("标签字典格式错误")
+    offset += label_len
+    expected = offset + n_rows * sum(np.dtype(RECORD_DTYPES[c]).itemsize for c in LOG_COLUMNS)
+    if len(raw) != expected:
+        raise FrameError(f"负载长度 {len(raw)} 与行数不符 (应为 {expected})")
+
+    arrays = {}
+    for col in LOG_COLUMNS:
+        dtype = np.dtype(RECORD_DTYPES[col])
+        arrays[col] = np.frombuffer(raw, dtype=dtype, count=n_rows, offset=offset)
+        offset += n_rows * dtype.itemsize
+    timestamps = arrays[TIMESTAMP_COLUMN]
+    if timestamps.min() < _MIN_TIMESTAMP or timestamps.max() > _MAX_TIMESTAMP:
+        raise FrameError("时间戳超出合理范围")
+    if len(labels) == 0 or arrays[LABEL_COLUMN].max() >= len(labels):
+        raise FrameError("标签编码超出字典范围")
+    for col in LOG_COLUMNS:
+        if col not in (TIMESTAMP_COLUMN, LABEL_COLUMN) and not np.isfinite(arrays[col]).all():
+            raise FrameError(f"{col} 中有NaN或无穷大")
+    return arrays, labels
+
+
+def host_segments(directory, host):
+    """该主机的全部日志段；按完整文件名匹配，主机名互为前缀 (如 lab 与 lab_2) 时不会混淆"""
+    pattern = re.compile(rf'^system_log_{re.escape(host)}_\d{{8}}{re.escape(SEGMENT_SUFFIX)}$')
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if pattern.match(name))
+
+
+def _day(epoch_ms):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=int(epoch_ms))
+
+
+class HostSink:
+    """
+    一台主机的数据：按天写入 <目录>/system_log_<主机>_<日期>.col 列式日志段 (data_processs.py 可直接发现)，
+    <目录>/<主机>.state.json 记录已确认的最大序号及确认时各段的行数。
+    打开时把各段截断到状态文件中的行数，删去写入后未确认的数据，重传的帧不会重复写入。
+    """
+    def __init__(self, directory, host, fsync=True):
+        self.directory = directory
+        self.host = host
+        self.fsync = fsync
+        self.state_path = os.path.join(directory, f'{host}.state.json')
+        self.state = {'host': host, 'seq': 0, 'rows': {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding='utf-8') as f:
+                self.state = json.load(f)
+        self._writers = {}
+        self.recover()
+
+    def segment_path(self, day):
+        return os.path.join(self.directory, f"system_log_{self.host}_{day.strftime('%Y%m%d')}{SEGMENT_SUFFIX}")
+
+    def recover(self):
+        for path in host_segments(self.directory, self.host):
+            name = os.path.basename(path)
+            if os.path.exists(os.path.join(path, 'schema.json')):
+                truncate_segment(path, self.state['rows'].get(name, 0))
+
+    def append(self, seq, arrays, labels):
+        """写入一帧 (按天拆分)，同步到磁盘后更新状态文件"""
+        timestamps = arrays[TIMESTAMP_COLUMN]
+        days = np.array([_day(t).date() for t in (timestamps.min(), timestamps.max())])
+        if days[0] == days[1]:
+            splits = [(days[0], slice(None))]
+        else:
+            dates = np.array([_day(t).date() for t in timestamps])
+            splits = [(d, dates == d) for d in sorted(set(dates))]
+        touched = []
+        for day, index in splits:
+            path = self.segment_path(day)
+            writer = self._writers.get(path)
+            if writer is None:
+                writer = self._writers[path] = ColumnarWriter(path, flush_rows=1 << 30)
+            writer.write_arrays({col: values[index] for col, values in arrays.items()}, labels)
+            name = os.path.basename(path)
+            self.state['rows'][name] = self.state['rows'].get(name, 0) + len(arrays[TIMESTAMP_COLUMN][index])
+            touched.append(writer)
+        if self.fsync:
+            for writer in touched:
+                for f in writer._files.values():
+                    os.fsync(f.fileno())
+        self.state['seq'] = seq
+        self._save_state()
+
+    def skip(self, seq):
+        """被拒绝的帧不写入数据，只推进已确认的序号，重传时不会再次处理"""
+        self.state['seq'] = seq
+        self._save_state()
+
+    def _save_state(self):
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def close(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+
+class IngestServer:
+    """
+    接收采集端的压缩数据帧，校验后追加到各主机的列式日志段，落盘后逐帧确认。
+    连接建立时采集端发送一行JSON (主机名、列与类型)，服务端回复该主机已确认的最大序号，采集端从下一帧继续发送。
+    每个连接按顺序处理帧，处理完一帧才读取下一帧，写盘跟不上时TCP窗口会让采集端自然减速 (背压)。
+    负载不合法的帧逐帧拒绝 (回复 REJECT_MAGIC 帧头和原因)，连接继续；帧头或序号错误时回复一行JSON错误并断开。
+    同一主机的新连接会顶替旧连接。
+    """
+    def __init__(self, directory=INGEST_DIR, fsync=True):
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self.sinks = {}
+        self._locks = collections.defaultdict(asyncio.Lock)
+        self._active = {}
+        self.rows = 0
+        self.frames = 0
+        self.rejected = 0
+        self.port = None
+        self.ready = None
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        host = None
+        try:
+            hello = json.loads(await reader.readline())
+            host = hello.get('host', '')
+            if not _HOST_PATTERN.match(host):
+                raise FrameError(f"非法的主机名: {host!r}")
+            if hello.get('columns') != LOG_COLUMNS or hello.get('dtypes') != {c: RECORD_DTYPES[c] for c in LOG_COLUMNS}:
+                raise FrameError("列或类型与服务端的schema不一致")
+            previous = self._active.get(host)
+            if previous is not None:
+                previous.close()
+            self._active[host] = writer
+            async with self._locks[host]:
+                sink = self.sinks.get(host)
+                if sink is None:
+                    sink = self.sinks[host] = await loop.run_in_executor(None, HostSink, self.directory, host,
+                                                                         self.fsync)
+                writer.write(json.dumps({'ok': True, 'acked': sink.state['seq']}).encode() + b'\n')
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                magic, seq, length = FRAME_HEADER.unpack(header)
+                if magic != FRAME_MAGIC or length > MAX_FRAME_BYTES:
+                    raise FrameError("帧头错误")
+                payload = await reader.readexactly(length)
+                async with self._locks[host]:
+                    if writer is not self._active.get(host):
+                        break
+                    acked = sink.state['seq']
+                    if seq <= acked:
+                        pass  # 重传的已确认帧，直接确认
+                    elif seq != acked + 1:
+                        raise FrameError(f"序号不连续: 收到 {seq}，应为 {acked + 1}")
+                    else:
+                        try:
+                            arrays, labels = decode_payload(payload)
+                        except FrameError as e:
+                            self.rejected += 1
+                            print(f"Warning: rejected frame {seq} from {host}: {e}")
+                            await loop.run_in_executor(None, sink.skip, seq)
+                            message = str(e).encode()
+                            writer.write(FRAME_HEADER.pack(REJECT_MAGIC, seq, len(message)) + message)
+                            await writer.drain()
+                            continue
+                        await loop.run_in_executor(None, sink.append, seq, arrays, labels)
+                        self.rows += len(arrays[TIMESTAMP_COLUMN])
+                        self.frames += 1
+                writer.write(FRAME_HEADER.pack(FRAME_MAGIC, seq, 0))
+                await writer.drain()
+        except FrameError as e:
+            self.rejected += 1
+            print(f"Warning: rejected data from {host}: {e}")
+            writer.write(json.dumps({'error': str(e)}, ensure_ascii=False).encode() + b'\n')
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            if host is not None and self._active.get(host) is writer:
+                del self._active[host]
+            writer.close()
+
+    async def serve(self, port=DEFAULT_PORT, host='0.0.0.0', stop=None):
+        server = await asyncio.start_server(self._handle, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        async with server:
+            if self.ready is not None:
+                self.ready()
+            if stop is None:
+                await server.serve_forever()
+            else:
+                await stop.wait()
+        for sink in self.sinks.values():
+            sink.close()
+
+
+class IngestClient:
+    """
+    采集端：write() 接口与 log_writer.LogWriter 相同，行在后台线程中按 batch_rows 行或 flush_interval 秒
+    打包为压缩帧发送，最多 max_inflight 帧未确认；断线后按指数退避重连，从服务端确认的位置继续发送。
+    未确认的数据最多保留 max_buffer_rows 行 (约一天)，超过时丢弃最旧的帧并计数；被服务端拒绝的帧丢弃并计入 rejected_rows。
+    """
+    def __init__(self, address, host=None, batch_rows=600, flush_interval=10.0, max_inflight=8,
+                 max_buffer_rows=86_400, retry_max=30.0):
+        host_name, _, port = address.rpartition(':')
+        self.address = (host_name or '127.0.0.1', int(port))
+        self.host = host or re.sub(r'[^A-Za-z0-9_.-]', '_', socket.gethostname())[:64]
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.max_inflight = max_inflight
+        self.max_buffer_rows = max_buffer_rows
+        self.retry_max = retry_max
+        self._queue = queue.SimpleQueue()
+        self._frames = collections.deque()  # [序号 (连接前为None), 行数, 负载]
+        self._buffered_rows = 0
+        self._sock = None
+        self._inflight = 0  # _frames 中已发送未确认的帧数
+        self._next_seq = None
+        self._thread = None
+        self._closing = False
+        self.rows_acked = 0
+        self.dropped_rows = 0
+        self.rejected_rows = 0
+        self.reconnects = 0
+        self.error = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='ingest-client', daemon=True)
+            self._thread.start()
+        return self
+
+    def write(self, row):
+        """放入一行 [timestamp (datetime), 各数据列..., label]，不阻塞调用方"""
+        self._queue.put(row)
+
+    def close(self, timeout=10.0):
+        """发送剩余的行并等待确认，最多等待 timeout 秒"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._closing = True
+        self._thread = None
+        self._disconnect()
+
+    def drop_connection(self):
+        """断开当前连接 (测试断线续传用)"""
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    @property
+    def pending_rows(self):
+        return self._buffered_rows
+
+    # ---------- 后台线程 ----------
+    def _run(self):
+        rows = []
+        next_flush = time.monotonic() + self.flush_interval
+        next_retry = 0.0
+        retry = 0.5
+        stopping = False
+        while not (stopping and not rows and not self._frames) and not self._closing:
+            # 1. 收集行，满一批或到时间就打包
+            try:
+                while len(rows) < self.batch_rows:
+                    row = self._queue.get_nowait()
+                    if row is None:
+                        stopping = True
+                        break
+                    rows.append(row)
+            except queue.Empty:
+                pass
+            now = time.monotonic()
+            if rows and (len(rows) >= self.batch_rows or now >= next_flush or stopping):
+                self._add_frame(rows)
+                rows = []
+                next_flush = now + self.flush_interval
+
+            # 2. 断线时按退避间隔重连
+            if self._sock is None and now >= next_retry and (self._frames or stopping):
+                try:
+                    self._connect()
+                    retry = 0.5
+                except (OSError, ValueError) as e:
+                    self.error = e
+                    next_retry = now + retry
+                    retry = min(retry * 2, self.retry_max)
+
+            # 3. 发送并读取确认
+            if self._sock is not None:
+                try:
+                    self._send_frames()
+                    self._read_acks(timeout=0.05 if not rows or len(rows) < self.batch_rows else 0)
+                except (OSError, ValueError) as e:
+                    self.error = e
+                    self._disconnect()
+                    next_retry = time.monotonic() + retry
+            elif self._queue.empty():
+                time.sleep(0.05)
+
+    def _add_frame(self, rows):
+        self._frames.append([None, len(rows), encode_rows(rows)])
+        self._buffered_rows += len(rows)
+        # 丢弃不在发送途中的最旧帧
+        while self._buffered_rows > self.max_buffer_rows and len(self._frames) > self._inflight + 1:
+            _, n, _ = self._frames[self._inflight]
+            del self._frames[self._inflight]
+            self._buffered_rows -= n
+            self.dropped_rows += n
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=5)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        hello = {'protocol': PROTOCOL_VERSION, 'host': self.host, 'columns': LOG_COLUMNS,
+                 'dtypes': {c: RECORD_DTYPES[c] for c in LOG_COLUMNS}}
+        sock.sendall(json.dumps(hello).encode() + b'\n')
+        reply = json.loads(sock.makefile('rb').readline() or b'{}')
+        if not reply.get('ok'):
+            sock.close()
+            raise ValueError(f"ingest server rejected connection: {reply.get('error')}")
+        acked = reply['acked']
+        # 丢掉已确认的帧，其余在发送时接着服务端的序号重新编号
+        while self._frames and self._frames[0][0] is not None and self._frames[0][0] <= acked:
+            self._ack_front()
+        for frame in self._frames:
+            frame[0] = None
+        self._next_seq = acked + 1
+        sock.setblocking(False)
+        self._sock = sock
+        self._recv_buffer = b''
+        self._send_buffer = b''
+        self._inflight = 0
+        if self.reconnects or acked:
+            print(f"Ingest: connected to {self.address[0]}:{self.address[1]}, resuming after frame {acked}")
+        self.reconnects += 1
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._inflight = 0
+
+    def _ack_front(self):
+        _, n, _ = self._frames.popleft()
+        self._buffered_rows -= n
+        self.rows_acked += n
+
+    def _send_frames(self):
+        while self._inflight < min(self.max_inflight, len(self._frames)) and len(self._send_buffer) < (1 << 20):
+            frame = self._frames[self._inflight]
+            if frame[0] is None:
+                frame[0] = self._next_seq
+                self._next_seq += 1
+            self._send_buffer += FRAME_HEADER.pack(FRAME_MAGIC, frame[0], len(frame[2])) + frame[2]
+            self._inflight += 1
+        if self._send_buffer:
+            try:
+                sent = self._sock.send(self._send_buffer)
+                self._send_buffer = self._send_buffer[sent:]
+            except BlockingIOError:
+                pass
+
+    def _read_acks(self, timeout):
+        readable, writable, _ = select.select([self._sock], [self._sock] if self._send_buffer else [], [], timeout)
+        if not readable:
+            return
+        data = self._sock.recv(1 << 16)
+        if not data:
+            raise ConnectionError("ingest server closed the connection")
+        self._recv_buffer += data
+        while len(self._recv_buffer) >= FRAME_HEADER.size:
+            magic, seq, length = FRAME_HEADER.unpack_from(self._recv_buffer)
+            if magic == REJECT_MAGIC:
+                if len(self._recv_buffer) < FRAME_HEADER.size + length:
+                    break
+                reason = self._recv_buffer[FRAME_HEADER.size:FRAME_HEADER.size + length].decode('utf-8', 'replace')
+                self._recv_buffer = self._recv_buffer[FRAME_HEADER.size + length:]
+                self._ack_through(seq - 1)
+                if self._frames and self._frames[0][0] == seq:
+                    # 重发也不会被接受，丢弃该帧，后面的帧照常确认
+                    _, n, _ = self._frames.popleft()
+                    self._buffered_rows -= n
+                    self.rejected_rows += n
+                    self._inflight = max(self._inflight - 1, 0)
+                    print(f"Warning: ingest server rejected frame {seq} ({n} rows): {reason}")
+            elif magic == FRAME_MAGIC:
+                self._recv_buffer = self._recv_buffer[FRAME_HEADER.size:]
+                self._ack_through(seq)
+            else:
+                raise ValueError(f"ingest server error: {self._recv_buffer.decode('utf-8', 'replace').strip()}")
+
+    def _ack_through(self, seq):
+        while self._frames and self._frames[0][0] is not None and self._frames[0][0] <= seq:
+            self._ack_front()
+            self._inflight = max(self._inflight - 1, 0)
+
+
+# ---------- 本机模拟部署 ----------
+def _server_process(directory, port, fsync, conn):
+    server = IngestServer(directory, fsync)
+    server.ready = lambda: conn.send(server.port)
+    asyncio.run(server.serve(port, '127.0.0.1'))
+
+
+def start_server_process(directory, port=0, fsync=True):
+    """在子进程中运行服务端，返回 (进程, 端口)"""
+    import multiprocessing
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_server_process, args=(directory, port, fsync, child), daemon=True)
+    process.start()
+    return process, parent.recv()
+
+
+def synthetic_rows(host_index, start, n, start_time=datetime.datetime(2025, 9, 30, 23, 0, 0)):
+    """第 host_index 台主机的第 start..start+n 行：每秒一行，mouse_distance 列为行号，便于检查丢失与重复"""
+    rows = []
+    labels = ('coding', 'gaming', 'idle', 'video')
+    for i in range(start, start + n):
+        values = dict.fromkeys(LOG_COLUMNS[1:-1], 0.0)
+        values.update(mouse_distance=float(i), cpu_percent=float(host_index), keyboard_counts=float(i % 97))
+        rows.append([start_time + datetime.timedelta(seconds=i)] + list(values.values()) + [labels[(i // 600) % 4]])
+    return rows
+
+
+def simulate(n_collectors=8, rows_per_collector=50_000, batch_rows=1000, fsync=True, disconnect_every=0,
+             restart_server_at=None, directory=None, timeout=300):
+    """
+    本机模拟部署：服务端子进程 + n_collectors 个采集端线程，每个采集端尽快发送 rows_per_collector 行。
+    disconnect_every 行时主动断线一次；restart_server_at 为 (0-1) 进度时强杀并重启服务端。
+    返回 (每秒入库行数, 目录, 各采集端统计)
+    """
+    import tempfile
+    directory = directory or tempfile.mkdtemp(prefix='ingest_')
+    process, port = start_server_process(directory, 0, fsync)
+    clients = [IngestClient(f'127.0.0.1:{port}', host=f'host{i:03d}', batch_rows=batch_rows, flush_interval=0.2,
+                            max_buffer_rows=rows_per_collector, retry_max=0.5).start()
+               for i in range(n_collectors)]
+    chunk = batch_rows
+    start = time.perf_counter()
+    restarted = False
+    for offset in range(0, rows_per_collector, chunk):
+        n = min(chunk, rows_per_collector - offset)
+        for i, client in enumerate(clients):
+            for row in synthetic_rows(i, offset, n):
+                client.write(row)
+            if disconnect_every and offset and offset % disconnect_every == 0:
+                client.drop_connection()
+        # 简单的背压：未确认的数据过多时等待
+        while sum(c.pending_rows for c in clients) > n_collectors * batch_rows * 8:
+            time.sleep(0.005)
+        if restart_server_at is not None and not restarted and offset >= rows_per_collector * restart_server_at:
+            process.kill()
+            process.join()
+            process, _ = start_server_process(directory, port, fsync)
+            restarted = True
+    for client in clients:
+        client.close(timeout)
+    elapsed = time.perf_counter() - start
+    process.kill()
+    process.join()
+    total = sum(c.rows_acked for c in clients)
+    stats = [{'host': c.host, 'acked': c.rows_acked, 'dropped': c.dropped_rows, 'rejected': c.rejected_rows,
+              'reconnects': c.reconnects, 'pending': c.pending_rows} for c in clients]
+    return total / elapsed, directory, stats
+
+
+def check_rejected_frame(directory):
+    """含NaN的帧被逐帧拒绝并丢弃，之后的帧照常确认；帧内时间戳倒退 (时钟回拨) 的帧照常入库"""
+    from columnar_log import read_log
+    bad = synthetic_rows(0, 50, 50)
+    bad[10][2] = float('nan')
+    try:
+        decode_payload(encode_rows(bad))
+        raise AssertionError("含NaN的帧没有被拒绝")
+    except FrameError:
+        pass
+    process, port = start_server_process(directory, 0, fsync=False)
+    try:
+        client = IngestClient(f'127.0.0.1:{port}', host='clock', batch_rows=50, flush_interval=60, retry_max=0.5)
+        for row in synthetic_rows(0, 0, 50) + bad + synthetic_rows(0, 100, 50)[::-1]:
+            client.write(row)
+        client.start().close()
+        assert (client.rows_acked, client.rejected_rows, client.pending_rows) == (100, 50, 0), \
+            (client.rows_acked, client.rejected_rows, client.pending_rows)
+        assert client.reconnects == 1, "被拒绝的帧导致了重连"
+    finally:
+        process.kill()
+        process.join()
+    values = np.concatenate([read_log(p)['mouse_distance'].to_numpy() for p in host_segments(directory, 'clock')])
+    assert sorted(values) == list(range(50)) + list(range(100, 150)), "入库的数据与发送的不一致"
+
+
+def check_ingest(n_collectors=4, rows_per_collector=20_000):
+    """断线与服务端被强杀重启后，每台主机入库的数据与发送的完全一致 (不丢、不重、按天分段)"""
+    import shutil
+    from columnar_log import read_log
+    rate, directory, stats = simulate(n_collectors, rows_per_collector, batch_rows=500, fsync=True,
+                                      disconnect_every=5000, restart_server_at=0.5)
+    try:
+        for i, s in enumerate(stats):
+            assert s['acked'] == rows_per_collector and s['dropped'] == s['rejected'] == s['pending'] == 0, s
+            segments = host_segments(directory, s['host'])
+            assert len(segments) == 2, f"应按天分为2段: {segments}"
+            import pandas as pd
+            df = pd.concat([read_log(p) for p in segments], ignore_index=True)
+            expected = np.arange(rows_per_collector, dtype=np.float32)
+            assert np.array_equal(df['mouse_distance'].to_numpy(), expected), f"{s['host']} 的数据有丢失或重复"
+            assert (df['cpu_percent'] == i).all() and df['timestamp'].is_monotonic_increasing
+        # 主机名互为前缀时，打开一台主机不会截断另一台主机的段
+        sink = HostSink(directory, 'lab_2', fsync=False)
+        sink.append(1, *decode_payload(encode_rows(synthetic_rows(0, 0, 50))))
+        sink.close()
+        HostSink(directory, 'lab', fsync=False).close()
+        assert [len(read_log(p)) for p in host_segments(directory, 'lab_2')] == [50], "其他主机的段被截断"
+        assert host_segments(directory, 'lab') == []
+        check_rejected_frame(os.path.join(directory, 'rejected'))
+        print(f"入库检查通过: {n_collectors} 台主机 x {rows_per_collector} 行, 经过断线与服务端重启后无丢失无重复, "
+              f"{rate:,.0f} 行/秒, 重连次数 {[s['reconnects'] for s in stats]}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="集中入库服务：接收多台采集端的压缩数据帧，按主机和日期写入列式日志段")
+    sub = parser.add_subparsers(dest='command')
+    serve = sub.add_parser('serve', help="运行入库服务端")
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve.add_argument('--host', default='0.0.0.0', help="监听地址")
+    serve.add_argument('--dir', default=INGEST_DIR, help="写入目录")
+    serve.add_argument('--no-fsync', action='store_true', help="确认前不调用fsync (更快，但断电时可能丢失已确认的数据)")
+    sim = sub.add_parser('simulate', help="本机运行服务端和N个模拟采集端，测量持续入库速率")
+    sim.add_argument('--collectors', type=int, default=8)
+    sim.add_argument('--rows', type=int, default=50_000, help="每个采集端发送的行数")
+    sim.add_argument('--batch-rows', type=int, default=1000)
+    sim.add_argument('--no-fsync', action='store_true')
+    sim.add_argument('--disconnect-every', type=int, default=0, help="每隔这么多行主动断线一次")
+    parser.add_argument('--check', action='store_true', help="运行断线续传与服务端重启检查")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        check_ingest()
+    elif args.command == 'serve':
+        server = IngestServer(args.dir, fsync=not args.no_fsync)
+        print(f"Ingest server writing to '{args.dir}', listening on {args.host}:{args.port}")
+        try:
+            asyncio.run(server.serve(args.port, args.host))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'simulate':
+        import shutil
+        rate, directory, stats = simulate(args.collectors, args.rows, args.batch_rows, not args.no_fsync,
+                                          args.disconnect_every)
+        shutil.rmtree(directory, ignore_errors=True)
+        print(f"{args.collectors} 个采集端 x {args.rows} 行 (每帧 {args.batch_rows} 行, "
+              f"{'不' if args.no_fsync else ''}fsync): {rate:,.0f} 行/秒入库, "
+              f"重连 {sum(s['reconnects'] for s in stats) - len(stats)} 次, 丢弃 {sum(s['dropped'] for s in stats)} 行")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import math
+import threading
+import time
+
+
+class _MouseCounters:
+    """只由鼠标监听线程写入的累计计数"""
+    __slots__ = ('left_clicks', 'right_clicks', 'scroll_amount', 'distance',
+                 'last_x', 'last_y', 'last_move_time', 'path_tick')
+
+    def __init__(self):
+        self.left_clicks = 0
+        self.right_clicks = 0
+        self.scroll_amount = 0
+        self.distance = 0.0
+        self.last_x = 0
+        self.last_y = 0
+        self.last_move_time = 0
+        self.path_tick = -1
+
+
+class _KeyboardCounters:
+    """只由键盘监听线程写入的累计计数"""
+    __slots__ = ('key_presses',)
+
+    def __init__(self):
+        self.key_presses = 0
+
+
+class InputAggregator:
+    """
+    无锁的用户输入聚合器。
+    每个监听线程只写自己的一组累计计数 (单写者)，回调中不加锁、不保存坐标点，鼠标距离在回调里增量累加。
+    采样线程在tick边界读取累计值并与上一次的快照相减得到本周期的增量，同时推进tick序号：
+    监听线程看到新的tick序号后从新的起点开始累计距离，与原先每周期清空 mouse_locations 的语义一致。
+    读取时尚未写入的事件会自然计入下一个周期，不会丢失。
+    """
+    def __init__(self, throttle_time=0.1):
+        self.throttle_time = throttle_time  # 鼠标移动事件节流
+        self._mouse = _MouseCounters()
+        self._keyboard = _KeyboardCounters()
+        self._tick = 0
+        self._snapshot = (0.0, 0, 0, 0, 0)
+
+    # ---------- 监听线程回调 ----------
+    def on_click(self, x, y, button, pressed):
+        if pressed:
+            name = getattr(button, 'name', button)
+            if name == 'left':
+                self._mouse.left_clicks += 1
+            elif name == 'right':
+                self._mouse.right_clicks += 1
+
+    def on_move(self, x, y):
+        m = self._mouse
+        current_time = time.time()
+        if current_time - m.last_move_time < self.throttle_time:
+            return
+        m.last_move_time = current_time
+        tick = self._tick
+        if m.path_tick == tick:
+            m.distance += math.hypot(x - m.last_x, y - m.last_y)
+        else:
+            m.path_tick = tick
+        m.last_x = x
+        m.last_y = y
+
+    def on_scroll(self, x, y, dx, dy):
+        self._mouse.scroll_amount += abs(dy)
+
+    def on_press(self, key):
+        self._keyboard.key_presses += 1
+
+    # ---------- 采样线程 ----------
+    def get_and_reset(self):
+        """返回本周期的 (鼠标移动距离, 左键, 右键, 滚轮, 键盘) 并开始新的周期"""
+        m, k = self._mouse, self._keyboard
+        current = (m.distance, m.left_clicks, m.right_clicks, m.scroll_amount, k.key_presses)
+        self._tick += 1
+        previous, self._snapshot = self._snapshot, current
+        return [c - p for c, p in zip(current, previous)]
+
+    def reset(self):
+        """丢弃当前周期已累计的输入"""
+        self.get_and_reset()
+
+
+class LockedInputAggregator:
+    """原 Recorder 中加锁并保存全部坐标点的实现，仅用于压力测试对比"""
+    def __init__(self, throttle_time=0.1):
+        self.throttle_time = throttle_time
+        self.data_lock = threading.Lock()
+        self.last_move_time = 0
+        self.mouse_locations = []
+        self.mouse_left_clicks = 0
+        self.mouse_right_clicks = 0
+        self.mouse_scroll_amount = 0
+        self.keyboard_counts = 0
+
+    def on_click(self, x, y, button, pressed):
+        if pressed:
+            with self.data_lock:
+                name = getattr(button, 'name', button)
+                if name == 'left':
+                    self.mouse_left_clicks += 1
+                elif name == 'right':
+                    self.mouse_right_clicks += 1
+
+    def on_move(self, x, y):
+        current_time = time.time()
+        if current_time - self.last_move_time < self.throttle_time:
+            return
+        self.last_move_time = current_time
+        with self.data_lock:
+            self.mouse_locations.append((x, y))
+
+    def on_scroll(self, x, y, dx, dy):
+        with self.data_lock:
+            self.mouse_scroll_amount += abs(dy)
+
+    def on_press(self, key):
+        with self.data_lock:
+            self.keyboard_counts += 1
+
+    def get_and_reset(self):
+        with self.data_lock:
+            mouse_distance_sum = sum(((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)**0.5 for p1, p2 in zip(self.mouse_locations, self.mouse_locations[1:]))
+            result = [mouse_distance_sum, self.mouse_left_clicks, self.mouse_right_clicks,
+                      self.mouse_scroll_amount, self.keyboard_counts]
+            self.mouse_locations.clear()
+            self.mouse_left_clicks = 0
+            self.mouse_right_clicks = 0
+            self.mouse_scroll_amount = 0
+            self.keyboard_counts = 0
+        return result
+
+
+def stress_benchmark(events_per_thread=200_000, tick_interval=0.001, throttle_time=0.0):
+    """
+    用两个线程模拟鼠标(移动/点击/滚轮)和键盘监听器高速注入事件，同时采样线程按 tick_interval 取数，
+    统计回调耗时分布，并校验所有事件都被计入。throttle_time=0 时相当于不节流的1000Hz以上鼠标。
+    """
+    class _Button:
+        def __init__(self, name):
+            self.name = name
+    left, right = _Button('left'), _Button('right')
+
+    def percentile(values, q):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    for name, aggregator in (('lock-free', InputAggregator(throttle_time)),
+                             ('locked', LockedInputAggregator(throttle_time))):
+        latencies = {'mouse': [], 'keyboard': []}
+        totals = [0.0, 0, 0, 0, 0]
+        stop = threading.Event()
+
+        def mouse_thread():
+            samples = latencies['mouse']
+            clock = time.perf_counter
+            for i in range(events_per_thread):
+                start = clock()
+                kind = i % 8
+                if kind == 0:
+                    aggregator.on_click(0, 0, left if i % 16 else right, True)
+                elif kind == 1:
+                    aggregator.on_scroll(0, 0, 0, -1)
+                else:
+                    aggregator.on_move(i % 1920, (i * 7) % 1080)
+                samples.append(clock() - start)
+
+        def keyboard_thread():
+            samples = latencies['keyboard']
+            clock = time.perf_counter
+            for i in range(events_per_thread // 4):
+                start = clock()
+                aggregator.on_press(None)
+                samples.append(clock() - start)
+
+        def sampler_thread():
+            while not stop.is_set():
+                for i, value in enumerate(aggregator.get_and_reset()):
+                    totals[i] += value
+                time.sleep(tick_interval)
+
+        workers = [threading.Thread(target=mouse_thread), threading.Thread(target=keyboard_thread)]
+        sampler = threading.Thread(target=sampler_thread)
+        start = time.perf_counter()
+        sampler.start()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler.join()
+        for i, value in enumerate(aggregator.get_and_reset()):
+            totals[i] += value
+
+        expected_clicks = events_per_thread // 8
+        assert totals[1] + totals[2] == expected_clicks, f"{name}: 点击数丢失 {totals[1] + totals[2]} != {expected_clicks}"
+        assert totals[4] == events_per_thread // 4, f"{name}: 按键数丢失"
+        rate = (events_per_thread + events_per_thread // 4) / elapsed
+        for source, samples in latencies.items():
+            print(f"{name:9s} {source:8s}: p50 {percentile(samples, 0.5) * 1e6:6.2f} us, "
+                  f"p99 {percentile(samples, 0.99) * 1e6:6.2f} us, max {max(samples) * 1e6:8.1f} us")
+        print(f"{name:9s} 事件注入速率 {rate / 1000:.0f}k/s")
+
+
+if __name__ == "__main__":
+    stress_benchmark()
@@ -0,0 +1,397 @@
+import csv
+import datetime
+import glob
+import gzip
+import io
+import os
+import queue
+import shutil
+import threading
+import time
+
+from columnar_log import LOG_COLUMNS, SEGMENT_SUFFIX, ColumnarWriter, truncate_segment
+
+# 正在写入的日志段旁边放一个同名的标记文件，正常关闭 (及压缩) 后删除；启动时只恢复带标记的段
+OPEN_MARKER = '.open'
+
+
+class _CsvSegment:
+    """一个CSV日志段：新建时写入表头，每次同步时写入缓存的行并fsync"""
+    suffix = '.csv'
+
+    def __init__(self, path, columns):
+        self.path = path
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        if not exists:
+            self.writer.writerow(columns)
+
+    def write_rows(self, rows):
+        for row in rows:
+            timestamp = row[0]
+            if isinstance(timestamp, datetime.datetime):
+                timestamp = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+            self.writer.writerow([timestamp] + list(row[1:]))
+
+    def sync(self, fsync):
+        self.file.flush()
+        if fsync:
+            os.fsync(self.file.fileno())
+
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def recover(path):
+        """截掉崩溃时写了一半的最后一行，返回截掉的字节数"""
+        with open(path, 'rb+') as f:
+            size = f.seek(0, io.SEEK_END)
+            if size == 0:
+                return 0
+            # 从末尾向前找到最后一个换行符
+            block = 4096
+            pos = size
+            while pos > 0:
+                start = max(pos - block, 0)
+                f.seek(start)
+                chunk = f.read(pos - start)
+                newline = chunk.rfind(b'\n')
+                if newline >= 0:
+                    keep = start + newline + 1
+                    break
+                pos = start
+            else:
+                keep = 0
+            if keep != size:
+                f.truncate(keep)
+            return size - keep
+
+
+class _ColumnarSegment:
+    """一个列式日志段 (见 columnar_log.py)，每次同步时按列写出缓存的行并fsync各列文件"""
+    suffix = SEGMENT_SUFFIX
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.writer = ColumnarWriter(path, columns=columns, flush_rows=1 << 30)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.writer.writerow(row)
+
+    def sync(self, fsync):
+        self.writer.flush()
+        if fsync:
+            for f in self.writer._files.values():
+                os.fsync(f.fileno())
+
+    def size(self):
+        return sum(f.tell() for f in self.writer._files.values())
+
+    def close(self):
+        self.writer.close()
+
+    @staticmethod
+    def recover(path):
+        truncate_segment(path)
+        return 0
+
+
+SEGMENT_FORMATS = {'csv': _CsvSegment, 'columnar': _ColumnarSegment}
+
+
+class LogWriter:
+    """
+    长时间记录用的后台日志写入线程。
+    write() 只把行放入队列；后台线程每隔 flush_interval 秒把积累的行批量写入当前日志段并 flush/fsync，
+    因此进程被强行结束时最多丢失最近 flush_interval 秒的数据。
+    日志段超过 max_bytes 或跨天时轮转，关闭的CSV段可选用gzip压缩。
+    启动时先恢复上次异常退出留下的日志段：截掉写了一半的行，补做未完成的压缩。
+    只处理本类创建时留下 .open 标记的段，目录中其他的日志 (如手工采集的训练数据) 不会被改动。
+    """
+    def __init__(self, directory, prefix='system_log', fmt='csv', columns=LOG_COLUMNS,
+                 flush_interval=1.0, fsync=True, max_bytes=64 << 20, rotate_daily=True, compress=False):
+        if fmt not in SEGMENT_FORMATS:
+            raise ValueError(f"未知的日志格式: {fmt}")
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_type = SEGMENT_FORMATS[fmt]
+        self.columns = list(columns)
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress and fmt == 'csv'  # 列式日志段本身已是紧凑的二进制，不再压缩
+        if compress and not self.compress:
+            print("Warning: compression is only applied to csv segments")
+
+        self._queue = queue.SimpleQueue()
+        self._segment = None
+        self._segment_day = None
+        self._thread = None
+        self.rows_written = 0
+        self.segments = []  # 本次运行写过的日志段 (压缩后为.gz路径)
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        if self._thread is not None:
+            return self
+        self.recover()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+        return self
+
+    def write(self, row):
+        """放入一行 [timestamp (datetime), 各数据列..., label]，不阻塞调用方"""
+        self._queue.put(row)
+
+    def close(self):
+        """写完队列中剩余的行并关闭当前日志段"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    # ---------- 崩溃恢复 ----------
+    def _pattern(self, suffix):
+        return os.path.join(self.directory, f'{self.prefix}_*{suffix}')
+
+    def recover(self):
+        """处理上次异常退出遗留的日志段 (带 .open 标记的段)，返回恢复过的段路径"""
+        recovered = []
+        for marker in sorted(glob.glob(self._pattern(self.segment_type.suffix + OPEN_MARKER))):
+            path = marker[:-len(OPEN_MARKER)]
+            # 压缩中途退出：原文件仍在，删除不完整的压缩文件后重新压缩
+            if os.path.exists(path + '.gz.tmp'):
+                os.remove(path + '.gz.tmp')
+            if os.path.exists(path):
+                dropped = self.segment_type.recover(path)
+                if dropped:
+                    print(f"Warning: dropped {dropped} bytes of partial row at the end of {path}")
+                recovered.append(path)
+                if self.compress:
+                    self._compress(path)
+            os.remove(marker)
+        return recovered
+
+    # ---------- 后台线程 ----------
+    def _run(self):
+        pending = []
+        next_flush = time.monotonic() + self.flush_interval
+        stopping = False
+        while not stopping:
+            timeout = next_flush - time.monotonic()
+            try:
+                row = self._queue.get(timeout=max(timeout, 0))
+                if row is None:
+                    stopping = True
+                else:
+                    pending.append(row)
+                    continue
+            except queue.Empty:
+                pass
+            # 到达同步时刻或收到关闭信号：一次性写入积累的行
+            while True:
+                try:
+                    row = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                else:
+                    pending.append(row)
+            try:
+                self._write_batch(pending)
+            except OSError as e:
+                # 写入失败时未写入的行留在pending中，下个周期重试
+                self.error = e
+                print(f"Error writing log segment: {e}")
+            next_flush = time.monotonic() + self.flush_interval
+        self._close_segment()
+
+    def _write_batch(self, rows):
+        """写入rows，已写入的行从rows中移除"""
+        while rows:
+            day = self._day(rows[0])
+            # 跨天时轮转
+            if self.rotate_daily and self._segment is not None and day != self._segment_day:
+                self._close_segment()
+            if self._segment is None:
+                self._open_segment(day)
+            n = 1
+            while n < len(rows) and not (self.rotate_daily and self._day(rows[n]) != day):
+                n += 1
+            self._flush_rows(rows[:n])
+            del rows[:n]
+        if self._segment is not None and self._segment.size() >= self.max_bytes:
+            self._close_segment()
+
+    def _flush_rows(self, rows):
+        self._segment.write_rows(rows)
+        self._segment.sync(self.fsync)
+        self.rows_written += len(rows)
+
+    @staticmethod
+    def _day(row):
+        timestamp = row[0]
+        return timestamp.date() if isinstance(timestamp, datetime.datetime) else None
+
+    def _open_segment(self, day):
+        now = datetime.datetime.now()
+        base = os.path.join(self.directory, f"{self.prefix}_{now.strftime('%Y%m%d_%H%M%S')}")
+        path, seq = base + self.segment_type.suffix, 1
+        while os.path.exists(path) or os.path.exists(path + '.gz'):
+            path = f'{base}_{seq}{self.segment_type.suffix}'
+            seq += 1
+        with open(path + OPEN_MARKER, 'w') as marker:
+            if self.fsync:
+                os.fsync(marker.fileno())
+        self._segment = self.segment_type(path, self.columns)
+        self._segment_day = day
+        self.segments.append(path)
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+        self._segment.sync(self.fsync)
+        self._segment.close()
+        path, self._segment = self._segment.path, None
+        if self.compress:
+            self.segments[self.segments.index(path)] = self._compress(path)
+        os.remove(path + OPEN_MARKER)
+
+    def _compress(self, path):
+        """gzip压缩一个已关闭的CSV段：先写临时文件并fsync，再替换，最后删除原文件"""
+        gz_path = path + '.gz'
+        tmp_path = gz_path + '.tmp'
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as raw:
+            with gzip.GzipFile(filename=os.path.basename(path), mode='wb', fileobj=raw) as dst:
+                shutil.copyfileobj(src, dst)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, gz_path)
+        os.remove(path)
+        return gz_path
+
+
+# ---------- 强杀测试 ----------
+def _kill_test_child(directory, flush_interval, max_bytes, rate):
+    """子进程：以固定速率写入带序号和写入时刻的行，直到被强行结束"""
+    writer = LogWriter(directory, flush_interval=flush_interval, max_bytes=max_bytes, compress=True).start()
+    width = len(LOG_COLUMNS) - 3
+    seq = 0
+    print('ready', flush=True)
+    next_row = time.monotonic()
+    while True:
+        # mouse_distance 列存序号，mouse_left_click 列存 time.time()
+        writer.write([datetime.datetime.now(), seq, repr(time.time())] + [0] * (width - 1) + ['coding'])
+        seq += 1
+        next_row += 1 / rate
+        time.sleep(max(next_row - time.monotonic(), 0))
+
+
+def _read_rows(directory):
+    import pandas as pd
+    frames = [pd.read_csv(p) for p in sorted(glob.glob(os.path.join(directory, 'system_log_*.csv*')))]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=LOG_COLUMNS)
+
+
+def check_recover_partial():
+    """最后一行写了一半的CSV段和各列行数不齐的列式段，恢复后都只保留完整的行"""
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt in ('csv', 'columnar'):
+            writer = LogWriter(directory, fmt=fmt, flush_interval=0.01).start()
+            for i in range(5):
+                writer.write([datetime.datetime(2025, 9, 24, 10, 0, i), i] + [0] * (len(LOG_COLUMNS) - 3) + ['idle'])
+            writer.close()
+            path = writer.segments[-1]
+            open(path + OPEN_MARKER, 'w').close()  # 模拟写入途中异常退出
+            if fmt == 'csv':
+                with open(path, 'a') as f:
+                    f.write('2025-09-24 10:00:05,5,0,0')
+            else:
+                with open(os.path.join(path, 'mouse_distance.bin'), 'ab') as f:
+                    f.write(b'\x00' * 4)
+            writer.recover()
+            from columnar_log import read_log
+            df = read_log(path)
+            assert len(df) == 5 and list(df['mouse_distance']) == [0, 1, 2, 3, 4], f"{fmt}: 恢复结果不正确"
+            assert not os.path.exists(path + OPEN_MARKER)
+    return True
+
+
+def check_foreign_files():
+    """目录中不是本类写入的日志 (如手工采集的 system_log_9_22.csv，最后一行不完整) 在恢复和压缩时原样保留"""
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'system_log_9_22.csv')
+        content = b','.join(col.encode() for col in LOG_COLUMNS) + b'\n2025-09-22 10:00:00,1,2'
+        with open(path, 'wb') as f:
+            f.write(content)
+        writer = LogWriter(directory, compress=True, flush_interval=0.01).start()
+        writer.write([datetime.datetime(2025, 9, 24, 10, 0, 0), 0] + [0] * (len(LOG_COLUMNS) - 3) + ['idle'])
+        writer.close()
+        with open(path, 'rb') as f:
+            assert f.read() == content, "已有的日志被改动"
+        assert not os.path.exists(path + '.gz')
+        assert writer.recover() == [] and not glob.glob(os.path.join(directory, '*' + OPEN_MARKER))
+    return True
+
+
+def kill_test(rounds=3, flush_interval=0.2, rate=200, max_bytes=16 << 10, run_seconds=1.5):
+    """
+    反复启动写入子进程并在随机时刻用SIGKILL结束它，然后恢复并检查：
+    已落盘的行连续无缺口、没有残缺行，且丢失的数据不超过 flush_interval (留出调度余量)。
+    """
+    import random
+    import signal
+    import subprocess
+    import sys
+    import tempfile
+    slack = 0.1
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(rounds):
+            child = subprocess.Popen(
+                [sys.executable, '-c',
+                 f"import log_writer; log_writer._kill_test_child({directory!r}, {flush_interval}, {max_bytes}, {rate})"],
+                cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.PIPE)
+            assert child.stdout.readline().strip() == b'ready'
+            time.sleep(run_seconds * random.uniform(0.5, 1.0))
+            kill_time = time.time()
+            child.send_signal(signal.SIGKILL)
+            child.wait()
+
+            # 下一次启动时的恢复：截掉残缺行、压缩已结束的段
+            writer = LogWriter(directory, compress=True)
+            writer.recover()
+            df = _read_rows(directory)
+            run = df[df['mouse_distance'].diff().fillna(1) <= 0].index
+            # 每轮的序号都从0开始，取最后一轮
+            last_run = df.iloc[run[-1]:] if len(run) else df
+            seqs = last_run['mouse_distance'].to_numpy()
+            assert (seqs == range(len(seqs))).all(), "落盘的行有缺口"
+            lag = kill_time - float(last_run['mouse_left_click'].iloc[-1])
+            assert lag <= flush_interval + slack, f"丢失了 {lag:.3f}s 的数据 (> {flush_interval}s)"
+            results.append((len(seqs), lag))
+        segments = len(glob.glob(os.path.join(directory, '*.csv.gz')))
+    return results, segments
+
+
+if __name__ == "__main__":
+    check_recover_partial()
+    print("残缺行恢复校验通过")
+    check_foreign_files()
+    print("已有日志未被改动")
+    results, segments = kill_test()
+    for i, (rows, lag) in enumerate(results):
+        print(f"第{i + 1}轮: 落盘 {rows} 行, 丢失最近 {lag * 1000:.0f}ms 的数据")
+    print(f"强杀测试通过 (共 {segments} 个压缩段)")
@@ -0,0 +1,355 @@
+import http.server
+import json
+import os
+import threading
+import time
+
+# 每个2的幂区间划分为 2**SUB_BUCKET_BITS 个等宽子桶，相对误差不超过 1/32
+SUB_BUCKET_BITS = 5
+_SUB = 1 << SUB_BUCKET_BITS
+# 以纳秒记录，最大约 2**40 ns (约18分钟)，更大的值计入最后一个桶
+_MAX_BITS = 40
+N_BUCKETS = (_MAX_BITS - SUB_BUCKET_BITS) * _SUB + _SUB
+# Prometheus 导出的桶上界 (秒)
+EXPORT_BOUNDS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PREFIX = 'digit_spirit'
+DEFAULT_DUMP_INTERVAL = 60.0
+
+
+def bucket_index(ns):
+    """纳秒值所在的桶：小于 2*_SUB 的值每个整数一个桶，之后每个2的幂区间 _SUB 个桶"""
+    if ns < 2 * _SUB:
+        return max(ns, 0)
+    shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+    return min(shift * _SUB + (ns >> shift), N_BUCKETS - 1)
+
+
+def bucket_bounds(index):
+    """桶 index 覆盖的纳秒范围 [lower, upper)"""
+    if index < 2 * _SUB:
+        return index, index + 1
+    shift = index // _SUB - 1
+    lower = (index % _SUB + _SUB) << shift
+    return lower, lower + (1 << shift)
+
+
+class Histogram:
+    """
+    HDR风格的对数-线性直方图，固定 N_BUCKETS 个计数，内存与记录次数无关，记录一次为O(1)。
+    每个直方图只应由一个线程写入 (流水线线程或UI线程)，读取方拿到的是近似一致的快照。
+    """
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bucket_index(int(seconds * 1e9))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """分位数 (秒)，取所在桶的中点，不超过最大值"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                lower, upper = bucket_bounds(index)
+                return min((lower + upper) / 2e9, self.max)
+        return self.max
+
+    def cumulative(self, bounds=EXPORT_BOUNDS):
+        """每个上界 (秒) 以下的累计次数；跨越上界的桶按其下界归类"""
+        out = []
+        counts = list(self.counts)
+        index = seen = 0
+        for bound in bounds:
+            limit = bound * 1e9
+            while index < N_BUCKETS and bucket_bounds(index)[0] < limit:
+                seen += counts[index]
+                index += 1
+            out.append(seen)
+        return out
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.quantile(0.5) * 1000,
+            'p90_ms': self.quantile(0.9) * 1000,
+            'p99_ms': self.quantile(0.99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class Metrics:
+    """
+    监控程序自身的性能指标：各阶段耗时直方图、计数器 (tick、丢弃/延迟的tick等)，
+    以及抓取时才读取的采集函数 (本进程的CPU与内存、采集项超时次数等)。
+    serve() 在本机端口上以 Prometheus 文本格式提供 /metrics (/metrics.json 为JSON)，start_dump() 定期写出JSON。
+    """
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = [process_stats]
+        self.started = time.time()
+        self._server = None
+        self._dump_stop = threading.Event()
+        self._dump_thread = None
+        self._last_cpu = None
+
+    # ---------- 热路径 ----------
+    def observe(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms.setdefault(stage, Histogram())
+        histogram.record(seconds)
+
+    def lap(self, stage, start):
+        """记录 start 至今的耗时，返回当前时刻，便于连续计时多个阶段"""
+        now = time.perf_counter()
+        self.observe(stage, now - start)
+        return now
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # ---------- 读取 ----------
+    def add_collector(self, collector):
+        """collector() 返回 [(名称, {标签: 值}, 数值)]，名称以 _total 结尾的导出为counter，其余为gauge"""
+        self.collectors.append(collector)
+
+    def collect(self):
+        samples = [(name, {}, value) for name, value in list(self.counters.items())]
+        for collector in self.collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                print(f"Warning: metrics collector failed. Error: {e}")
+        return samples
+
+    def snapshot(self):
+        """JSON可序列化的快照；cpu_percent 为距上一次快照的平均CPU占用"""
+        samples = self.collect()
+        values = {}
+        for name, labels, value in samples:
+            key = name + ''.join(f'[{v}]' for v in labels.values())
+            values[key] = value
+        cpu_seconds, now = values.get('process_cpu_seconds_total'), time.perf_counter()
+        if cpu_seconds is not None:
+            if self._last_cpu is not None and now > self._last_cpu[1]:
+                values['process_cpu_percent'] = (cpu_seconds - self._last_cpu[0]) / (now - self._last_cpu[1]) * 100
+            self._last_cpu = (cpu_seconds, now)
+        return {
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'uptime_seconds': time.time() - self.started,
+            'stages': {stage: h.summary() for stage, h in list(self.histograms.items())},
+            'values': values,
+        }
+
+    def prometheus_text(self):
+        lines = []
+        name = f'{PREFIX}_stage_seconds'
+        lines.append(f'# HELP {name} Per-stage latency of the monitor.')
+        lines.append(f'# TYPE {name} histogram')
+        for stage, histogram in list(self.histograms.items()):
+            count, total = histogram.count, histogram.total
+            for bound, seen in zip(EXPORT_BOUNDS, histogram.cumulative()):
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {seen}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total:.9g}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        declared = set()
+        for metric, labels, value in self.collect():
+            full = f'{PREFIX}_{metric}'
+            if full not in declared:
+                declared.add(full)
+                lines.append(f'# TYPE {full} {"counter" if metric.endswith("_total") else "gauge"}')
+            label_text = ','.join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f'{full}{{{label_text}}} {value:.9g}' if label_text else f'{full} {value:.9g}')
+        return '\n'.join(lines) + '\n'
+
+    # ---------- 导出 ----------
+    def serve(self, port, host='127.0.0.1'):
+        """在后台线程中提供 HTTP 端点，只监听本机。port 为0时由系统分配，返回实际端口"""
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = metrics.prometheus_text().encode(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(metrics.snapshot(), ensure_ascii=False).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        return self._server.server_address[1]
+
+    def dump(self, path):
+        """先写临时文件再替换，读取方不会读到写了一半的文件"""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, indent=1, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def start_dump(self, path, interval=DEFAULT_DUMP_INTERVAL):
+        def run():
+            while not self._dump_stop.wait(interval):
+                try:
+                    self.dump(path)
+                except OSError as e:
+                    print(f"Warning: could not write metrics to {path}. Error: {e}")
+        self._dump_stop.clear()
+        self._dump_thread = threading.Thread(target=run, name='metrics-dump', daemon=True)
+        self._dump_thread.start()
+
+    def close(self, path=None):
+        """停止HTTP端点与定期写出；给出 path 时最后再写一次"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self._dump_stop.set()
+        if path:
+            self.dump(path)
+
+
+_process = None
+
+
+def process_stats():
+    """本进程累计的CPU时间与常驻内存"""
+    global _process
+    import psutil
+    if _process is None:
+        _process = psutil.Process()
+    cpu = _process.cpu_times()
+    return [('process_cpu_seconds_total', {}, cpu.user + cpu.system),
+            ('process_resident_memory_bytes', {}, _process.memory_info().rss),
+            ('process_threads', {}, _process.num_threads())]
+
+
+def probe_collector(probe_runner):
+    """ProbeRunner 各采集项的调用/超时/错误次数及最近一次耗时"""
+    def collect():
+        samples = []
+        for name, s in probe_runner.stats().items():
+            labels = {'probe': name}
+            samples += [('probe_calls_total', labels, s['calls']), ('probe_timeouts_total', labels, s['timeouts']),
+                        ('probe_errors_total', labels, s['errors']),
+                        ('probe_last_latency_seconds', labels, s['last_latency_ms'] / 1000)]
+        return samples
+    return collect
+
+
+def from_environment():
+    """
+    按环境变量启用：DIGIT_SPIRIT_METRICS_PORT 为本机端口，DIGIT_SPIRIT_METRICS_JSON 为定期写出的JSON路径
+    (DIGIT_SPIRIT_METRICS_INTERVAL 秒一次，默认60)。两者都未设置时返回 (None, None)，不做任何记录。
+    """
+    port = int(os.environ.get('DIGIT_SPIRIT_METRICS_PORT', '0') or 0)
+    path = os.environ.get('DIGIT_SPIRIT_METRICS_JSON') or None
+    if not port and not path:
+        return None, None
+    metrics = Metrics()
+    if port:
+        metrics.serve(port)
+        print(f"Metrics endpoint: http://127.0.0.1:{port}/metrics")
+    if path:
+        metrics.start_dump(path, float(os.environ.get('DIGIT_SPIRIT_METRICS_INTERVAL', DEFAULT_DUMP_INTERVAL)))
+    return metrics, path
+
+
+# ---------- 测试 ----------
+def check_histogram(n=200_000, seed=0):
+    """对数正态分布的耗时：各分位数与精确值的相对误差不超过桶宽；累计桶单调且总数正确"""
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    values = rng.lognormal(np.log(200e-6), 1.0, n)
+    histogram = Histogram()
+    for v in values:
+        histogram.record(float(v))
+    for q in (0.5, 0.9, 0.99, 0.999):
+        exact = np.quantile(values, q)
+        assert abs(histogram.quantile(q) - exact) / exact < 2 / _SUB, f"p{q * 100:g} 误差过大"
+    cumulative = histogram.cumulative()
+    assert cumulative == sorted(cumulative) and cumulative[-1] <= n
+    for bound, seen in zip(EXPORT_BOUNDS, cumulative):
+        exact = int((values < bound).sum())
+        assert abs(seen - exact) <= n * 0.01, f"le={bound} 的累计次数 {seen} 与精确值 {exact} 相差过大"
+    for index in range(N_BUCKETS - 1):
+        lower, upper = bucket_bounds(index)
+        assert bucket_index(lower) == index and bucket_index(upper - 1) == index and bucket_bounds(index + 1)[0] == upper
+    print(f"直方图检查通过: {N_BUCKETS} 个桶, p50/p99 = {histogram.quantile(0.5) * 1e6:.0f}/"
+          f"{histogram.quantile(0.99) * 1e6:.0f} us")
+
+
+def check_overhead(ticks=5000, interval=1.0):
+    """用假采集器和假模型运行流水线，比较开启与关闭指标时每个tick的耗时，开销应小于tick周期的1%"""
+    from pipeline import _TEST_IDLE_MEANS, FakeModel, FakeRecorder, MonitorPipeline
+    from feature_engine import RAW_DATA_COLUMNS
+    from window_matcher import WindowMatcher
+    rows = [[float(i % 7)] * len(RAW_DATA_COLUMNS) for i in range(60)]
+    timings = {}
+    for enabled in (False, True, False, True):
+        metrics = Metrics() if enabled else None
+        pipeline = MonitorPipeline(FakeRecorder(rows, [("Visual Studio Code", "Code.exe")]), FakeModel(),
+                                   WindowMatcher({'code': 'coding'}), _TEST_IDLE_MEANS, metrics=metrics)
+        start = time.perf_counter()
+        for tick in range(ticks):
+            pipeline.step(tick, float(tick))
+        timings[enabled] = min(timings.get(enabled, float('inf')), (time.perf_counter() - start) / ticks)
+    overhead = timings[True] - timings[False]
+    assert overhead < interval * 0.01, f"每个tick的指标开销 {overhead * 1e6:.1f}us 超过周期的1%"
+    print(f"开销检查通过: 每个tick {timings[False] * 1e6:.1f}us -> {timings[True] * 1e6:.1f}us "
+          f"(+{max(overhead, 0) * 1e6:.1f}us, 周期的 {max(overhead, 0) / interval * 100:.4f}%)")
+
+
+def check_endpoint():
+    """本机端口上的 /metrics 与 /metrics.json 可以读取，JSON定期写出"""
+    import tempfile
+    import urllib.request
+    metrics = Metrics()
+    for seconds in (0.0002, 0.0004, 0.003):
+        metrics.observe('model', seconds)
+    metrics.count('late_ticks_total')
+    port = metrics.serve(0)
+    text = urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=5).read().decode()
+    assert f'{PREFIX}_stage_seconds_count{{stage="model"}} 3' in text
+    assert f'{PREFIX}_stage_seconds_bucket{{stage="model",le="0.0005"}} 2' in text
+    assert f'{PREFIX}_late_ticks_total 1' in text and f'{PREFIX}_process_resident_memory_bytes' in text
+    snapshot = json.loads(urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics.json', timeout=5).read())
+    assert snapshot['stages']['model']['count'] == 3
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, 'metrics.json')
+        metrics.start_dump(path, interval=0.05)
+        time.sleep(0.3)
+        metrics.close()
+        with open(path, encoding='utf-8') as f:
+            assert json.load(f)['values']['late_ticks_total'] == 1
+    print(f"端点检查通过: {len(text.splitlines())} 行Prometheus文本")
+
+
+if __name__ == "__main__":
+    check_histogram()
+    check_overhead()
+    check_endpoint()
@@ -0,0 +1,296 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import zipfile
+
+from feature_engine import FINAL_FEATURE_COLUMNS
+
+# 模型包的格式版本，读取时拒绝更新的格式
+BUNDLE_FORMAT = 1
+BUNDLE_PATH = 'model.bundle'
+
+_MANIFEST = 'manifest.json'
+_BOOSTER = 'model.ubj'
+_TREES = 'trees.npz'
+
+# 没有训练数据的基准值时使用 (与界面原来写死的默认值相同)
+DEFAULT_IDLE_MEANS = {'cpu_percent': 6.0, 'ram_percent': 60.0, 'gpu_percent': 25.0, 'gpu_vram_percent': 15.0}
+
+
+class ModelBundle:
+    """
+    单文件模型包 (zip)：
+      manifest.json  格式版本、模型版本号、类别列表、有序特征列、训练时的空闲基准、训练元数据、各成员的sha256
+      model.ubj      XGBoost原生二进制格式的booster (继续训练/增量更新时使用)
+      trees.npz      TreeEnsemble 的扁平数组 (实时预测使用，只需numpy)
+    打开时只读取manifest；engine 与 booster 在首次访问时才读取并校验，booster 才会导入xgboost。
+    """
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.classes = manifest['classes']
+        self.feature_names = manifest['feature_names']
+        self.idle_means = manifest['idle_means']
+        self.metadata = manifest.get('metadata', {})
+        self.model_version = manifest['model_version']
+        self._engine = None
+        self._booster = None
+
+    @classmethod
+    def open(cls, path=BUNDLE_PATH):
+        with zipfile.ZipFile(path) as zf:
+            manifest = json.loads(zf.read(_MANIFEST))
+        if manifest.get('format', 0) > BUNDLE_FORMAT:
+            raise ValueError(f"模型包格式 {manifest['format']} 比当前程序支持的 {BUNDLE_FORMAT} 更新，请升级程序")
+        return cls(path, manifest)
+
+    def _read(self, name):
+        with zipfile.ZipFile(self.path) as zf:
+            data = zf.read(name)
+        if hashlib.sha256(data).hexdigest() != self.manifest['members'][name]:
+            raise ValueError(f"模型包 {self.path} 中的 {name} 校验失败")
+        return data
+
+    @property
+    def engine(self):
+        """TreeEnsemble (只依赖numpy)"""
+        if self._engine is None:
+            from tree_engine import TreeEnsemble
+            self._engine = TreeEnsemble.load(io.BytesIO(self._read(_TREES)))
+        return self._engine
+
+    @property
+    def booster(self):
+        """xgboost.Booster (首次访问时导入xgboost)"""
+        if self._booster is None:
+            import xgboost as xgb
+            booster = xgb.Booster()
+            booster.load_model(bytearray(self._read(_BOOSTER)))
+            self._booster = booster
+        return self._booster
+
+    def check_schema(self, feature_names=FINAL_FEATURE_COLUMNS):
+        """模型的特征列 (含顺序) 必须与实时特征引擎输出的列一致"""
+        feature_names = list(feature_names)
+        if self.feature_names == feature_names:
+            return
+        missing = [c for c in self.feature_names if c not in feature_names]
+        extra = [c for c in feature_names if c not in self.feature_names]
+        if missing or extra:
+            raise ValueError(f"模型特征列与特征引擎不一致: 模型需要但引擎没有 {missing}, 引擎多出 {extra}")
+        raise ValueError(f"模型特征列的顺序与特征引擎不一致: {self.feature_names}")
+
+    def describe(self):
+        lines = [f"{self.path}: 格式 {self.manifest['format']}, 模型版本 {self.model_version}, "
+                 f"创建于 {self.manifest['created']}",
+                 f"  类别: {self.classes}",
+                 f"  特征 ({len(self.feature_names)}): {self.feature_names}",
+                 f"  空闲基准: {self.idle_means}"]
+        lines += [f"  {key}: {value}" for key, value in self.metadata.items()]
+        return '\n'.join(lines)
+
+
+def load_bundle(path=BUNDLE_PATH, feature_names=FINAL_FEATURE_COLUMNS, lazy=True):
+    """一次调用完成读取与特征列校验；lazy=False 时立即构建预测引擎"""
+    bundle = ModelBundle.open(path)
+    if feature_names is not None:
+        bundle.check_schema(feature_names)
+    if not lazy:
+        bundle.engine
+    return bundle
+
+
+def save_bundle(path, booster, classes, feature_names=None, idle_means=None, metadata=None, engine=None):
+    """
+    写出模型包。feature_names 默认取booster中记录的特征列；idle_means 与 metadata 为空时沿用同路径旧模型包的值。
+    engine 为由该booster得到的 TreeEnsemble (如量化后的版本)，默认由booster构建。
+    模型版本号在旧模型包的基础上加1。先写临时文件再替换，读取方不会看到写了一半的文件。
+    """
+    import numpy as np
+    from tree_engine import TreeEnsemble
+    feature_names = list(feature_names or booster.feature_names or FINAL_FEATURE_COLUMNS)
+    if booster.feature_names and list(booster.feature_names) != feature_names:
+        raise ValueError(f"booster的特征列 {booster.feature_names} 与给定的特征列不一致")
+    previous = None
+    if os.path.exists(path):
+        try:
+            previous = ModelBundle.open(path)
+        except (zipfile.BadZipFile, KeyError, ValueError) as e:
+            print(f"Warning: 无法读取旧模型包 {path}: {e}")
+    if idle_means is None:
+        idle_means = previous.idle_means if previous else DEFAULT_IDLE_MEANS
+    if metadata is None:
+        metadata = previous.metadata if previous else {}
+
+    if engine is None:
+        engine = TreeEnsemble.from_booster(booster, classes=[str(c) for c in classes])
+        engine.feature_names = feature_names
+    elif list(engine.feature_names) != feature_names:
+        raise ValueError(f"engine的特征列 {engine.feature_names} 与给定的特征列不一致")
+    trees = io.BytesIO()
+    engine.save(trees)
+    members = {_BOOSTER: bytes(booster.save_raw('ubj')), _TREES: trees.getvalue()}
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'model_version': (previous.model_version + 1) if previous else 1,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'classes': [str(c) for c in classes],
+        'feature_names': feature_names,
+        'idle_means': {k: float(v) for k, v in idle_means.items()},
+        'num_trees': int(len(engine.roots)),
+        'quantization': 'bins' if engine.cuts is not None else (
+            'float16' if engine.threshold.dtype == np.float16 else None),
+        'xgboost_version': __import__('xgboost').__version__,
+        'numpy_version': np.__version__,
+        'metadata': metadata,
+        'members': {name: hashlib.sha256(data).hexdigest() for name, data in members.items()},
+    }
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(_MANIFEST, json.dumps(manifest, indent=1, ensure_ascii=False))
+        for name, data in members.items():
+            zf.writestr(name, data)
+    os.replace(tmp_path, path)
+    return ModelBundle(path, manifest)
+
+
+def idle_means_from_logs(paths):
+    """训练日志中 idle 行的均值 (即 data_processs.py 扣除的基准，按行数加权到所有文件)"""
+    import pandas as pd
+    from columnar_log import read_log
+    idle = [df.loc[df['label'] == 'idle', list(DEFAULT_IDLE_MEANS)] for df in map(read_log, paths)]
+    idle = pd.concat(idle, ignore_index=True)
+    if idle.empty:
+        return dict(DEFAULT_IDLE_MEANS)
+    return {col: float(idle[col].mean()) for col in DEFAULT_IDLE_MEANS}
+
+
+def convert_joblib(model_path='xgboost_model.joblib', encoder_path='label_encoder.joblib', path=BUNDLE_PATH,
+                   idle_means=None, metadata=None):
+    """把现有的 joblib 模型/编码器 转换为模型包"""
+    import joblib
+    booster = joblib.load(model_path).get_booster()
+    classes = [str(c) for c in joblib.load(encoder_path).classes_]
+    metadata = dict(metadata or {}, converted_from=[os.path.basename(model_path), os.path.basename(encoder_path)])
+    return save_bundle(path, booster, classes, idle_means=idle_means, metadata=metadata)
+
+
+# ---------- 测试 ----------
+def check_bundle(model_path='xgboost_model.joblib', encoder_path='label_encoder.joblib'):
+    """模型包与joblib模型的预测逐位一致；特征列不一致、成员被篡改时报错；重复保存时版本号递增"""
+    import tempfile
+    import numpy as np
+    from tree_engine import TreeEnsemble
+    reference = TreeEnsemble.from_joblib(model_path, encoder_path)
+    X = np.random.default_rng(0).uniform(0, 100, (500, len(FINAL_FEATURE_COLUMNS))).astype(np.float32)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.bundle')
+        convert_joblib(model_path, encoder_path, path)
+        bundle = load_bundle(path)
+        assert bundle._engine is None and bundle._booster is None, "打开模型包时不应加载模型"
+        assert bundle.classes == reference.classes
+        assert (bundle.engine.predict_proba(X) == reference.predict_proba(X)).all()
+        import xgboost as xgb
+        expected = bundle.booster.predict(xgb.DMatrix(X, feature_names=bundle.feature_names))
+        assert np.allclose(expected, reference.predict_proba(X), atol=1e-6)
+
+        try:
+            bundle.check_schema(FINAL_FEATURE_COLUMNS[::-1])
+            raise AssertionError("特征列顺序不一致时应报错")
+        except ValueError:
+            pass
+        try:
+            load_bundle(path, FINAL_FEATURE_COLUMNS[:-1])
+            raise AssertionError("缺少特征列时应报错")
+        except ValueError:
+            pass
+
+        again = save_bundle(path, bundle.booster, bundle.classes)
+        assert again.model_version == 2 and again.idle_means == bundle.idle_means
+
+        # 篡改 trees.npz
+        tampered = os.path.join(tmp, 'tampered.bundle')
+        with zipfile.ZipFile(path) as src, zipfile.ZipFile(tampered, 'w') as dst:
+            for item in src.infolist():
+                data = src.read(item.filename)
+                dst.writestr(item, data[:-1] + bytes([data[-1] ^ 1]) if item.filename == _TREES else data)
+        try:
+            ModelBundle.open(tampered).engine
+            raise AssertionError("成员被篡改时应报错")
+        except ValueError:
+            pass
+    print("模型包校验通过")
+
+
+_LOAD_SNIPPETS = {
+    'joblib + sklearn + xgboost': (
+        "import joblib\n"
+        "model = joblib.load({model!r}); encoder = joblib.load({encoder!r})\n"),
+    'joblib -> TreeEnsemble (当前界面)': (
+        "from tree_engine import TreeEnsemble\n"
+        "engine = TreeEnsemble.from_joblib({model!r}, {encoder!r})\n"),
+    '模型包 -> TreeEnsemble': (
+        "from model_bundle import load_bundle\n"
+        "engine = load_bundle({bundle!r}).engine\n"),
+    '模型包 (仅manifest，延迟加载)': (
+        "from model_bundle import load_bundle\n"
+        "bundle = load_bundle({bundle!r})\n"),
+}
+
+
+def benchmark(model_path='xgboost_model.joblib', encoder_path='label_encoder.joblib', repeat=5):
+    """在新进程中测量 从导入到可以预测 的耗时 (含导入sklearn/xgboost的时间)，取中位数"""
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        bundle_path = os.path.join(tmp, 'model.bundle')
+        convert_joblib(model_path, encoder_path, bundle_path)
+        print(f"模型包大小 {os.path.getsize(bundle_path) / 1024:.0f} KiB, joblib 两个文件合计 "
+              f"{(os.path.getsize(model_path) + os.path.getsize(encoder_path)) / 1024:.0f} KiB")
+        results = {}
+        for name, snippet in _LOAD_SNIPPETS.items():
+            code = ("import time, warnings; warnings.simplefilter('ignore'); start = time.perf_counter()\n"
+                    + snippet.format(model=model_path, encoder=encoder_path, bundle=bundle_path)
+                    + "print(time.perf_counter() - start)")
+            timings = []
+            for _ in range(repeat):
+                out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+                timings.append(float(out.stdout.strip().splitlines()[-1]))
+            results[name] = sorted(timings)[len(timings) // 2]
+            print(f"{name:36s}: {results[name] * 1000:8.1f} ms")
+    return results
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="版本化的单文件模型包")
+    sub = parser.add_subparsers(dest='command')
+    convert = sub.add_parser('convert', help="把 joblib 模型/编码器 转换为模型包")
+    convert.add_argument('--model', default='xgboost_model.joblib')
+    convert.add_argument('--encoder', default='label_encoder.joblib')
+    convert.add_argument('--output', default=BUNDLE_PATH)
+    convert.add_argument('--logs', nargs='*', default=None,
+                         help="用于计算空闲基准的训练日志，默认为 train_data/ 下的全部日志")
+    info = sub.add_parser('info', help="显示模型包信息")
+    info.add_argument('path', nargs='?', default=BUNDLE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        from data_processs import discover_files
+        logs = args.logs if args.logs is not None else discover_files('train_data')
+        bundle = convert_joblib(args.model, args.encoder, args.output, idle_means_from_logs(logs) if logs else None,
+                                metadata={'train_logs': [os.path.basename(p) for p in logs]})
+        print(bundle.describe())
+    elif args.command == 'info':
+        print(ModelBundle.open(args.path).describe())
+    else:
+        check_bundle()
+        benchmark()
+
+
+if __name__ == "__main__":
+    main()
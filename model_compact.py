@@ -0,0 +1,168 @@
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from feature_engine import FINAL_FEATURE_COLUMNS
+from model_bundle import BUNDLE_PATH, load_bundle, save_bundle
+from tree_engine import TreeEnsemble
+
+# 截断：只保留前N轮的树
+DEFAULT_ROUNDS = (50, 25, 10)
+# 剪枝：用XGBoost的prune更新器剪掉增益低于gamma的分裂
+DEFAULT_GAMMAS = (1.0, 5.0)
+# 蒸馏：以原模型在训练集上的预测为标签训练的小模型 (max_depth, 轮数)
+DEFAULT_STUDENTS = ((4, 30), (3, 20), (2, 10))
+QUANTIZATIONS = (None, 'bins', 'float16')
+# 允许比原模型低的准确率
+DEFAULT_BUDGET = 0.01
+
+
+def load_xy(path):
+    """读取 processed_system*.csv (data_processs.py 的输出)，返回 (X float32, y)"""
+    df = pd.read_csv(path)
+    return df[FINAL_FEATURE_COLUMNS].to_numpy(dtype=np.float32), df['label'].to_numpy()
+
+
+def _num_class(booster):
+    return int(json.loads(booster.save_config())['learner']['learner_model_param']['num_class'])
+
+
+def truncate(booster, rounds):
+    return booster[:rounds]
+
+
+def prune(booster, X, y, gamma):
+    """树结构上自下而上剪掉损失下降小于gamma的分裂 (叶子值不变)"""
+    dtrain = xgb.DMatrix(X, label=y, feature_names=booster.feature_names)
+    params = {'process_type': 'update', 'updater': 'prune', 'gamma': gamma, 'num_class': _num_class(booster)}
+    return xgb.train(params, dtrain, num_boost_round=booster.num_boosted_rounds(), xgb_model=booster)
+
+
+def distill(teacher, X, max_depth, rounds, seed=0):
+    """用原模型对训练集的预测类别作为标签训练较浅、较少轮数的模型"""
+    dtrain = xgb.DMatrix(X, feature_names=teacher.feature_names)
+    dtrain.set_label(teacher.predict(dtrain).argmax(axis=1))
+    params = {'objective': 'multi:softprob', 'num_class': _num_class(teacher), 'tree_method': 'hist',
+              'max_depth': max_depth, 'learning_rate': 0.3, 'seed': seed}
+    return xgb.train(params, dtrain, num_boost_round=rounds)
+
+
+def structural_variants(booster, X_train, y_train, rounds=DEFAULT_ROUNDS, gammas=DEFAULT_GAMMAS,
+                        students=DEFAULT_STUDENTS):
+    """返回 [(名称, booster)]，第一个为原模型"""
+    variants = [('原模型', booster)]
+    total = booster.num_boosted_rounds()
+    variants += [(f'截断 {n} 轮', truncate(booster, n)) for n in rounds if n < total]
+    variants += [(f'剪枝 gamma={g:g}', prune(booster, X_train, y_train, g)) for g in gammas]
+    variants += [(f'蒸馏 depth={d} {n} 轮', distill(booster, X_train, d, n)) for d, n in students]
+    return variants
+
+
+def engine_size(engine):
+    """保存为 trees.npz 后的字节数"""
+    buffer = io.BytesIO()
+    engine.save(buffer)
+    return len(buffer.getvalue())
+
+
+def single_row_latency(engine, X, repeat=2000):
+    """实时监控中每秒一次的单行预测耗时 (微秒/行)，取3次测量的最小值"""
+    rows = X[np.arange(repeat) % len(X)]
+    best = float('inf')
+    for _ in range(3):
+        start = time.perf_counter()
+        for row in rows:
+            engine.predict_one(row)
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best * 1e6
+
+
+def evaluate_variants(variants, classes, X_test, y_test, quantizations=QUANTIZATIONS, repeat=2000):
+    """每个结构变体再与每种量化方式组合，在测试集上统计准确率、混淆矩阵、与原模型的一致率、大小与延迟"""
+    from sklearn.metrics import confusion_matrix
+    report = []
+    baseline_pred = None
+    for name, booster in variants:
+        engine = TreeEnsemble.from_booster(booster, classes=classes)
+        for quantization in quantizations:
+            candidate = engine.quantize(quantization) if quantization else engine
+            pred = candidate.predict_proba(X_test).argmax(axis=1)
+            if baseline_pred is None:
+                baseline_pred = pred
+            report.append({
+                'name': name + (f' + {quantization}' if quantization else ''),
+                'quantization': quantization,
+                'trees': int(len(candidate.roots)),
+                'nodes': int(len(candidate.left)),
+                'max_depth': int(candidate.max_depth),
+                'size_bytes': engine_size(candidate),
+                'accuracy': float((pred == y_test).mean()),
+                'agreement': float((pred == baseline_pred).mean()),
+                'latency_us': single_row_latency(candidate, X_test, repeat),
+                'confusion_matrix': confusion_matrix(y_test, pred, labels=range(len(classes))).tolist(),
+                'booster': booster,
+                'engine': candidate,
+            })
+    return report
+
+
+def choose(report, budget=DEFAULT_BUDGET):
+    """准确率不低于 原模型 - budget 的变体中单行延迟最低的一个 (延迟相近时取更小的)"""
+    floor = report[0]['accuracy'] - budget
+    eligible = [row for row in report if row['accuracy'] >= floor]
+    return min(eligible, key=lambda row: (round(row['latency_us']), row['size_bytes']))
+
+
+def print_report(report, classes, chosen):
+    print(f"{'变体':28s} {'树':>5s} {'节点':>7s} {'深度':>4s} {'大小KiB':>8s} {'准确率':>7s} {'一致率':>7s} {'延迟us':>8s}")
+    for row in report:
+        mark = ' *' if row is chosen else ''
+        print(f"{row['name']:28s} {row['trees']:5d} {row['nodes']:7d} {row['max_depth']:4d} "
+              f"{row['size_bytes'] / 1024:8.1f} {row['accuracy']:7.4f} {row['agreement']:7.4f} "
+              f"{row['latency_us']:8.1f}{mark}")
+    print(f"\n混淆矩阵 (行为真实标签，列为预测标签，顺序 {classes})")
+    for row in report:
+        print(f"  {row['name']:28s} {row['confusion_matrix']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模型压缩：截断轮数、剪枝、蒸馏为浅树、阈值量化，并输出准确率/延迟对比")
+    parser.add_argument('--model', default=BUNDLE_PATH, help="原模型包")
+    parser.add_argument('--train', default='processed_system.csv', help="剪枝与蒸馏使用的训练数据")
+    parser.add_argument('--test', default='processed_system_test.csv')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help="允许的准确率下降")
+    parser.add_argument('--repeat', type=int, default=2000, help="测量单行延迟的预测次数")
+    parser.add_argument('--output', default='model_compact.bundle', help="选中的压缩模型包")
+    parser.add_argument('--report', default='compact_report.json')
+    args = parser.parse_args(argv)
+
+    bundle = load_bundle(args.model)
+    X_train, y_train = load_xy(args.train)
+    X_test, y_test = load_xy(args.test)
+    variants = structural_variants(bundle.booster, X_train, y_train)
+    report = evaluate_variants(variants, bundle.classes, X_test, y_test, repeat=args.repeat)
+    chosen = choose(report, args.budget)
+    print_report(report, bundle.classes, chosen)
+
+    metadata = dict(bundle.metadata, compacted_from=f"{args.model} (版本 {bundle.model_version})",
+                    variant=chosen['name'], test_accuracy=chosen['accuracy'], latency_us=chosen['latency_us'])
+    save_bundle(args.output, chosen['booster'], bundle.classes, idle_means=bundle.idle_means,
+                metadata=metadata, engine=chosen['engine'])
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump({'model': args.model, 'test': args.test, 'budget': args.budget, 'chosen': chosen['name'],
+                   'variants': [{k: v for k, v in row.items() if k not in ('booster', 'engine')} for row in report]},
+                  f, indent=1, ensure_ascii=False)
+    print(f"\n预算 {args.budget:.3f} 内最快的变体: {chosen['name']} "
+          f"(准确率 {chosen['accuracy']:.4f} vs {report[0]['accuracy']:.4f}, "
+          f"{chosen['latency_us']:.0f} vs {report[0]['latency_us']:.0f} us/行, "
+          f"{chosen['size_bytes'] / 1024:.0f} vs {report[0]['size_bytes'] / 1024:.0f} KiB)")
+    print(f"已保存到 '{args.output}'，报告已保存到 '{args.report}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,44 @@
 import joblib
 import pandas as pd
-import psutil
 import time
-import threading
-from pynput import mouse, keyboard
-import pynvml
+import psutil
+from input_aggregator import InputAggregator
+from system_probe import make_probe
+from probe_runner import CounterRates, Probe, ProbeRunner
+from feature_engine import COUNTER_MASK
+
+try:
+    import win32gui
+    import win32process
+except ImportError:  # 非Windows平台无法获取前景窗口
+    win32gui = win32process = None
+
+
+def get_foreground_window():
+    """获取前景窗口标题及所属进程名，返回 (标题, 进程名)；获取失败时标题为None"""
+    try:
+        hwnd = win32gui.GetForegroundWindow()
+        if not hwnd:
+            return "", ""
+        window_title = win32gui.GetWindowText(hwnd)
+        try:
+            _, pid = win32process.GetWindowThreadProcessId(hwnd)
+            process_name = psutil.Process(pid).name()
+        except Exception:
+            process_name = ""
+        return window_title, process_name
+    except Exception:
+        return None, ""
+
 
 class Recorder:
-    def __init__(self):
+    """
+    采集器。system_probe / gpu_probe / input_aggregator 为空时使用真实的采集后端 (/proc或psutil、NVML、pynput监听)，
+    回放测试 (replay.py) 中替换为按录制数据返回的假数据源；clock 用于计算两次采集之间经过的时间。
+    """
+    def __init__(self, window_probe=None, system_probe=None, gpu_probe=None, input_aggregator=None,
+                 clock=time.monotonic):
+        self.clock = clock
         # 监听器
         self.mouse_listener = None
         self.keyboard_listener = None
@@ -15,65 +46,46 @@ class Recorder:
         # 状态
         self.running = False
         
-        # 数据采集变量
-        self.mouse_locations = []
-        self.mouse_left_clicks = 0
-        self.mouse_right_clicks = 0
-        self.mouse_scroll_amount = 0
-        self.keyboard_counts = 0
+        # 用户输入聚合 (监听线程无锁累加，采样线程按周期取增量)
+        self.listen_input = input_aggregator is None
+        self.input_aggregator = input_aggregator or InputAggregator(throttle_time=0.1)
         
-        # 性能与同步
-        self.data_lock = threading.Lock()
-        self.last_move_time = 0
-        self.throttle_time = 0.1 # 鼠标移动事件节流
-
-        # 网络与磁盘
-        self.bytes_sent_prev = 0
-        self.bytes_recv_prev = 0
-        self.packets_sent_prev = 0
-        self.packets_recv_prev = 0
-        self.read_bytes_prev = 0
-        self.write_bytes_prev = 0
+        # 网络与磁盘 (CPU/内存/网络/磁盘由同一个采集后端一次性读取)；自行创建的后端在 stop() 时关闭，start() 时重新打开
+        self.owns_system_probe = system_probe is None
+        self.system_probe = system_probe or make_probe()
+        self.counter_rates = CounterRates(6) # 网络/磁盘累计计数 -> 每次采集之间的增量
+        self.last_sample_time = None
 
         # GPU 初始化
         self.gpu_handle = None
-        try:
-            pynvml.nvmlInit()
-            self.gpu_handle = pynvml.nvmlDeviceGetHandleByIndex(0)
-            print("NVIDIA GPU found and initialized.")
-        except Exception as e:
-            print(f"Warning: Could not initialize NVIDIA GPU monitoring. Error: {e}")
-
-    def on_click(self, x, y, button, pressed):
-        if pressed:
-            with self.data_lock:
-                if button == mouse.Button.left:
-                    self.mouse_left_clicks += 1
-                elif button == mouse.Button.right:
-                    self.mouse_right_clicks += 1
-
-    def on_move(self, x, y):
-        current_time = time.time()
-        if current_time - self.last_move_time < self.throttle_time:
-            return
-        self.last_move_time = current_time
-        with self.data_lock:
-            self.mouse_locations.append((x, y))
-
-    def on_press(self, key):
-        with self.data_lock:
-            self.keyboard_counts += 1
-
-    def on_scroll(self, x, y, dx, dy):
-        with self.data_lock:
-            self.mouse_scroll_amount += abs(dy)
-    
-    def get_and_reset_data(self):
-        # 1. 采集系统性能数据
-        cpu_usage = psutil.cpu_percent(interval=None) 
-        ram_usage = psutil.virtual_memory().percent
+        if gpu_probe is None:
+            try:
+                import pynvml
+                pynvml.nvmlInit()
+                self.gpu_handle = pynvml.nvmlDeviceGetHandleByIndex(0)
+                print("NVIDIA GPU found and initialized.")
+            except Exception as e:
+                print(f"Warning: Could not initialize NVIDIA GPU monitoring. Error: {e}")
+
+        # 各采集项在线程池中并发执行，单个慢调用不会拖慢整个采样
+        probes = [
+            Probe('system', self.read_system, deadline=0.2, default=(0.0, 0.0, 0, 0, 0, 0, 0, 0)),
+            Probe('gpu', gpu_probe or self.read_gpu, deadline=0.2, default=(-1, -1)),
+        ]
+        if window_probe is not None:
+            probes.append(Probe('window', window_probe, deadline=0.1, default=("", "")))
+        self.probe_runner = ProbeRunner(probes, clock=clock)
+        self.probe_results = {}
+
+    def read_system(self):
+        """读取CPU/内存使用率及网络、磁盘的累计计数"""
+        return self.system_probe.snapshot()
+
+    def read_gpu(self):
+        """读取GPU使用率和显存占用率，不可用时为-1"""
         gpu_usage, gpu_vram_usage = -1, -1 # 默认为-1，表示不可用
         if self.gpu_handle:
+            import pynvml
             try:
                 gpu_util = pynvml.nvmlDeviceGetUtilizationRates(self.gpu_handle)
                 gpu_usage = gpu_util.gpu
@@ -81,64 +93,59 @@ class Recorder:
                 gpu_vram_usage = (mem_info.used / mem_info.total) * 100 if mem_info.total > 0 else 0
             except pynvml.NVMLError as e:
                 print(f"Could not get GPU info: {e}")
+        return gpu_usage, gpu_vram_usage
+
+    def collect_sample(self):
+        """
+        采集一次原始数据，返回 (按 RAW_DATA_COLUMNS 排列的数据, 距上次采集经过的秒数)。
+        计数类字段为两次采集之间的增量，首次采集时经过时间为None。
+        """
+        # 1. 并发采集系统性能数据与GPU数据，超时的采集项沿用上一次的值并标记为stale
+        self.probe_results = self.probe_runner.collect()
+        (cpu_usage, ram_usage, bytes_sent, bytes_recv, packets_sent, packets_recv,
+         read_bytes, write_bytes) = self.probe_results['system'].value
+        gpu_usage, gpu_vram_usage = self.probe_results['gpu'].value
 
         # 2. 采集并重置用户输入数据
-        with self.data_lock:
-            # 计算鼠标移动总距离
-            mouse_distance_sum = sum(((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)**0.5 for p1, p2 in zip(self.mouse_locations, self.mouse_locations[1:]))
-            
-            # 复制当前数据
-            left_clicks = self.mouse_left_clicks
-            right_clicks = self.mouse_right_clicks
-            scroll_amount = self.mouse_scroll_amount
-            keyboard_hits = self.keyboard_counts
-            
-            # 重置数据，为下一个时间窗口做准备
-            self.mouse_locations.clear()
-            self.mouse_left_clicks = 0
-            self.mouse_right_clicks = 0
-            self.mouse_scroll_amount = 0
-            self.keyboard_counts = 0
-
-        net_io_now = psutil.net_io_counters()
-        disk_io_now = psutil.disk_io_counters()
+        mouse_distance_sum, left_clicks, right_clicks, scroll_amount, keyboard_hits = self.input_aggregator.get_and_reset()
+
+        now = self.clock()
+        elapsed = now - self.last_sample_time if self.last_sample_time is not None else None
+        self.last_sample_time = now
         
-        if self.bytes_recv_prev == 0:
-            bytes_sent_per_sec = 0
-            bytes_recv_per_sec = 0
-            packets_sent_per_sec = 0
-            packets_recv_per_sec = 0
-            read_bytes_per_sec = 0
-            write_bytes_per_sec = 0
-        else:
-            bytes_sent_per_sec = net_io_now.bytes_sent - self.bytes_sent_prev
-            bytes_recv_per_sec = net_io_now.bytes_recv - self.bytes_recv_prev
-            packets_sent_per_sec = net_io_now.packets_sent - self.packets_sent_prev
-            packets_recv_per_sec = net_io_now.packets_recv - self.packets_recv_prev
-            read_bytes_per_sec = disk_io_now.read_bytes - self.read_bytes_prev
-            write_bytes_per_sec = disk_io_now.write_bytes - self.write_bytes_prev        
-        self.bytes_sent_prev = net_io_now.bytes_sent
-        self.bytes_recv_prev = net_io_now.bytes_recv
-        self.packets_sent_prev = net_io_now.packets_sent
-        self.packets_recv_prev = net_io_now.packets_recv
-        self.read_bytes_prev = disk_io_now.read_bytes
-        self.write_bytes_prev = disk_io_now.write_bytes
+        (bytes_sent_delta, bytes_recv_delta, packets_sent_delta, packets_recv_delta,
+         read_bytes_delta, write_bytes_delta) = self.counter_rates.update(
+            self.probe_results['system'],
+            (bytes_sent, bytes_recv, packets_sent, packets_recv, read_bytes, write_bytes), elapsed)
 
         # 3. 组合成数据行并返回
         return [
             mouse_distance_sum, left_clicks, right_clicks, scroll_amount, 
-            keyboard_hits, cpu_usage, ram_usage, gpu_usage, gpu_vram_usage,bytes_sent_per_sec, bytes_recv_per_sec, packets_sent_per_sec, packets_recv_per_sec,
-            read_bytes_per_sec, write_bytes_per_sec,
-        ]
+            keyboard_hits, cpu_usage, ram_usage, gpu_usage, gpu_vram_usage,bytes_sent_delta, bytes_recv_delta, packets_sent_delta, packets_recv_delta,
+            read_bytes_delta, write_bytes_delta,
+        ], elapsed
+
+    def get_and_reset_data(self):
+        """采集一行数据，计数类字段按实际经过的时间换算为每秒速率"""
+        sample, elapsed = self.collect_sample()
+        if elapsed:
+            sample = [value / elapsed if is_counter else value for value, is_counter in zip(sample, COUNTER_MASK)]
+        return sample
 
     def start(self):
         if self.running: return
         self.running = True
+        if self.system_probe is None:
+            self.system_probe = make_probe()
 
+        self.last_sample_time = None
         self.get_and_reset_data()
+        if not self.listen_input:
+            return
 
-        self.mouse_listener = mouse.Listener(on_click=self.on_click, on_move=self.on_move, on_scroll=self.on_scroll)
-        self.keyboard_listener = keyboard.Listener(on_press=self.on_press)
+        from pynput import mouse, keyboard
+        self.mouse_listener = mouse.Listener(on_click=self.input_aggregator.on_click, on_move=self.input_aggregator.on_move, on_scroll=self.input_aggregator.on_scroll)
+        self.keyboard_listener = keyboard.Listener(on_press=self.input_aggregator.on_press)
         self.mouse_listener.start()
         self.keyboard_listener.start()
         print("User input listeners started.")
@@ -149,8 +156,13 @@ class Recorder:
         
         if self.mouse_listener: self.mouse_listener.stop()
         if self.keyboard_listener: self.keyboard_listener.stop()
+        self.probe_runner.close() # 释放采集线程池，再次 start() 时重新创建
+        if self.owns_system_probe and self.system_probe is not None:
+            self.system_probe.close() # 释放 /proc 文件描述符
+            self.system_probe = None
         
         if self.gpu_handle:
+            import pynvml
             try:
                 pynvml.nvmlShutdown()
                 print("NVML shut down.")
@@ -2,10 +2,16 @@ import flet as ft
 import asyncio
 import sys
 import os
-import joblib
+import time
 import pandas as pd
-from model_test import Recorder
-import win32gui
+from model_test import Recorder, get_foreground_window
+from feature_engine import FINAL_FEATURE_COLUMNS, RAW_DATA_COLUMNS
+from tree_engine import TreeEnsemble
+from model_bundle import DEFAULT_IDLE_MEANS, load_bundle
+from window_matcher import WindowMatcher
+from pipeline import MonitorPipeline, DisplayState
+from metrics import from_environment, probe_collector
+import device_output
 
 # --- 全局配置 ---
 # 兼容打包后的路径
@@ -14,39 +20,26 @@ if getattr(sys, 'frozen', False):
 else:
     base_path = os.path.dirname(os.path.abspath(__file__))
 
+BUNDLE_PATH = os.path.join(base_path, 'model.bundle')
 MODEL_PATH = os.path.join(base_path, 'xgboost_model.joblib')
 ENCODER_PATH = os.path.join(base_path, 'label_encoder.joblib')
 CSV_LABEL_PATH = os.path.join(base_path, 'windows_label.csv')
 PREDICTION_INTERVAL_MS = 1000
-DATA_BUFFER_SECONDS = 30
-
-# 特征列，确保与模型训练时一致
-FINAL_FEATURE_COLUMNS = [
-    'cpu_percent', 'ram_percent', 'gpu_percent', 'gpu_vram_percent',
-    'mouse_left_click_freq', 'mouse_right_click_freq', 'mouse_scroll_freq',
-    'keyboard_counts_freq', 'mouse_distance_freq','bytes_sent_per_sec_freq', 'bytes_recv_per_sec_freq', 'packets_sent_per_sec_freq', 'packets_recv_per_sec_freq',
-    'read_bytes_per_sec_freq', 'write_bytes_per_sec_freq'
-]
-
-# 原始数据列
-RAW_DATA_COLUMNS = [
-    'mouse_distance', 'mouse_left_click', 'mouse_right_click',
-    'mouse_scroll', 'keyboard_counts', 'cpu_percent',
-    'ram_percent', 'gpu_percent', 'gpu_vram_percent','bytes_sent_per_sec', 'bytes_recv_per_sec', 'packets_sent_per_sec', 'packets_recv_per_sec',
-    'read_bytes_per_sec', 'write_bytes_per_sec'
-]
 
 class StatusPredictorApp:
     def __init__(self):
         self.page = None
         self.is_running = False
-        self.data_buffer = pd.DataFrame(columns=RAW_DATA_COLUMNS + ['timestamp'])
+        self.run_id = 0 # 每次开始监控加1，旧的结果消费任务据此退出
+        self.pipeline = None
+        self.display_state = DisplayState()
+        # 性能指标 (默认关闭)：设置 DIGIT_SPIRIT_METRICS_PORT / DIGIT_SPIRIT_METRICS_JSON 环境变量时开启，见 metrics.py
+        self.metrics, self.metrics_path = from_environment()
+        # 下位机输出 (默认关闭)：设置 DIGIT_SPIRIT_DEVICE 为串口或 tcp:host:port 时开启，见 device_output.py
+        self.device = None
 
-        # 默认的空闲状态基准值
-        self.idle_means = {
-            'cpu_percent': 6.0, 'ram_percent': 60.0,
-            'gpu_percent': 25.0, 'gpu_vram_percent': 15.0
-        }
+        # 默认的空闲状态基准值 (模型包中有训练时的基准时使用该基准)
+        self.idle_means = dict(DEFAULT_IDLE_MEANS)
 
         # --- UI 控件定义 ---
         self.status_label = ft.Text("状态: 未开始", size=14)
@@ -61,7 +54,7 @@ class StatusPredictorApp:
         
         # --- 字典管理UI控件 ---
         self.dict_view = ft.ListView(expand=1, spacing=5, auto_scroll=True)
-        self.dict_key_input = ft.TextField(label="窗口标题关键词", width=220)
+        self.dict_key_input = ft.TextField(label="窗口标题/进程名关键词", width=220)
         self.dict_value_input = ft.TextField(label="对应标签", width=120)
         self.add_button = ft.ElevatedButton("添加/更新", icon=ft.icons.ADD, on_click=self.add_or_update_entry)
         
@@ -71,6 +64,7 @@ class StatusPredictorApp:
             self.windows_dictionary = {}
             self.info_label.value = f"警告: '{os.path.basename(CSV_LABEL_PATH)}' 未找到"
             self.info_label.color = ft.colors.ORANGE
+        self.window_matcher = WindowMatcher(self.windows_dictionary)
 
     async def main(self, page: ft.Page):
         self.page = page
@@ -83,16 +77,38 @@ class StatusPredictorApp:
         
         # 加载模型
         try:
-            self.model = joblib.load(MODEL_PATH)
-            self.label_encoder = joblib.load(ENCODER_PATH)
-            self.info_label.value = "模型和编码器已加载"
+            if os.path.exists(BUNDLE_PATH):
+                # 模型包：一次读取并校验特征列，只需numpy，不导入sklearn/xgboost
+                bundle = load_bundle(BUNDLE_PATH, FINAL_FEATURE_COLUMNS, lazy=False)
+                self.tree_engine = bundle.engine
+                self.idle_means.update(bundle.idle_means)
+                self.info_label.value = f"模型包已加载 (版本 {bundle.model_version})"
+            else:
+                # 将树展开为扁平数组，预测时不再经过DataFrame和sklearn封装
+                self.tree_engine = TreeEnsemble.from_joblib(MODEL_PATH, ENCODER_PATH)
+                if self.tree_engine.feature_names != FINAL_FEATURE_COLUMNS:
+                    raise ValueError(f"模型特征列与 FINAL_FEATURE_COLUMNS 不一致: {self.tree_engine.feature_names}")
+                self.info_label.value = "模型和编码器已加载"
         except FileNotFoundError:
             self.info_label.value = "错误: 模型或编码器文件未找到"
             self.info_label.color = ft.colors.RED
             self.control_button.disabled = True
             self.calibrate_button.disabled = True
+        except ValueError as e:
+            self.info_label.value = f"错误: {e}"
+            self.info_label.color = ft.colors.RED
+            self.control_button.disabled = True
+            self.calibrate_button.disabled = True
 
-        self.system_monitor = Recorder()
+        self.system_monitor = Recorder(window_probe=get_foreground_window)
+        if self.metrics is not None:
+            self.metrics.add_collector(probe_collector(self.system_monitor.probe_runner))
+        if not self.control_button.disabled:
+            # 采集、特征计算和预测都在工作线程中执行，UI只消费结果
+            self.pipeline = MonitorPipeline(self.system_monitor, self.tree_engine, self.window_matcher,
+                                            self.idle_means, interval=PREDICTION_INTERVAL_MS / 1000,
+                                            metrics=self.metrics)
+            self.device = device_output.from_environment(self.tree_engine.classes, self.metrics)
         
         # 创建UI布局
         self._build_ui()
@@ -146,7 +162,9 @@ class StatusPredictorApp:
     async def toggle_monitoring(self, e):
         if self.is_running:
             self.is_running = False
-            self.system_monitor.stop()
+            await asyncio.get_running_loop().run_in_executor(None, self.pipeline.stop)
+            if self.device is not None:
+                self.device.reset()
             self.control_button.text = "开始监控"
             self.status_label.value = "状态: 已停止"
             self.predicted_status_label.value = "--"
@@ -154,12 +172,13 @@ class StatusPredictorApp:
             self.calibrate_button.disabled = False
         else:
             self.is_running = True
-            self.data_buffer = pd.DataFrame(columns=RAW_DATA_COLUMNS + ['timestamp'])
-            self.system_monitor.start()
+            self.display_state.reset()
+            self.pipeline.start()
             self.control_button.text = "停止监控"
             self.status_label.value = "状态: 监控中..."
             self.calibrate_button.disabled = True
-            asyncio.create_task(self.predict_loop())
+            self.run_id += 1
+            asyncio.create_task(self.consume_results(self.run_id))
         self.page.update()
 
     async def start_calibration(self, e):
@@ -217,111 +236,33 @@ class StatusPredictorApp:
         self.control_button.disabled = False
         self.page.update()
 
-    def _get_window_title_info(self):
-        """获取前景窗口标题并更新UI"""
-        try:
-            hwnd = win32gui.GetForegroundWindow()
-            if hwnd:
-                window_title = win32gui.GetWindowText(hwnd)
-                display_title = (window_title[:45] + '...') if len(window_title) > 45 else window_title
-                self.current_window_label.value = f"当前窗口: {display_title}"
-                self.current_window_label.tooltip = f"完整标题: {window_title}"
-                return window_title
-            else:
-                self.current_window_label.value = "当前窗口: 无"
-                return ""
-        except Exception:
-             self.current_window_label.value = "当前窗口: 获取失败"
-             return ""
-
-
-    async def predict_loop(self):
-        """主预测循环，采用“空闲优先 -> 字典规则 -> 模型兜底”逻辑"""
-        while self.is_running:
-            try:
-                # 步骤 0: 更新当前窗口标题信息
-                window_title = self._get_window_title_info()
-
-                # 步骤 1: 数据采集与缓冲
-                raw_data = self.system_monitor.get_and_reset_data()
-                
-                if raw_data is None:
-                    await asyncio.sleep(PREDICTION_INTERVAL_MS / 1000)
-                    continue
-
-                current_time = pd.Timestamp.now()
-                new_row = pd.DataFrame([raw_data], columns=RAW_DATA_COLUMNS)
-                new_row['timestamp'] = current_time
-                self.data_buffer = pd.concat([self.data_buffer, new_row], ignore_index=True)
-                self.data_buffer = self.data_buffer[self.data_buffer['timestamp'] > (current_time - pd.Timedelta(seconds=DATA_BUFFER_SECONDS))]
-
-                if len(self.data_buffer) < 5:
-                    self.predicted_status_label.value = f"收集中 {len(self.data_buffer)}/5"
-                    self.page.update()
-                    await asyncio.sleep(PREDICTION_INTERVAL_MS / 1000)
-                    continue
-
-                # 步骤 2: 计算特征并进行模型预测
-                recent_data = self.data_buffer[self.data_buffer['timestamp'] > (current_time - pd.Timedelta(seconds=10))]
-                latest_resources = self.data_buffer.iloc[-1]
-                
-                feature_vector = {
-                    'mouse_distance_freq': recent_data['mouse_distance'].sum(),
-                    'mouse_left_click_freq': recent_data['mouse_left_click'].sum(),
-                    'mouse_right_click_freq': recent_data['mouse_right_click'].sum(),
-                    'mouse_scroll_freq': recent_data['mouse_scroll'].sum(),
-                    'keyboard_counts_freq': recent_data['keyboard_counts'].sum(),
-                    'bytes_sent_per_sec_freq': recent_data['bytes_sent_per_sec'].sum(),
-                    'bytes_recv_per_sec_freq': recent_data['bytes_recv_per_sec'].sum(),
-                    'packets_sent_per_sec_freq': recent_data['packets_sent_per_sec'].sum(),
-                    'packets_recv_per_sec_freq': recent_data['packets_recv_per_sec'].sum(),
-                    'read_bytes_per_sec_freq': recent_data['read_bytes_per_sec'].sum(),
-                    'write_bytes_per_sec_freq': recent_data['write_bytes_per_sec'].sum(),
-                }
-                
-                # [逻辑修复] 处理校准值为-1的情况
-                feature_vector.update({
-                    'cpu_percent': latest_resources['cpu_percent'] - self.idle_means['cpu_percent'],
-                    'ram_percent': latest_resources['ram_percent'] - self.idle_means['ram_percent'],
-                    'gpu_percent': latest_resources['gpu_percent'] - self.idle_means['gpu_percent'] if self.idle_means['gpu_percent'] != -1 else latest_resources['gpu_percent'],
-                    'gpu_vram_percent': latest_resources['gpu_vram_percent'] - self.idle_means['gpu_vram_percent'] if self.idle_means['gpu_vram_percent'] != -1 else latest_resources['gpu_vram_percent']
-                })
-
-                model_input = pd.DataFrame([feature_vector])[FINAL_FEATURE_COLUMNS]
-                prediction_numeric = self.model.predict(model_input)
-                model_prediction = self.label_encoder.inverse_transform(prediction_numeric)[0]
-
-                final_prediction = ""
-
-                dict_label_find = []
-                dict_label = ""
-                for key_title, label in self.windows_dictionary.items():
-                    if key_title.lower() in window_title.lower():
-                        dict_label_find.append(label)                 
-                if dict_label_find:
-                    for label in dict_label_find:
-                        if label == 'video':
-                            dict_label = 'video'
-                            break
-                        else:
-                            dict_label = label
-                    if dict_label == 'gaming' and model_prediction == 'video':
-                        dict_label = 'video' 
-                    final_prediction = dict_label
-                else:
-                    # 步骤 5: 决策 - 模型兜底
-                    final_prediction = model_prediction                
-                
-                # 更新UI
-                self.predicted_status_label.value = final_prediction.upper()
-                self.page.update()
-
-            except Exception as e:
-                print(f"Error in predict_loop: {e}")
-                self.predicted_status_label.value = "错误"
-                self.page.update()
-
-            await asyncio.sleep(PREDICTION_INTERVAL_MS / 1000)
+    async def consume_results(self, run_id):
+        """从流水线的结果队列读取预测结果，只有显示内容变化时才重绘界面；停止或开始了新一次监控时退出"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # 阻塞读取放到线程池中，不占用事件循环；界面只显示最新的结果，下位机输出的平滑需要每个tick的结果
+            results = await loop.run_in_executor(None, self.pipeline.drain)
+            if not self.is_running or run_id != self.run_id:
+                break
+            if self.device is not None:
+                for result in results:
+                    if result is not None:
+                        self.device.update(result)
+            result = results[-1]
+            if result is None:
+                break
+            rendered = self.display_state.update(result)
+            if rendered is None:
+                continue
+            label_text, window_text, window_tooltip = rendered
+            self.predicted_status_label.value = label_text
+            self.current_window_label.value = window_text
+            if window_tooltip:
+                self.current_window_label.tooltip = window_tooltip
+            start = time.perf_counter()
+            self.page.update()
+            if self.metrics is not None:
+                self.metrics.observe('render', time.perf_counter() - start)
 
     async def show_dialog(self, title, content):
         dialog = ft.AlertDialog(
@@ -341,7 +282,11 @@ class StatusPredictorApp:
         if e.data == "close":
             if self.is_running:
                 self.is_running = False
-                self.system_monitor.stop()
+                await asyncio.get_running_loop().run_in_executor(None, self.pipeline.stop)
+            if self.device is not None:
+                self.device.close()
+            if self.metrics is not None:
+                self.metrics.close(self.metrics_path)
             self.page.window_destroy()
 
     async def update_dict_view(self):
@@ -351,7 +296,7 @@ class StatusPredictorApp:
                 ft.Row([
                     ft.IconButton(icon=ft.icons.DELETE_FOREVER, icon_color="red400",
                                   tooltip="删除此条目", data=key, on_click=self.delete_entry),
-                    ft.Text(f"标题含: '{key}'", weight=ft.FontWeight.BOLD),
+                    ft.Text(f"标题/进程名含: '{key}'", weight=ft.FontWeight.BOLD),
                     ft.Text(f" -> 标签: {label}"),
                 ], alignment=ft.MainAxisAlignment.START)
             )
@@ -377,6 +322,7 @@ class StatusPredictorApp:
 
         self.dict_key_input.error_text, self.dict_value_input.error_text = None, None
         self.windows_dictionary[key] = value
+        self.window_matcher.update(self.windows_dictionary)
         self.dict_key_input.value, self.dict_value_input.value = "", ""
         
         await self.save_dict_to_csv()
@@ -386,6 +332,7 @@ class StatusPredictorApp:
         key_to_delete = e.control.data
         if key_to_delete in self.windows_dictionary:
             del self.windows_dictionary[key_to_delete]
+            self.window_matcher.update(self.windows_dictionary)
             await self.save_dict_to_csv()
             await self.update_dict_view()
 
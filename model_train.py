@@ -1,36 +1,34 @@
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
+import os
+from sklearn.model_selection import GroupShuffleSplit
 from xgboost import XGBClassifier
 from sklearn.metrics import accuracy_score
 
-# 加载数据集
-df = pd.read_csv('system_log.csv')
-
-# 数据预处理
-# 将时间戳转换为自第一个时间戳以来的总秒数
-df['timestamp'] = pd.to_datetime(df['timestamp'])
-df['timestamp'] = (df['timestamp'] - df['timestamp'].min()).dt.total_seconds()
-
-# 对 'label' 列进行编码
-label_encoder = LabelEncoder()
-df['label'] = label_encoder.fit_transform(df['label'])
-
-# 分离特征 (X) 和目标 (y)
-X = df.drop('label', axis=1)
-y = df['label']
-
-# 将数据拆分为训练集和测试集
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+from dataset_store import STORE_DIR, DatasetStore
+
+# 加载数据集 (由 data_processs.py 生成的内存映射数据集，特征为float32，已按会话建立索引)
+train_store = DatasetStore(os.path.join(STORE_DIR, 'train'))
+X, y = train_store.take()
+
+test_path = os.path.join(STORE_DIR, 'test')
+if os.path.exists(test_path):
+    # 使用独立采集的测试集
+    test_store = DatasetStore(test_path)
+    X_train, y_train = X, y
+    X_test, y_test = test_store.take()
+else:
+    # 没有测试集时按会话划分，同一会话的数据不会同时出现在训练集和测试集中
+    splitter = GroupShuffleSplit(n_splits=1, test_size=0.2, random_state=42)
+    train_rows, test_rows = next(splitter.split(X, y, groups=train_store.groups()))
+    X_train, y_train = train_store.take(train_rows)
+    X_test, y_test = train_store.take(test_rows)
 
 # 初始化并训练 XGBoost 模型
-# We set `use_label_encoder=False` to avoid a deprecation warning.
 # `eval_metric='mlogloss'` is used for multiclass classification.
-model = XGBClassifier(use_label_encoder=False, eval_metric='mlogloss')
+model = XGBClassifier(objective='multi:softprob', num_class=len(train_store.classes), eval_metric='mlogloss')
 model.fit(X_train, y_train)
 
 # 进行预测并评估模型
 y_pred = model.predict(X_test)
 accuracy = accuracy_score(y_test, y_pred)
 
-print(f"模型的准确率为: {accuracy}")
\ No newline at end of file
+print(f"模型的准确率为: {accuracy}")
@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import xgboost as xgb
+
+from dataset_store import STORE_DIR, DatasetStore, build_store
+from train_external import balanced_weights, export
+
+DEFAULT_ROUNDS = 20
+DEFAULT_HOLDOUT = 0.25
+# 更新后的准确率最多允许比旧模型低这么多，超过则不发布
+DEFAULT_TOLERANCE = 0.01
+
+
+def load_model(model_path='xgboost_model.joblib', encoder_path='label_encoder.joblib'):
+    """读取当前发布的模型，返回 (booster, 类别列表)"""
+    import joblib
+    booster = joblib.load(model_path).get_booster()
+    classes = [str(c) for c in joblib.load(encoder_path).classes_]
+    return booster, classes
+
+
+def store_from_logs(paths, path, classes, cache_dir=None):
+    """用 data_processs.py 的流水线预处理新采集的日志，按已有模型的类别编码写成数据集"""
+    from data_processs import CACHE_DIR, PreprocessCache, combine, load_processed
+    cache = PreprocessCache(cache_dir or CACHE_DIR)
+    frames, _ = load_processed(paths, cache)
+    cache.save_index()
+    return build_store(combine(frames, [os.path.basename(p) for p in paths]), path, classes)
+
+
+def split_holdout(store, rows, fraction=DEFAULT_HOLDOUT, seed=0):
+    """
+    按会话留出一部分新数据用于回归检查，同一会话不会同时出现在两侧；
+    只有一个会话时留出时间上最后的 fraction 部分。
+    """
+    from sklearn.model_selection import GroupShuffleSplit
+    groups = store.groups(rows)
+    if len(np.unique(groups)) < 2:
+        n_holdout = max(1, int(len(rows) * fraction))
+        return rows[:-n_holdout], rows[-n_holdout:]
+    splitter = GroupShuffleSplit(n_splits=1, test_size=fraction, random_state=seed)
+    train_idx, holdout_idx = next(splitter.split(rows, groups=groups))
+    return rows[train_idx], rows[holdout_idx]
+
+
+def score(booster, X, y, n_classes):
+    """返回 (准确率, mlogloss)"""
+    from sklearn.metrics import log_loss
+    proba = booster.predict(xgb.DMatrix(X, feature_names=booster.feature_names))
+    return float((proba.argmax(axis=1) == y).mean()), float(log_loss(y, proba, labels=range(n_classes)))
+
+
+def tree_params(booster):
+    """已发布模型训练时的 learning_rate 与 max_depth (joblib保存的booster带有训练配置)"""
+    tree = json.loads(booster.save_config())['learner']['gradient_booster'].get('tree_train_param')
+    if tree is None:
+        return {}
+    return {'learning_rate': float(tree['learning_rate']), 'max_depth': int(tree['max_depth'])}
+
+
+def update_booster(booster, X, y, mode='continue', rounds=DEFAULT_ROUNDS, params=None, weight=None):
+    """
+    mode='continue'：在旧模型之后用新数据继续训练 rounds 棵树，学习率和树深沿用旧模型；
+    mode='refresh'：树结构不变，只用新数据重新计算叶子值。weight 为每行的样本权重。返回新的booster，旧booster不变。
+    """
+    n_classes = int(booster.attr('num_class') or 0) or None
+    dtrain = xgb.DMatrix(X, label=y, weight=weight, feature_names=booster.feature_names)
+    if mode == 'continue':
+        train_params = {'objective': 'multi:softprob', 'eval_metric': 'mlogloss', 'tree_method': 'hist',
+                        **tree_params(booster)}
+        num_boost_round = rounds
+    elif mode == 'refresh':
+        train_params = {'process_type': 'update', 'updater': 'refresh', 'refresh_leaf': True}
+        num_boost_round = booster.num_boosted_rounds()
+    else:
+        raise ValueError(f"未知的更新方式: {mode}")
+    if n_classes:
+        train_params['num_class'] = n_classes
+    train_params.update(params or {})
+    # xgb.train 会复制 xgb_model，旧booster仍可用于对比
+    return xgb.train(train_params, dtrain, num_boost_round=num_boost_round, xgb_model=booster)
+
+
+def run_update(store, rows, model_path='xgboost_model.joblib', encoder_path='label_encoder.joblib',
+               mode='continue', rounds=DEFAULT_ROUNDS, holdout=DEFAULT_HOLDOUT, tolerance=DEFAULT_TOLERANCE,
+               reference=None, publish=True, force=False, seed=0, bundle_path=None):
+    """
+    用 store 中的 rows 更新模型：留出部分会话，在其余数据上更新，对比新旧模型在留出数据
+    (以及 reference 数据集，用于检查旧类别是否退化) 上的准确率，没有退化时原子地替换模型文件。
+    给出 bundle_path 时同时更新模型包 (沿用其中的空闲基准，并在元数据中记录本次更新)。返回报告字典。
+    """
+    start = time.perf_counter()
+    booster, classes = load_model(model_path, encoder_path)
+    if store.classes != classes:
+        raise ValueError(f"数据集的类别 {store.classes} 与模型的类别 {classes} 不一致")
+    train_rows, holdout_rows = split_holdout(store, np.asarray(rows), holdout, seed)
+    X_train, y_train = store.take(train_rows)
+    X_holdout, y_holdout = store.take(holdout_rows)
+
+    checks = {'holdout': (X_holdout, y_holdout)}
+    if reference is not None:
+        checks['reference'] = reference.take()
+    before = {name: score(booster, X, y, len(classes)) for name, (X, y) in checks.items()}
+    # 与 train_external/tune 一样按类别加权，一天内不均衡的新数据不会改变各类别的先验
+    weight = balanced_weights(np.bincount(y_train, minlength=len(classes)))[y_train]
+    updated = update_booster(booster, X_train, y_train, mode, rounds, weight=weight)
+    after = {name: score(updated, X, y, len(classes)) for name, (X, y) in checks.items()}
+
+    regressions = [name for name in checks if after[name][0] < before[name][0] - tolerance]
+    report = {
+        'mode': mode, 'train_rows': len(train_rows), 'holdout_rows': len(holdout_rows),
+        'trees_before': booster.num_boosted_rounds(), 'trees_after': updated.num_boosted_rounds(),
+        'before': before, 'after': after, 'regressions': regressions,
+        'published': False, 'seconds': 0.0,
+    }
+    if publish and (force or not regressions):
+        if os.path.exists(model_path):
+            # 保留上一版模型，便于回滚
+            shutil.copy2(model_path, model_path + '.bak')
+        metadata = None
+        if bundle_path and os.path.exists(bundle_path):
+            from model_bundle import ModelBundle
+            metadata = dict(ModelBundle.open(bundle_path).metadata, last_update={
+                'mode': mode, 'rows': len(train_rows), 'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'holdout_accuracy': after['holdout'][0]})
+        export(updated, classes, model_path, encoder_path, bundle_path, metadata=metadata)
+        report['published'] = True
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+
+def print_report(report):
+    print(f"更新方式 {report['mode']}: 训练 {report['train_rows']} 行, 留出 {report['holdout_rows']} 行, "
+          f"树 {report['trees_before']} -> {report['trees_after']}")
+    for name in report['before']:
+        (acc0, loss0), (acc1, loss1) = report['before'][name], report['after'][name]
+        print(f"  {name}: 准确率 {acc0:.4f} -> {acc1:.4f} ({acc1 - acc0:+.4f}), mlogloss {loss0:.4f} -> {loss1:.4f}")
+    if report['published']:
+        print(f"已发布新模型 ({report['seconds']:.2f}s)")
+    elif report['regressions']:
+        print(f"Warning: {report['regressions']} 上的准确率下降超过允许范围，未发布新模型")
+    else:
+        print(f"未发布新模型 ({report['seconds']:.2f}s)")
+
+
+# ---------- 测试 ----------
+def check_update():
+    """
+    合成数据：旧模型在数据集A上训练；新数据B的分布不同。
+    以A为参照集、容差为0时更新会因旧数据退化而被拒绝，模型文件保持不变；
+    不设参照集时继续训练/刷新叶子值能提升B的留出准确率并发布，发布的文件可被 tree_engine 读取且预测一致。
+    """
+    from train_external import write_synthetic_store
+    from tree_engine import TreeEnsemble
+    with tempfile.TemporaryDirectory() as root:
+        old = write_synthetic_store(os.path.join(root, 'old'), 20_000, 15, seed=0)
+        new = write_synthetic_store(os.path.join(root, 'new'), 4_000, 15, seed=1)
+        model_path, encoder_path = os.path.join(root, 'model.joblib'), os.path.join(root, 'encoder.joblib')
+        X, y = old.take()
+        base = xgb.train({'objective': 'multi:softprob', 'num_class': 4, 'tree_method': 'hist', 'max_depth': 4},
+                         xgb.DMatrix(X, label=y, feature_names=old.feature_names), num_boost_round=30)
+        export(base, old.classes, model_path, encoder_path)
+
+        published = open(model_path, 'rb').read()
+        report = run_update(new, np.arange(len(new)), model_path, encoder_path, tolerance=0.0, reference=old)
+        print_report(report)
+        assert not report['published'] and 'reference' in report['regressions']
+        assert open(model_path, 'rb').read() == published, "被拒绝的更新修改了模型文件"
+
+        for mode in ('continue', 'refresh'):
+            report = run_update(new, np.arange(len(new)), model_path, encoder_path, mode=mode)
+            print_report(report)
+            assert report['published'] and report['after']['holdout'][0] > report['before']['holdout'][0]
+            assert tree_params(load_model(model_path, encoder_path)[0])['max_depth'] == 4, "新增的树没有沿用旧模型的树深"
+
+        engine = TreeEnsemble.from_joblib(model_path, encoder_path)
+        booster, _ = load_model(model_path, encoder_path)
+        X_new, _ = new.take(np.arange(200))
+        expected = booster.predict(xgb.DMatrix(X_new, feature_names=booster.feature_names))
+        actual = engine.predict_proba(X_new)
+        assert np.allclose(actual, expected, atol=1e-5), "发布的模型与 tree_engine 的预测不一致"
+        print("增量更新检查通过")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用新采集的会话增量更新已发布的XGBoost模型")
+    parser.add_argument('logs', nargs='*', help="新采集的日志文件 (csv/csv.gz/列式日志段)")
+    parser.add_argument('--store', default=None, help="改为从已有数据集中选取新数据")
+    parser.add_argument('--since', default=None, help="与 --store 一起使用：只取该时间之后的会话，如 2025-09-24")
+    parser.add_argument('--sources', nargs='*', default=None, help="与 --store 一起使用：只取这些来源文件的会话")
+    parser.add_argument('--mode', choices=['continue', 'refresh'], default='continue',
+                        help="continue: 继续训练新的树；refresh: 只重新计算已有树的叶子值")
+    parser.add_argument('--rounds', type=int, default=DEFAULT_ROUNDS, help="continue 模式新增的树的轮数")
+    parser.add_argument('--holdout', type=float, default=DEFAULT_HOLDOUT, help="留出用于回归检查的会话比例")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="允许的准确率下降")
+    parser.add_argument('--reference', default=None,
+                        help="同时检查该数据集上的准确率，默认为 dataset_store/test (若存在)")
+    parser.add_argument('--model', default='xgboost_model.joblib')
+    parser.add_argument('--encoder', default='label_encoder.joblib')
+    parser.add_argument('--bundle', default='model.bundle', help="同时更新的模型包，为空字符串时不写")
+    parser.add_argument('--dry-run', action='store_true', help="只报告，不发布")
+    parser.add_argument('--force', action='store_true', help="即使准确率下降也发布")
+    parser.add_argument('--check', action='store_true', help="在合成数据上运行检查")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        check_update()
+        return
+    reference_path = args.reference
+    if reference_path is None and os.path.exists(os.path.join(STORE_DIR, 'test')):
+        reference_path = os.path.join(STORE_DIR, 'test')
+    reference = DatasetStore(reference_path) if reference_path else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.store:
+            store = DatasetStore(args.store)
+            rows = store.select(sources=args.sources, start=args.since)
+        elif args.logs:
+            _, classes = load_model(args.model, args.encoder)
+            store = store_from_logs(args.logs, os.path.join(tmp, 'new'), classes)
+            rows = np.arange(len(store))
+        else:
+            parser.error("需要给出新的日志文件或 --store")
+        if len(rows) == 0:
+            print("没有新的数据")
+            return
+        report = run_update(store, rows, args.model, args.encoder, args.mode, args.rounds, args.holdout,
+                            args.tolerance, reference, publish=not args.dry_run, force=args.force,
+                            bundle_path=args.bundle)
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import time
+import numpy as np
+import pandas as pd
+
+from feature_engine import FINAL_FEATURE_COLUMNS, FEATURE_WINDOW_SECONDS
+
+# 会话切分阈值：相邻两条记录间隔超过该值时视为新的采集会话
+SESSION_GAP_SECONDS = 60
+
+# 需要做滑窗求和的列，顺序与训练时生成的特征列一致
+WINDOW_COLUMNS = [col[:-len('_freq')] for col in FINAL_FEATURE_COLUMNS if col.endswith('_freq')]
+
+# 可选的窗口长度 (秒)
+DEFAULT_WINDOWS = (FEATURE_WINDOW_SECONDS,)
+MULTI_WINDOWS = (10, 30, 60, 300)
+
+_NS_PER_SECOND = 1_000_000_000
+
+
+def window_column_name(col, seconds):
+    """滑窗列名：模型使用的10s窗口沿用 f'{col}_freq'，其余窗口加后缀，如 f'{col}_freq_30s'"""
+    if seconds == FEATURE_WINDOW_SECONDS:
+        return f'{col}_freq'
+    return f'{col}_freq_{seconds}s'
+
+
+def segment_sessions(times_ns, gap_seconds=SESSION_GAP_SECONDS):
+    """按时间间隔切分会话，times_ns 为已排序的int64纳秒时间戳，返回每行的会话编号 (从0开始)"""
+    session_id = np.zeros(len(times_ns), dtype=np.int64)
+    if len(times_ns) > 1:
+        np.cumsum(np.diff(times_ns) > gap_seconds * _NS_PER_SECOND, out=session_id[1:])
+    return session_id
+
+
+def window_starts(times_ns, session_id, seconds):
+    """
+    每行所在时间窗 (t - seconds, t] 的起始行号，窗口不跨越会话。
+    与pandas按时间滚动的规则一致：左开右闭，同一时刻的重复记录只包含当前行及其之前的行。
+    """
+    starts = np.searchsorted(times_ns, times_ns - seconds * _NS_PER_SECOND, side='right')
+    # 每个会话的第一行的行号
+    session_start = np.flatnonzero(np.r_[True, session_id[1:] != session_id[:-1]])
+    np.maximum(starts, session_start[session_id], out=starts)
+    return starts
+
+
+def prefix_sums(values):
+    """一列数值的前缀和 (首项为0)，NaN按0处理。整数列使用int64，结果精确；浮点列使用float64"""
+    values = np.asarray(values)
+    if values.dtype.kind in 'iub':
+        prefix = np.zeros(len(values) + 1, dtype=np.int64)
+    else:
+        prefix = np.zeros(len(values) + 1, dtype=np.float64)
+        values = np.nan_to_num(values, nan=0.0)
+    np.cumsum(values, out=prefix[1:])
+    return prefix
+
+
+def rolling_window_sums(prefix, starts, dtype=np.float64):
+    """由前缀和与窗口起始行号得到每行的滑窗求和"""
+    result = prefix[1:] - prefix[starts]
+    return result.astype(dtype, copy=False)
+
+
+def add_window_features(df, windows=DEFAULT_WINDOWS, columns=WINDOW_COLUMNS,
+                        session_gap_seconds=SESSION_GAP_SECONDS, dtype=np.float64):
+    """
+    对按时间排序、timestamp为datetime的DataFrame切分会话并添加滑窗特征列 (原地添加并返回)。
+    每个窗口长度的起始行号只用searchsorted计算一次，每列只做一次前缀和，所有窗口共用。
+    dtype 为结果列的类型，数据量很大时可用float32减半内存 (前缀和本身仍为int64/float64)。
+    """
+    times_ns = df['timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    session_id = segment_sessions(times_ns, session_gap_seconds)
+    df['session_id'] = session_id
+
+    starts = {seconds: window_starts(times_ns, session_id, seconds) for seconds in windows}
+    new_columns = {}
+    for col in columns:
+        prefix = prefix_sums(df[col].to_numpy())
+        for seconds in windows:
+            new_columns[window_column_name(col, seconds)] = rolling_window_sums(prefix, starts[seconds], dtype)
+    # 列顺序：窗口长度优先，同一窗口内按 columns 的顺序
+    for seconds in windows:
+        for col in columns:
+            name = window_column_name(col, seconds)
+            df[name] = new_columns.pop(name)
+    return df
+
+
+def build_features(df, windows=DEFAULT_WINDOWS, label_encoder=None, session_gap_seconds=SESSION_GAP_SECONDS):
+    """
+    训练用数据的完整预处理，结果与原notebook的逐列 groupby().rolling() 一致：
+    按时间排序 -> 切分会话 -> 滑窗求和 -> timestamp换算为相对秒数 -> 标签编码 -> NaN填0。
+    label_encoder 为None时新建LabelEncoder并fit，否则直接transform。返回 (DataFrame, label_encoder)。
+    """
+    from sklearn.preprocessing import LabelEncoder
+    df = df.copy()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    add_window_features(df, windows, session_gap_seconds=session_gap_seconds)
+    df['timestamp'] = (df['timestamp'] - df['timestamp'].min()).dt.total_seconds()
+    if label_encoder is None:
+        label_encoder = LabelEncoder()
+        df['label'] = label_encoder.fit_transform(df['label'])
+    else:
+        df['label'] = label_encoder.transform(df['label'])
+    df.fillna(0, inplace=True)
+    return df, label_encoder
+
+
+def load_features(path, windows=DEFAULT_WINDOWS, label_encoder=None):
+    """读取采集日志CSV并完成预处理，返回 (DataFrame, label_encoder)"""
+    return build_features(pd.read_csv(path), windows, label_encoder)
+
+
+# ---------- 校验与性能测试 ----------
+def _reference_features(df, windows=DEFAULT_WINDOWS, columns=WINDOW_COLUMNS):
+    """原notebook中的实现：每个窗口、每一列各做一次 groupby('session_id').rolling().sum()"""
+    df = df.copy()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    df['session_id'] = (df['timestamp'].diff() > pd.Timedelta(seconds=SESSION_GAP_SECONDS)).cumsum()
+    df = df.set_index('timestamp')
+    for seconds in windows:
+        for col in columns:
+            rolled = df.groupby('session_id')[col].rolling(window=f'{seconds}s').sum()
+            df[window_column_name(col, seconds)] = rolled.reset_index(level=0, drop=True)
+    return df.reset_index()
+
+
+def _assert_close(ours, theirs, name):
+    ours, theirs = np.asarray(ours, dtype=np.float64), np.asarray(theirs, dtype=np.float64)
+    # 浮点前缀和相减与pandas的滑动累加在舍入上略有差异，按数值量级给出容差
+    tolerance = 1e-9 * np.maximum(np.abs(theirs), 1.0) + 1e-6
+    bad = np.flatnonzero(~(np.abs(ours - theirs) <= tolerance))
+    assert len(bad) == 0, f"{name}: {len(bad)} 行不一致, 例如第{bad[0]}行 {ours[bad[0]]} != {theirs[bad[0]]}"
+
+
+def check_parity(log_path='system_log.csv', processed_path='processed_system.csv'):
+    """与仓库中notebook生成的 processed_system.csv 逐列比较，并在多窗口下与逐列pandas实现比较"""
+    raw = pd.read_csv(log_path)
+    ours, _ = build_features(raw)
+    expected = pd.read_csv(processed_path)
+    assert list(ours.columns) == list(expected.columns), f"列不一致: {list(ours.columns)}"
+    for col in expected.columns:
+        if col == 'label' or col == 'session_id':
+            assert (ours[col].to_numpy() == expected[col].to_numpy()).all(), f"{col} 不一致"
+        else:
+            _assert_close(ours[col], expected[col], col)
+
+    df = raw.copy()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    add_window_features(df, MULTI_WINDOWS)
+    reference = _reference_features(raw, MULTI_WINDOWS)
+    for seconds in MULTI_WINDOWS:
+        for col in WINDOW_COLUMNS:
+            name = window_column_name(col, seconds)
+            _assert_close(df[name].fillna(0), reference[name].fillna(0), name)
+    return len(ours)
+
+
+def synthetic_log(n_rows, seed=0):
+    """生成n_rows行的合成采集日志：1秒采样，每约1小时插入一次超过阈值的间隔"""
+    rng = np.random.default_rng(seed)
+    steps = np.full(n_rows, _NS_PER_SECOND, dtype=np.int64)
+    steps[rng.random(n_rows) < 1 / 3600] = 300 * _NS_PER_SECOND
+    steps[0] = 0
+    times = np.datetime64('2025-09-01', 'ns') + np.cumsum(steps).astype('timedelta64[ns]')
+    data = {'timestamp': times}
+    for col in WINDOW_COLUMNS:
+        if col == 'mouse_distance':
+            data[col] = rng.exponential(200.0, n_rows)
+        elif col.startswith(('mouse', 'keyboard')):
+            data[col] = rng.poisson(1.0, n_rows)
+        else:
+            data[col] = rng.integers(0, 1 << 20, n_rows)
+    return pd.DataFrame(data)
+
+
+def benchmark(n_rows=10_000_000, reference_rows=200_000):
+    """
+    合成日志上的耗时：向量化实现跑完整的 n_rows 行 (结果列为float32，4个窗口共44列)，
+    pandas实现只跑 reference_rows 行后按比例换算
+    """
+    df = synthetic_log(n_rows)
+    start = time.perf_counter()
+    add_window_features(df, MULTI_WINDOWS, dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    print(f"向量化 ({len(MULTI_WINDOWS)}个窗口 x {len(WINDOW_COLUMNS)}列): {n_rows:,}行 {elapsed:.2f}s "
+          f"({n_rows / elapsed / 1e6:.2f}M行/s)")
+
+    small = synthetic_log(reference_rows)
+    start = time.perf_counter()
+    _reference_features(small, MULTI_WINDOWS)
+    reference_elapsed = (time.perf_counter() - start) * n_rows / reference_rows
+    print(f"groupby-rolling: {reference_rows:,}行实测，折算{n_rows:,}行约 {reference_elapsed:.1f}s "
+          f"(约{reference_elapsed / elapsed:.0f}倍)")
+
+
+if __name__ == "__main__":
+    print(f"与 processed_system.csv 一致性校验通过: {check_parity()} 行")
+    benchmark()
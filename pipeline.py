@@ -0,0 +1,315 @@
+import queue
+import threading
+import time
+
+from feature_engine import MIN_BUFFER_ROWS, RollingFeatureEngine
+from scheduler import TickScheduler
+
+
+class PredictionResult:
+    """流水线每个tick发布的结果"""
+    __slots__ = ('status', 'label', 'model_label', 'probabilities', 'features',
+                 'window_title', 'process_name', 'buffered', 'tick', 'timestamp', 'error')
+
+    def __init__(self, status, label="", model_label="", probabilities=None, features=None,
+                 window_title="", process_name="", buffered=0, tick=0, timestamp=0.0, error=None):
+        self.status = status                # 'collecting' | 'ok' | 'error'
+        self.label = label                  # 最终判定 (字典规则 + 模型)
+        self.model_label = model_label      # 模型的原始预测
+        self.probabilities = probabilities  # 各类别概率，顺序同模型的类别列表
+        self.features = features            # 特征向量，顺序同 FINAL_FEATURE_COLUMNS
+        self.window_title = window_title    # None表示获取失败
+        self.process_name = process_name
+        self.buffered = buffered            # 缓冲区中的数据条数
+        self.tick = tick
+        self.timestamp = timestamp          # time.time()
+        self.error = error
+
+
+class MonitorPipeline:
+    """
+    采集 -> 特征 -> 预测 -> 字典决策 的完整流水线，在独立的工作线程中按固定频率运行，
+    结果通过有界队列发布给UI等消费者，队列满时丢弃最旧的结果。
+    recorder 需提供 start()/stop()/get_and_reset_data()，若有 probe_results['window'] 则用作前景窗口。
+    给出 metrics (metrics.Metrics) 时记录各阶段耗时及tick、延迟、跳过和丢弃的次数。
+    """
+    def __init__(self, recorder, model, window_matcher, idle_means, interval=1.0,
+                 queue_size=16, clock=time.monotonic, sleep=None, metrics=None):
+        self.recorder = recorder
+        self.model = model
+        self.window_matcher = window_matcher
+        self.idle_means = idle_means  # 与UI共享的字典，校准后原地更新
+        self.interval = interval
+        self.clock = clock
+        self.results = queue.Queue(maxsize=queue_size)
+        self.feature_engine = RollingFeatureEngine()
+        self.scheduler = None
+        self.dropped_results = 0
+        self.metrics = metrics
+        self._stop_event = threading.Event()
+        # 默认在停止事件上等待，stop() 可以立即唤醒工作线程
+        self.sleep = sleep or self._stop_event.wait
+        self._thread = None
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        if self._thread is not None:
+            return
+        self.feature_engine.reset()
+        while not self.results.empty():  # 丢弃上一次运行遗留的结果
+            self.results.get_nowait()
+        self._stop_event.clear()
+        self.recorder.start()
+        self._thread = threading.Thread(target=self._run, name='monitor-pipeline', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join(timeout=self.interval * 2)
+        self._thread = None
+        self.recorder.stop()
+        self.publish(None)  # 通知消费者流水线已停止
+
+    def wait_stopped(self, timeout=None):
+        """阻塞直到 stop() 被调用 (或超时)，返回是否已停止"""
+        return self._stop_event.wait(timeout)
+
+    def latest(self, block=True):
+        """取出队列中最新的一条结果，跳过积压的旧结果；流水线已停止时返回None"""
+        return self.drain(block)[-1]
+
+    def drain(self, block=True):
+        """按顺序取出队列中的全部结果 (至少一条)；流水线已停止时最后一个元素为None"""
+        results = [self.results.get(block)]
+        while results[-1] is not None:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        return results
+
+    def _run(self):
+        self.scheduler = TickScheduler(self.interval, clock=self.clock, sleep=self.sleep)
+        while not self._stop_event.is_set():
+            tick = self.scheduler.wait()
+            if self._stop_event.is_set():
+                break
+            if self.metrics is not None:
+                self.metrics.count('ticks_total')
+                if tick.missed:
+                    self.metrics.count('missed_ticks_total', tick.missed)
+                if tick.lateness > self.scheduler.late_threshold:
+                    self.metrics.count('late_ticks_total')
+            self.publish(self.step(tick.index))
+
+    # ---------- 单步 ----------
+    def step(self, tick=0, timestamp=None):
+        """执行一次 采集 -> 特征 -> 预测 -> 决策，返回 PredictionResult"""
+        metrics = self.metrics
+        start = now = time.perf_counter()
+        try:
+            raw_data = self.recorder.get_and_reset_data()
+            if metrics is not None:
+                now = metrics.lap('probe', now)
+            probe_results = getattr(self.recorder, 'probe_results', None) or {}
+            window = probe_results.get('window')
+            window_title, process_name = window.value if window is not None else ("", "")
+
+            if raw_data is None:
+                return PredictionResult('collecting', window_title=window_title, process_name=process_name,
+                                        buffered=len(self.feature_engine), tick=tick, timestamp=time.time())
+
+            # 使用单调时钟，避免系统时间调整打乱滑窗
+            self.feature_engine.push(raw_data, self.clock() if timestamp is None else timestamp)
+            if not self.feature_engine.is_ready():
+                return PredictionResult('collecting', window_title=window_title, process_name=process_name,
+                                        buffered=len(self.feature_engine), tick=tick, timestamp=time.time())
+
+            features = self.feature_engine.features(self.idle_means).copy()
+            if metrics is not None:
+                now = metrics.lap('features', now)
+            model_label, probabilities = self.model.predict_one(features)
+            if metrics is not None:
+                now = metrics.lap('model', now)
+            label = self.window_matcher.decide(model_label, window_title or "", process_name)
+            if metrics is not None:
+                metrics.lap('rules', now)
+                metrics.lap('step', start)
+            return PredictionResult('ok', label=label, model_label=model_label, probabilities=probabilities,
+                                    features=features, window_title=window_title, process_name=process_name,
+                                    buffered=len(self.feature_engine), tick=tick, timestamp=time.time())
+        except Exception as e:
+            print(f"Error in pipeline: {e}")
+            if metrics is not None:
+                metrics.count('pipeline_errors_total')
+            return PredictionResult('error', tick=tick, timestamp=time.time(), error=str(e))
+
+    def publish(self, result):
+        """非阻塞地放入结果队列，满时丢弃最旧的一条"""
+        while True:
+            try:
+                self.results.put_nowait(result)
+                return
+            except queue.Full:
+                try:
+                    self.results.get_nowait()
+                    self.dropped_results += 1
+                    if self.metrics is not None:
+                        self.metrics.count('dropped_results_total')
+                except queue.Empty:
+                    pass
+
+
+def render_result(result):
+    """将结果转换为界面上显示的 (预测标签文本, 窗口文本, 窗口提示)"""
+    title = result.window_title
+    if title is None:
+        window_text, window_tooltip = "当前窗口: 获取失败", None
+    elif title:
+        display_title = (title[:45] + '...') if len(title) > 45 else title
+        window_text, window_tooltip = f"当前窗口: {display_title}", f"完整标题: {title}"
+    else:
+        window_text, window_tooltip = "当前窗口: 无", None
+
+    if result.status == 'collecting':
+        label_text = f"收集中 {result.buffered}/{MIN_BUFFER_ROWS}"
+    elif result.status == 'error':
+        label_text = "错误"
+    else:
+        label_text = result.label.upper()
+    return label_text, window_text, window_tooltip
+
+
+class DisplayState:
+    """记录当前界面显示的内容，只有显示内容变化时才需要重绘"""
+    def __init__(self):
+        self.rendered = None
+        self.redraws = 0
+
+    def update(self, result):
+        """返回新的显示内容；与当前显示相同时返回None"""
+        rendered = render_result(result)
+        if rendered == self.rendered:
+            return None
+        self.rendered = rendered
+        self.redraws += 1
+        return rendered
+
+    def reset(self):
+        self.rendered = None
+
+
+# ---------- 无界面测试 ----------
+_TEST_IDLE_MEANS = {'cpu_percent': 0, 'ram_percent': 0, 'gpu_percent': 0, 'gpu_vram_percent': 0}
+
+
+class FakeRecorder:
+    """按预设序列返回原始数据和前景窗口的假采集器"""
+    def __init__(self, rows, windows=None):
+        self.rows = list(rows)
+        self.windows = windows
+        self.index = 0
+        self.probe_results = {}
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def get_and_reset_data(self):
+        from probe_runner import ProbeResult
+        row = self.rows[self.index % len(self.rows)]
+        window = self.windows[self.index % len(self.windows)] if self.windows else ("", "")
+        self.probe_results = {'window': ProbeResult(window, False, 0.0, time.monotonic())}
+        self.index += 1
+        return row
+
+
+class FakeModel:
+    """按键盘计数给出标签的假模型"""
+    classes = ['coding', 'gaming', 'idle', 'video']
+
+    def predict_one(self, features):
+        import numpy as np
+        from feature_engine import FINAL_FEATURE_COLUMNS
+        keys = features[FINAL_FEATURE_COLUMNS.index('keyboard_counts_freq')]
+        label = 'coding' if keys > 20 else 'idle'
+        proba = np.zeros(len(self.classes), dtype=np.float32)
+        proba[self.classes.index(label)] = 1.0
+        return label, proba
+
+
+def check_headless(ticks=300):
+    """
+    用假采集器和假模型驱动流水线 (假时钟，不sleep)，模拟UI消费结果并统计重绘次数：
+    前景窗口和用户状态每60个tick才变化一次，重绘次数应远小于tick数。
+    """
+    from feature_engine import RAW_DATA_COLUMNS
+    from scheduler import FakeClock
+    from window_matcher import WindowMatcher
+
+    idle_row = [0.0] * len(RAW_DATA_COLUMNS)
+    typing_row = list(idle_row)
+    typing_row[RAW_DATA_COLUMNS.index('keyboard_counts')] = 5
+    rows = [idle_row] * 60 + [typing_row] * 60
+    windows = [("Visual Studio Code", "Code.exe")] * 90 + [("bilibili - 视频", "msedge.exe")] * 90
+
+    clock = FakeClock()
+    pipeline = MonitorPipeline(FakeRecorder(rows, windows), FakeModel(),
+                               WindowMatcher({'bilibili': 'video'}),
+                               _TEST_IDLE_MEANS, queue_size=ticks + 1, clock=clock, sleep=clock.sleep)
+    scheduler = TickScheduler(1.0, clock=clock, sleep=clock.sleep)
+    for _ in range(ticks):
+        tick = scheduler.wait()
+        pipeline.publish(pipeline.step(tick.index))
+
+    display = DisplayState()
+    consumed = 0
+    labels = []
+    while not pipeline.results.empty():
+        result = pipeline.results.get_nowait()
+        consumed += 1
+        rendered = display.update(result)
+        if rendered is not None:
+            labels.append(rendered[0])
+    assert consumed == ticks
+    assert display.redraws < ticks // 10, f"重绘次数过多: {display.redraws}"
+    assert 'VIDEO' in labels and 'CODING' in labels and 'IDLE' in labels
+    return {'ticks': ticks, 'redraws': display.redraws, 'labels': labels}
+
+
+def check_threaded(interval=0.01, duration=0.5):
+    """在真实工作线程中运行流水线，消费者阻塞读取最新结果，验证能及时停止并收到结束通知"""
+    from feature_engine import RAW_DATA_COLUMNS
+    from window_matcher import WindowMatcher
+
+    pipeline = MonitorPipeline(FakeRecorder([[0.0] * len(RAW_DATA_COLUMNS)], [("Explorer", "explorer.exe")]),
+                               FakeModel(), WindowMatcher({}), _TEST_IDLE_MEANS, interval=interval)
+    display = DisplayState()
+    received = 0
+    pipeline.start()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        result = pipeline.latest()
+        received += 1
+        display.update(result)
+    stop_start = time.perf_counter()
+    pipeline.stop()
+    stop_latency = time.perf_counter() - stop_start
+    while pipeline.latest() is not None:
+        pass
+    assert received > 0 and display.rendered[0] == 'IDLE'
+    assert stop_latency < interval * 2 + 0.05, f"停止耗时过长 {stop_latency * 1000:.1f}ms"
+    return {'received': received, 'redraws': display.redraws, 'stop_ms': stop_latency * 1000}
+
+
+if __name__ == "__main__":
+    threaded = check_threaded()
+    print(f"工作线程测试通过: 收到 {threaded['received']} 条结果, 重绘 {threaded['redraws']} 次, "
+          f"停止耗时 {threaded['stop_ms']:.1f}ms")
+    result = check_headless()
+    print(f"无界面测试通过: {result['ticks']} 个tick, 重绘 {result['redraws']} 次")
+    print(f"显示序列: {result['labels']}")
@@ -0,0 +1,222 @@
+import concurrent.futures
+import time
+
+
+class Probe:
+    """一个采集项：func() 返回采集值，deadline 为每个tick内允许的最长等待时间 (秒)"""
+    def __init__(self, name, func, deadline=0.2, default=None):
+        self.name = name
+        self.func = func
+        self.deadline = deadline
+        self.default = default
+
+
+class ProbeResult:
+    """单个采集项在一个tick内的结果。stale为True表示本次未按时返回，value为最近一次的有效值"""
+    __slots__ = ('value', 'stale', 'latency', 'timestamp', 'error')
+
+    def __init__(self, value, stale, latency, timestamp, error=None):
+        self.value = value
+        self.stale = stale
+        self.latency = latency      # 最近一次完成的采集耗时 (秒)
+        self.timestamp = timestamp  # 最近一次有效值的采集完成时刻 (time.monotonic)
+        self.error = error
+
+    def __repr__(self):
+        return f"ProbeResult(value={self.value!r}, stale={self.stale}, latency={self.latency * 1000:.1f}ms)"
+
+
+class _ProbeState:
+    def __init__(self, probe):
+        self.probe = probe
+        self.future = None
+        self.value = probe.default
+        self.timestamp = None
+        self.latency = 0.0
+        self.error = None
+        # 统计
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+
+class ProbeRunner:
+    """
+    在小线程池中并发执行所有采集项，每个采集项有独立的截止时间。
+    超时的采集项不会阻塞本次tick，而是返回上一次的值并标记为stale；
+    仍在执行的调用不会被重复提交，完成后其结果用于之后的tick。
+    close() 释放线程池，之后再次 collect() 时重新创建，统计数据保留。
+    """
+    def __init__(self, probes, max_workers=None, clock=time.monotonic):
+        self.clock = clock
+        self.probes = list(probes)
+        self._states = {probe.name: _ProbeState(probe) for probe in self.probes}
+        self.max_workers = max_workers or len(self._states)
+        self._executor = None
+
+    def _timed_call(self, state):
+        start = self.clock()
+        value = state.probe.func()
+        return value, start, self.clock()
+
+    def _harvest(self, state):
+        """读取已完成的调用结果，更新最近值和耗时统计"""
+        future, state.future = state.future, None
+        try:
+            value, start, end = future.result()
+        except Exception as e:
+            state.errors += 1
+            state.error = e
+            return False
+        latency = end - start
+        state.value, state.timestamp, state.latency, state.error = value, end, latency, None
+        state.calls += 1
+        state.total_latency += latency
+        state.max_latency = max(state.max_latency, latency)
+        return True
+
+    def collect(self):
+        """并发执行所有采集项，返回 {名称: ProbeResult}"""
+        start = self.clock()
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix='probe')
+        for state in self._states.values():
+            if state.future is None:
+                state.future = self._executor.submit(self._timed_call, state)
+
+        results = {}
+        for name, state in self._states.items():
+            remaining = state.probe.deadline - (self.clock() - start)
+            fresh = False
+            try:
+                state.future.result(timeout=max(remaining, 0))
+            except concurrent.futures.TimeoutError:
+                state.timeouts += 1
+            except Exception:
+                fresh = self._harvest(state)
+            else:
+                fresh = self._harvest(state)
+            results[name] = ProbeResult(state.value, not fresh, state.latency, state.timestamp, state.error)
+        return results
+
+    def stats(self):
+        """每个采集项的调用次数、超时次数、错误次数及耗时 (毫秒)"""
+        return {
+            name: {
+                'calls': s.calls, 'timeouts': s.timeouts, 'errors': s.errors,
+                'mean_latency_ms': s.total_latency / s.calls * 1000 if s.calls else 0.0,
+                'max_latency_ms': s.max_latency * 1000,
+                'last_latency_ms': s.latency * 1000,
+            }
+            for name, s in self._states.items()
+        }
+
+    def close(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        for state in self._states.values():
+            if state.future is not None and state.future.cancelled():
+                state.future = None
+
+
+class CounterRates:
+    """
+    把一个采集项返回的累计计数 (网络/磁盘的字节数、包数等) 换算为每次采集之间的增量。
+    采集项超时 (stale) 时计数没有更新：沿用上一次的速率，基准保持不变，下次按实际经过的时间计算增量；
+    新读数按两次读取计数的实际时刻 (ProbeResult.timestamp) 换算到本次采集间隔。
+    """
+    def __init__(self, n):
+        self.prev = None       # 上一次成功读取的计数
+        self.time_prev = None  # 上一次成功读取计数的时刻
+        self.rates = (0,) * n  # 上一次的每秒速率
+        self.n = n
+
+    def update(self, result, counters, elapsed):
+        """result 为本次的 ProbeResult，counters 为其中的累计计数，elapsed 为距上次采集的秒数；返回各计数的增量"""
+        if self.prev is None or not elapsed:
+            deltas = (0,) * self.n
+        elif result.stale:
+            deltas = tuple(rate * elapsed for rate in self.rates)
+        else:
+            deltas = tuple(value - prev for value, prev in zip(counters, self.prev))
+            # 之前的tick超时或本次读取较晚时，两次读取计数的间隔与采集间隔不同
+            counter_elapsed = result.timestamp - self.time_prev
+            if counter_elapsed != elapsed and counter_elapsed > 0:
+                deltas = tuple(delta * elapsed / counter_elapsed for delta in deltas)
+        if not result.stale:
+            self.prev = tuple(counters)
+            self.time_prev = result.timestamp
+            self.rates = tuple(delta / elapsed for delta in deltas) if elapsed else (0,) * self.n
+        return deltas
+
+
+def check_slow_probes(ticks=20, tick_deadline=0.05):
+    """注入人为变慢的假采集项，验证慢项不会拖慢整个tick并正确标记stale"""
+    import itertools
+    counter = itertools.count()
+
+    def fast():
+        return next(counter)
+
+    def slow():
+        time.sleep(tick_deadline * 3)
+        return 'slow-value'
+
+    def flaky():
+        raise RuntimeError("NVML error")
+
+    runner = ProbeRunner([
+        Probe('fast', fast, deadline=tick_deadline, default=-1),
+        Probe('slow', slow, deadline=tick_deadline, default='initial'),
+        Probe('flaky', flaky, deadline=tick_deadline, default=(-1, -1)),
+    ])
+    stale_slow = fresh_slow = 0
+    worst_tick = 0.0
+    for _ in range(ticks):
+        start = time.perf_counter()
+        results = runner.collect()
+        worst_tick = max(worst_tick, time.perf_counter() - start)
+        assert not results['fast'].stale
+        assert results['flaky'].stale and results['flaky'].value == (-1, -1)
+        if results['slow'].stale:
+            stale_slow += 1
+            assert results['slow'].value in ('initial', 'slow-value')
+        else:
+            fresh_slow += 1
+            assert results['slow'].value == 'slow-value'
+        time.sleep(tick_deadline)
+    runner.close()
+    # 整个tick最多只等待截止时间 (留出调度余量)
+    assert worst_tick < tick_deadline * 2, f"tick被慢采集项阻塞 {worst_tick * 1000:.1f}ms"
+    assert stale_slow > 0 and fresh_slow > 0
+    return {'worst_tick_ms': worst_tick * 1000, 'slow_stale': stale_slow, 'slow_fresh': fresh_slow,
+            'stats': runner.stats()}
+
+
+def check_counter_rates(rate=1000.0, ticks=30):
+    """计数按固定速率增长，每3个tick有一次采集超时：每个tick的增量都应等于 速率 x 采集间隔"""
+    counter_rates = CounterRates(1)
+    for i in range(ticks):
+        now = i * 1.0
+        if i % 3 == 2:
+            result = ProbeResult((0,), True, 0.0, now - 1.0)  # 超时，沿用上一次的值
+        else:
+            result = ProbeResult((rate * (now + 0.05),), False, 0.05, now + 0.05)
+        delta, = counter_rates.update(result, result.value, 1.0 if i else None)
+        if i > 0:
+            assert abs(delta - rate) < 1e-6, f"tick {i}: 增量 {delta}，应为 {rate}"
+
+
+if __name__ == "__main__":
+    check_counter_rates()
+    print("计数速率测试通过: 采集项超时时沿用速率，恢复后按实际读取间隔换算")
+    result = check_slow_probes()
+    print(f"慢采集项测试通过: 最长tick {result['worst_tick_ms']:.1f}ms, "
+          f"slow stale/fresh = {result['slow_stale']}/{result['slow_fresh']}")
+    for name, stats in result['stats'].items():
+        print(f"  {name}: {stats}")
@@ -0,0 +1,327 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnar_log import read_log
+from feature_engine import RAW_DATA_COLUMNS
+from model_bundle import BUNDLE_PATH, load_bundle
+from offline_features import segment_sessions
+from pipeline import MonitorPipeline
+from scheduler import FakeClock
+from window_matcher import WINDOWS_LABEL_PATH, WindowMatcher, load_windows_dictionary
+
+# 计数类字段在假采集源中的累计初值 (模拟开机以来已有的网络/磁盘计数)
+COUNTER_BASE = float(1 << 20)
+# 分阶段计时的顺序
+STAGES = ('collect', 'buffer', 'features', 'model', 'rules', 'tick')
+
+_INPUT_IDX = np.arange(5)  # 鼠标距离、左键、右键、滚轮、按键，顺序同 InputAggregator.get_and_reset
+_SYSTEM_COUNTER_IDX = np.array([RAW_DATA_COLUMNS.index(c) for c in (
+    'bytes_sent_per_sec', 'bytes_recv_per_sec', 'packets_sent_per_sec', 'packets_recv_per_sec',
+    'read_bytes_per_sec', 'write_bytes_per_sec')])
+_CPU, _RAM, _GPU, _VRAM = (RAW_DATA_COLUMNS.index(c) for c in
+                           ('cpu_percent', 'ram_percent', 'gpu_percent', 'gpu_vram_percent'))
+
+
+class ReplaySource:
+    """
+    按虚拟时钟返回录制数据的假采集源，同时充当 Recorder 的系统采集后端、GPU采集项、前景窗口采集项和输入聚合器。
+    load() 时刻记为第0个周期，时刻 start + k * interval 的采集返回第 k 行：
+    使用率直接取该行的值；网络/磁盘返回累计计数器 (相邻两次之差为该行的每秒速率 * interval)；
+    输入事件返回该周期内的增量。返回值只取决于虚拟时刻，与采集线程的调用顺序无关。
+    """
+    def __init__(self, clock, interval=1.0):
+        self.clock = clock
+        self.interval = interval
+        self.load(np.zeros((1, len(RAW_DATA_COLUMNS))))
+
+    def load(self, rows, windows=None):
+        self.rows = np.asarray(rows, dtype=np.float64)
+        self.windows = windows
+        self.counters = COUNTER_BASE + np.cumsum(self.rows[:, _SYSTEM_COUNTER_IDX] * self.interval, axis=0)
+        self.start = self.clock()
+
+    def index(self, now=None):
+        """当前虚拟时刻对应的行号，超出录制数据时停在最后一行"""
+        k = int(round(((self.clock() if now is None else now) - self.start) / self.interval))
+        return min(max(k, 0), len(self.rows) - 1)
+
+    def exhausted(self, now):
+        """时刻 now 是否已超过最后一行"""
+        return (now - self.start) / self.interval > len(self.rows) - 0.5
+
+    # ---------- Recorder 使用的接口 ----------
+    def snapshot(self):
+        k = self.index()
+        row = self.rows[k]
+        return (row[_CPU], row[_RAM], *self.counters[k])
+
+    def gpu(self):
+        row = self.rows[self.index()]
+        return row[_GPU], row[_VRAM]
+
+    def window(self):
+        return self.windows[self.index()] if self.windows is not None else ("", "")
+
+    def get_and_reset(self):
+        return tuple(self.rows[self.index(), _INPUT_IDX] * self.interval)
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StageTimer:
+    """替换对象上的方法，记录每次调用的真实耗时 (秒)"""
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self._wrapped = []
+
+    def wrap(self, obj, method, stage):
+        original = getattr(obj, method)
+        samples = self.samples.setdefault(stage, [])
+        self._wrapped.append((obj, method, obj.__dict__.get(method)))
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+        setattr(obj, method, timed)
+
+    def restore(self):
+        """恢复被替换的方法"""
+        for obj, method, original in reversed(self._wrapped):
+            if original is None:
+                delattr(obj, method)
+            else:
+                setattr(obj, method, original)
+        self._wrapped = []
+
+    def summary(self):
+        """各阶段的 {次数, 平均/p50/p99/最大耗时 (微秒)}"""
+        out = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            us = np.asarray(samples) * 1e6
+            out[stage] = {'count': len(us), 'mean_us': float(us.mean()), 'p50_us': float(np.percentile(us, 50)),
+                          'p99_us': float(np.percentile(us, 99)), 'max_us': float(us.max())}
+        return out
+
+
+def window_titles(df, mode, dictionary):
+    """
+    每行的前景窗口 (标题, 进程名)。日志中有 window_title 列时直接使用；
+    否则 mode='label' 时取字典中第一个对应录制标签的关键词作为标题 (检验字典规则)，mode='none' 时为空窗口。
+    """
+    if 'window_title' in df:
+        process = df['process_name'] if 'process_name' in df else [""] * len(df)
+        return [(str(t) if pd.notna(t) else "", str(p) if pd.notna(p) else "") for t, p in zip(df['window_title'], process)]
+    if mode == 'label' and 'label' in df:
+        titles = {}
+        for key, label in dictionary.items():
+            titles.setdefault(label, key)
+        return [(titles.get(label, ""), "") for label in df['label']]
+    return None
+
+
+def split_sessions(df):
+    """按 offline_features 的规则 (间隔超过 SESSION_GAP_SECONDS) 切分会话，返回每个会话的行号数组"""
+    times_ns = df['timestamp'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+    session_id = segment_sessions(times_ns)
+    return np.split(np.arange(len(df)), np.flatnonzero(np.diff(session_id)) + 1)
+
+
+def replay(df, model, idle_means, dictionary=None, windows='none', interval=1.0, timeout=10.0):
+    """
+    把一份录制日志按会话送入完整的实时监控：每个会话对应一次 开始监控 -> 停止监控，
+    由 Recorder (假采集源) + MonitorPipeline 工作线程 + TickScheduler 在虚拟时钟上运行，不真正sleep。
+    每个会话的第一行被 Recorder.start() 用于初始化计数器，其余每行对应一个tick。
+    返回 (逐tick结果DataFrame, 报告字典, 逐tick的 PredictionResult 列表)
+    """
+    from model_test import Recorder
+    df = df.sort_values('timestamp', kind='stable').reset_index(drop=True)
+    raw = df[RAW_DATA_COLUMNS].to_numpy(dtype=np.float64)
+    titles = window_titles(df, windows, dictionary or {})
+    clock = FakeClock()
+    source = ReplaySource(clock, interval)
+    recorder = Recorder(window_probe=source.window, system_probe=source, gpu_probe=source.gpu,
+                        input_aggregator=source, clock=clock)
+    pipeline = None
+
+    def sleep(seconds):
+        # 本会话的数据已全部送出时停在这里，直到 stop()；否则只推进虚拟时钟
+        if source.exhausted(clock() + seconds):
+            pipeline.wait_stopped()
+        else:
+            clock.sleep(seconds)
+
+    pipeline = MonitorPipeline(recorder, model, WindowMatcher(dictionary or {}), dict(idle_means),
+                               interval=interval, queue_size=len(df) + 1, clock=clock, sleep=sleep)
+    timer = StageTimer()
+    timer.wrap(recorder, 'get_and_reset_data', 'collect')
+    timer.wrap(pipeline.feature_engine, 'push', 'buffer')
+    timer.wrap(pipeline.feature_engine, 'features', 'features')
+    timer.wrap(model, 'predict_one', 'model')
+    timer.wrap(pipeline.window_matcher, 'decide', 'rules')
+    timer.wrap(pipeline, 'step', 'tick')
+    # ProbeRunner 按虚拟时钟计时 (回放中总为0)，各采集项的真实耗时在这里单独记录
+    for probe in recorder.probe_runner.probes:
+        timer.wrap(probe, 'func', f'probe:{probe.name}')
+
+    sessions = split_sessions(df)
+    records = []
+    start = time.perf_counter()
+    try:
+        for rows in sessions:
+            if len(rows) < 2:
+                continue
+            source.load(raw[rows], [titles[i] for i in rows] if titles is not None else None)
+            pipeline.start()
+            for i in rows[1:]:
+                result = pipeline.results.get(timeout=timeout)
+                records.append((i, result))
+            pipeline.stop()
+            while pipeline.results.get(timeout=timeout) is not None:
+                pass
+    finally:
+        pipeline.stop()
+        timer.restore()
+        recorder.probe_runner.close()
+    wall_seconds = time.perf_counter() - start
+
+    out = pd.DataFrame({
+        'timestamp': df['timestamp'].to_numpy()[[i for i, _ in records]],
+        'tick': [r.tick for _, r in records],
+        'status': [r.status for _, r in records],
+        'label': [r.label for _, r in records],
+        'model_label': [r.model_label for _, r in records],
+        'window_title': [r.window_title for _, r in records],
+        'buffered': [r.buffered for _, r in records],
+    })
+    if 'label' in df:
+        out['expected'] = df['label'].to_numpy()[[i for i, _ in records]]
+    report = {
+        'ticks': len(records),
+        'sessions': len(sessions),
+        'wall_seconds': wall_seconds,
+        'virtual_seconds': len(records) * interval,
+        'ticks_per_second': len(records) / wall_seconds if wall_seconds else 0.0,
+        'stages': timer.summary(),
+        'probes': {name: {'timeouts': s['timeouts'], 'errors': s['errors']}
+                   for name, s in recorder.probe_runner.stats().items()},
+        'status': out['status'].value_counts().to_dict(),
+        'dropped_results': pipeline.dropped_results,
+    }
+    if 'expected' in out:
+        ok = out[out['status'] == 'ok']
+        wrong = ok[ok['label'] != ok['expected']]
+        report['accuracy'] = float((ok['label'] == ok['expected']).mean()) if len(ok) else 0.0
+        report['model_accuracy'] = float((ok['model_label'] == ok['expected']).mean()) if len(ok) else 0.0
+        report['mismatches'] = len(wrong)
+        report['confusions'] = wrong.groupby(['expected', 'label']).size().sort_values(ascending=False).to_dict()
+    return out, report, [r for _, r in records]
+
+
+def print_report(name, report):
+    print(f"{name}: {report['ticks']} 个tick ({report['sessions']} 个会话), 耗时 {report['wall_seconds']:.2f}s, "
+          f"{report['ticks_per_second']:,.0f} tick/秒 (相当于实时的 {report['virtual_seconds'] / report['wall_seconds']:,.0f} 倍)")
+    print(f"  状态: {report['status']}" + (f", 丢弃结果 {report['dropped_results']}" if report['dropped_results'] else ""))
+    print(f"  {'阶段':14s} {'次数':>7s} {'平均us':>8s} {'p50us':>8s} {'p99us':>8s} {'最大us':>9s}")
+    for stage, s in report['stages'].items():
+        print(f"  {stage:14s} {s['count']:7d} {s['mean_us']:8.1f} {s['p50_us']:8.1f} {s['p99_us']:8.1f} {s['max_us']:9.1f}")
+    for probe, s in report['probes'].items():
+        print(f"  采集项 {probe}: 超时 {s['timeouts']}, 错误 {s['errors']}")
+    if 'mismatches' in report:
+        print(f"  与录制标签一致率 {report['accuracy']:.4f} (模型 {report['model_accuracy']:.4f}), "
+              f"不一致 {report['mismatches']} 个tick")
+        for (expected, label), count in list(report['confusions'].items())[:5]:
+            print(f"    {expected} -> {label}: {count}")
+
+
+# ---------- 测试 ----------
+def check_replay(path='test_data/system_log_9_23.csv', bundle_path=BUNDLE_PATH):
+    """
+    回放结果与 batch_score 逐行比较：Recorder 由累计计数器还原出的每秒速率、特征、模型标签应与
+    直接对回放的数据行 (每个会话去掉初始化用的第一行，时间戳换成虚拟时钟的整秒) 批量计算的结果一致；
+    回放不真正sleep，耗时应远小于录制时长。
+    """
+    from batch_score import live_features, score_features
+    bundle = load_bundle(bundle_path)
+    df = read_log(path).sort_values('timestamp', kind='stable').reset_index(drop=True)
+    out, report, results = replay(df, bundle.engine, bundle.idle_means)
+    print_report(path, report)
+
+    # 与回放看到的数据相同：每个会话从第二行开始，间隔1秒，会话之间隔开足够长的时间以清空缓冲区
+    rows, seconds, offset = [], [], 0.0
+    for session in split_sessions(df):
+        if len(session) < 2:
+            continue
+        rows.extend(session[1:])
+        seconds.extend(offset + np.arange(1, len(session)))
+        offset += len(session) + 3600
+    expected = df.iloc[rows].reset_index(drop=True)
+    expected['timestamp'] = pd.Timestamp('2000-01-01') + pd.to_timedelta(seconds, unit='s')
+    features, ready, _ = live_features(expected, bundle.idle_means)
+    proba = score_features(bundle, features, ready)
+
+    assert len(results) == len(expected) and report['ticks'] == len(expected)
+    assert not report['dropped_results'] and report['status'].get('error', 0) == 0
+    assert np.array_equal(out['status'] == 'ok', ready), "收集中/可预测状态与批量计算不一致"
+    live = np.array([r.features for r in results if r.status == 'ok'])
+    assert np.allclose(live, features[ready], rtol=1e-9, atol=1e-6), "回放得到的特征与批量计算不一致"
+    labels = np.array(bundle.classes, dtype=object)[proba[ready].argmax(axis=1)]
+    agree = (out.loc[out['status'] == 'ok', 'model_label'].to_numpy() == labels).mean()
+    assert agree > 0.999, f"模型标签与批量计算一致率 {agree:.4f}"
+    assert report['wall_seconds'] < report['virtual_seconds'] / 100, "回放没有明显快于实时"
+    print(f"回放检查通过: 特征与批量计算一致, 模型标签一致率 {agree:.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="用录制的日志在无界面、无真实输入设备/NVML/Windows API 的环境中加速回放完整的实时监控流水线")
+    parser.add_argument('paths', nargs='*', help="采集日志 (csv/csv.gz/列式日志段)，默认为 test_data/ 下的全部日志")
+    parser.add_argument('--model', default=BUNDLE_PATH)
+    parser.add_argument('--dictionary', default=WINDOWS_LABEL_PATH, help="字典规则 (title,label)")
+    parser.add_argument('--windows', choices=['none', 'label'], default='none',
+                        help="日志中没有窗口标题时的前景窗口：none 为空窗口 (只看模型)，label 为录制标签对应的字典关键词")
+    parser.add_argument('--idle', choices=['bundle', 'file'], default='bundle',
+                        help="空闲基准：模型包中的训练基准，或该文件自身idle行的均值")
+    parser.add_argument('--output-dir', default=None, help="保存逐tick结果")
+    parser.add_argument('--check', action='store_true', help="与 batch_score 的批量结果逐行比较")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        check_replay(bundle_path=args.model)
+        return
+    paths = args.paths
+    if not paths:
+        from data_processs import discover_files
+        paths = discover_files('test_data')
+    bundle = load_bundle(args.model)
+    dictionary = load_windows_dictionary(args.dictionary)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for path in paths:
+        df = read_log(path)
+        if args.idle == 'file':
+            from batch_score import idle_means_from_log
+            idle_means = idle_means_from_log(df)
+        else:
+            idle_means = bundle.idle_means
+        out, report, _ = replay(df, bundle.engine, idle_means, dictionary, args.windows)
+        print_report(path, report)
+        if args.output_dir:
+            name = os.path.basename(os.path.normpath(path)).split('.')[0]
+            out.to_csv(os.path.join(args.output_dir, f'{name}.replay.csv'), index=False)
+
+
+if __name__ == "__main__":
+    main()
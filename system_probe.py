@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+
+# snapshot() 返回的扁平元组中各字段的顺序，网络/磁盘为累计值，由调用方计算每秒增量
+SNAPSHOT_FIELDS = [
+    'cpu_percent', 'ram_percent',
+    'bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv',
+    'read_bytes', 'write_bytes',
+]
+
+DISK_SECTOR_SIZE = 512
+
+
+class PsutilProbe:
+    """基于psutil的系统指标采集，所有平台可用，作为默认/兜底实现"""
+    name = 'psutil'
+
+    def __init__(self):
+        import psutil
+        self._psutil = psutil
+        psutil.cpu_percent(interval=None)  # 第一次调用只建立基准
+
+    def snapshot(self):
+        psutil = self._psutil
+        net_io = psutil.net_io_counters()
+        disk_io = psutil.disk_io_counters()
+        read_bytes = disk_io.read_bytes if disk_io else 0
+        write_bytes = disk_io.write_bytes if disk_io else 0
+        return (
+            psutil.cpu_percent(interval=None), psutil.virtual_memory().percent,
+            net_io.bytes_sent, net_io.bytes_recv, net_io.packets_sent, net_io.packets_recv,
+            read_bytes, write_bytes,
+        )
+
+    def close(self):
+        pass
+
+
+class _ProcFile:
+    """保持打开的/proc文件，每次用preadv从偏移0重读到预分配的缓冲区"""
+    def __init__(self, path, size=8192):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.buffer = bytearray(size)
+
+    def read(self):
+        while True:
+            n = os.preadv(self.fd, [self.buffer], 0)
+            if n < len(self.buffer):
+                return memoryview(self.buffer)[:n]
+            # 缓冲区不够大时扩容后重读
+            self.buffer = bytearray(len(self.buffer) * 2)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ProcProbe:
+    """
+    Linux下直接读取 /proc/stat、/proc/meminfo、/proc/net/dev、/proc/diskstats 的采集后端。
+    文件只打开一次，只解析模型用到的字段，结果与psutil的计算方式一致
+    (CPU忙碌时间不含idle/iowait/guest，内存使用率基于MemAvailable，磁盘只统计整盘不含分区)。
+    """
+    name = 'proc'
+
+    def __init__(self, procfs_path='/proc', sysfs_block_path='/sys/block'):
+        self._stat = _ProcFile(os.path.join(procfs_path, 'stat'))
+        self._meminfo = _ProcFile(os.path.join(procfs_path, 'meminfo'))
+        self._netdev = _ProcFile(os.path.join(procfs_path, 'net', 'dev'))
+        self._diskstats = _ProcFile(os.path.join(procfs_path, 'diskstats'))
+        self.sysfs_block_path = sysfs_block_path
+        self._storage_devices = {}  # 设备名 -> 是否为整盘，缓存/sys/block的查询结果
+        self._cpu_prev = self._read_cpu_times()
+
+    def _is_storage_device(self, name):
+        result = self._storage_devices.get(name)
+        if result is None:
+            result = os.access(os.path.join(self.sysfs_block_path, name.replace('/', '!')), os.F_OK)
+            self._storage_devices[name] = result
+        return result
+
+    def _read_cpu_times(self):
+        line = self._stat.read().tobytes().split(b'\n', 1)[0].split()
+        # cpu user nice system idle iowait irq softirq steal guest guest_nice
+        times = [int(v) for v in line[1:]]
+        total = sum(times)
+        if len(times) > 8:
+            total -= sum(times[8:10])  # guest时间已经计入user/nice
+        idle = times[3] + (times[4] if len(times) > 4 else 0)
+        return total, total - idle
+
+    def _cpu_percent(self):
+        total, busy = self._read_cpu_times()
+        prev_total, prev_busy = self._cpu_prev
+        self._cpu_prev = (total, busy)
+        total_delta = total - prev_total
+        if total_delta <= 0:
+            return 0.0
+        busy_delta = busy - prev_busy
+        return round(min(max(busy_delta / total_delta * 100, 0.0), 100.0), 1)
+
+    def _ram_percent(self):
+        total = available = None
+        free = buffers = cached = 0
+        for line in self._meminfo.read().tobytes().split(b'\n'):
+            if line.startswith(b'MemTotal:'):
+                total = int(line.split()[1])
+            elif line.startswith(b'MemAvailable:'):
+                available = int(line.split()[1])
+                break
+            elif line.startswith(b'MemFree:'):
+                free = int(line.split()[1])
+            elif line.startswith(b'Buffers:'):
+                buffers = int(line.split()[1])
+            elif line.startswith(b'Cached:'):
+                cached = int(line.split()[1])
+        if not total:
+            return 0.0
+        if available is None:
+            available = free + buffers + cached
+        return round((total - available) / total * 100, 1)
+
+    def _net_counters(self):
+        bytes_sent = bytes_recv = packets_sent = packets_recv = 0
+        # 前两行为表头
+        for line in self._netdev.read().tobytes().split(b'\n')[2:]:
+            colon = line.rfind(b':')
+            if colon <= 0:
+                continue
+            fields = line[colon + 1:].split()
+            bytes_recv += int(fields[0])
+            packets_recv += int(fields[1])
+            bytes_sent += int(fields[8])
+            packets_sent += int(fields[9])
+        return bytes_sent, bytes_recv, packets_sent, packets_recv
+
+    def _disk_counters(self):
+        read_sectors = write_sectors = 0
+        for line in self._diskstats.read().tobytes().split(b'\n'):
+            fields = line.split()
+            flen = len(fields)
+            if flen == 14 or flen >= 18:
+                name, rsect, wsect = fields[2], fields[5], fields[9]
+            elif flen == 15:
+                name, rsect, wsect = fields[3], fields[6], fields[10]
+            elif flen == 7:
+                name, rsect, wsect = fields[2], fields[4], fields[6]
+            else:
+                continue
+            if self._is_storage_device(name.decode()):
+                read_sectors += int(rsect)
+                write_sectors += int(wsect)
+        return read_sectors * DISK_SECTOR_SIZE, write_sectors * DISK_SECTOR_SIZE
+
+    def snapshot(self):
+        return (self._cpu_percent(), self._ram_percent()) + self._net_counters() + self._disk_counters()
+
+    def close(self):
+        for f in (self._stat, self._meminfo, self._netdev, self._diskstats):
+            f.close()
+
+
+def make_probe(backend='auto'):
+    """backend: 'auto' | 'proc' | 'psutil'。auto在Linux上优先使用/proc，失败时回退到psutil"""
+    if backend in ('auto', 'proc') and sys.platform.startswith('linux'):
+        try:
+            return ProcProbe()
+        except OSError as e:
+            if backend == 'proc':
+                raise
+            print(f"Warning: /proc probe unavailable, falling back to psutil. Error: {e}")
+    return PsutilProbe()
+
+
+def _write_fixture(root):
+    """生成一组最小的/proc与/sys/block样例文件"""
+    os.makedirs(os.path.join(root, 'proc', 'net'), exist_ok=True)
+    os.makedirs(os.path.join(root, 'sys', 'block', 'sda'), exist_ok=True)
+    files = {
+        'proc/stat': "cpu  100 0 50 800 50 0 0 0 0 0\ncpu0 100 0 50 800 50 0 0 0 0 0\nintr 0\n",
+        'proc/meminfo': "MemTotal:       16000000 kB\nMemFree:         2000000 kB\nMemAvailable:    6000000 kB\nBuffers:          100000 kB\n",
+        'proc/net/dev': ("Inter-|   Receive                                                |  Transmit\n"
+                         " face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed\n"
+                         "    lo:    1000      10    0    0    0     0          0         0     1000      10    0    0    0     0       0          0\n"
+                         "  eth0:    5000      50    0    0    0     0          0         0     3000      30    0    0    0     0       0          0\n"),
+        'proc/diskstats': ("   8       0 sda 100 0 2000 0 50 0 4000 0 0 0 0 0 0 0 0 0 0\n"
+                           "   8       1 sda1 90 0 1800 0 40 0 3000 0 0 0 0 0 0 0 0 0 0\n"),
+    }
+    for rel, content in files.items():
+        with open(os.path.join(root, rel), 'w') as f:
+            f.write(content)
+    return files
+
+
+def check_fixture():
+    """用样例/proc文件校验解析结果，并验证保持打开的文件能读到更新后的内容"""
+    import tempfile
+    with tempfile.TemporaryDirectory() as root:
+        _write_fixture(root)
+        probe = ProcProbe(os.path.join(root, 'proc'), os.path.join(root, 'sys', 'block'))
+        with open(os.path.join(root, 'proc', 'stat'), 'r+') as f:
+            f.write("cpu  160 0 70 820 50 0 0 0 0 0\n")
+        snapshot = probe.snapshot()
+        probe.close()
+    expected = (
+        80.0,              # busy +80 / total +100
+        62.5,              # (16000000 - 6000000) / 16000000
+        4000, 6000, 40, 60,
+        2000 * DISK_SECTOR_SIZE, 4000 * DISK_SECTOR_SIZE,  # sda1为分区，不计入
+    )
+    assert snapshot == expected, f"{snapshot} != {expected}"
+    return snapshot
+
+
+def benchmark(repeat=2000):
+    """比较两种后端每次快照的耗时和CPU占用"""
+    backends = [PsutilProbe()]
+    if sys.platform.startswith('linux'):
+        backends.append(ProcProbe())
+    for probe in backends:
+        probe.snapshot()
+        wall, cpu = time.perf_counter(), time.process_time()
+        for _ in range(repeat):
+            probe.snapshot()
+        wall = (time.perf_counter() - wall) / repeat
+        cpu = (time.process_time() - cpu) / repeat
+        print(f"{probe.name:7s}: {wall * 1e6:8.1f} us/次 (CPU {cpu * 1e6:8.1f} us/次), 样例: {probe.snapshot()}")
+        probe.close()
+
+
+if __name__ == "__main__":
+    print(f"样例文件校验通过: {check_fixture()}")
+    benchmark()
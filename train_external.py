@@ -0,0 +1,301 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import xgboost as xgb
+
+from dataset_store import STORE_DIR, DatasetStore
+
+DEFAULT_CHUNK_ROWS = 200_000
+
+DEFAULT_PARAMS = {
+    'objective': 'multi:softprob',
+    'eval_metric': 'mlogloss',
+    'tree_method': 'hist',
+    'max_bin': 256,
+}
+
+
+def class_counts(stores, n_classes, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """按块统计各类别的行数，不把标签数组整体读入内存"""
+    counts = np.zeros(n_classes, dtype=np.int64)
+    for store in stores:
+        for start in range(0, len(store), chunk_rows):
+            counts += np.bincount(store.y[start:start + chunk_rows], minlength=n_classes)
+    return counts
+
+
+def balanced_weights(counts):
+    """与sklearn的 class_weight='balanced' 相同：n / (类别数 * 该类行数)，代替对全量数据做SMOTE"""
+    counts = np.asarray(counts, dtype=np.float64)
+    weights = np.zeros_like(counts)
+    present = counts > 0
+    weights[present] = counts.sum() / (present.sum() * counts[present])
+    return weights.astype(np.float32)
+
+
+def stratified_rates(counts, per_class=None):
+    """分层抽样时各类别的保留概率：每类最多保留约 per_class 行 (默认为最少类别的行数)"""
+    counts = np.asarray(counts, dtype=np.float64)
+    if per_class is None:
+        per_class = counts[counts > 0].min()
+    rates = np.ones_like(counts)
+    np.divide(per_class, counts, out=rates, where=counts > per_class)
+    return rates
+
+
+class StoreIter(xgb.DataIter):
+    """
+    按块把一个或多个数据集送入XGBoost。每块用普通文件读取，处理完即释放，内存占用只与块大小有关。
+    class_weights 给出时为每行附加样本权重；sample_rates 给出时按类别做伯努利抽样，
+    每块的随机种子固定，XGBoost多次遍历时得到的样本完全相同。
+    """
+    def __init__(self, stores, chunk_rows=DEFAULT_CHUNK_ROWS, class_weights=None, sample_rates=None,
+                 seed=0, cache_prefix=None):
+        self.plan = [(store, start) for store in stores for start in range(0, len(store), chunk_rows)]
+        self.chunk_rows = chunk_rows
+        self.class_weights = class_weights
+        self.sample_rates = sample_rates
+        self.seed = seed
+        self.rows = 0  # 最近一次完整遍历送入的行数
+        self._it = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._it >= len(self.plan):
+            return 0
+        store, start = self.plan[self._it]
+        X, y = store.read_chunk(start, start + self.chunk_rows)
+        if self.sample_rates is not None:
+            keep = np.random.default_rng((self.seed, self._it)).random(len(y)) < self.sample_rates[y]
+            X, y = X[keep], y[keep]
+        weight = self.class_weights[y] if self.class_weights is not None else None
+        input_data(data=X, label=y, weight=weight, feature_names=store.feature_names)
+        self.rows += len(y)
+        self._it += 1
+        return 1
+
+    def reset(self):
+        self._it = 0
+        self.rows = 0
+
+
+def open_stores(paths):
+    stores = [DatasetStore(path) for path in paths]
+    for store in stores[1:]:
+        if store.classes != stores[0].classes or store.feature_names != stores[0].feature_names:
+            raise ValueError(f"{store.path} 的类别或特征列与 {stores[0].path} 不一致")
+    return stores
+
+
+def train(train_paths, eval_paths=(), balance='weight', per_class=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+          num_boost_round=100, params=None, cache_dir=None, external=True, seed=0, verbose=True):
+    """
+    流式训练。external=True 时使用XGBoost的外存模式 (量化后的数据页缓存在 cache_dir 的磁盘文件中)，
+    否则使用 QuantileDMatrix (数据仍按块读取，但量化结果驻留内存)。
+    balance: 'weight' 按类别加权；'sample' 按类别分层抽样；'none' 不做平衡。返回 (booster, 类别列表)
+    """
+    stores = open_stores(train_paths)
+    classes = stores[0].classes
+    counts = class_counts(stores, len(classes), chunk_rows)
+    class_weights = sample_rates = None
+    if balance == 'weight':
+        class_weights = balanced_weights(counts)
+    elif balance == 'sample':
+        sample_rates = stratified_rates(counts, per_class)
+    elif balance != 'none':
+        raise ValueError(f"未知的平衡方式: {balance}")
+    if verbose:
+        print(f"训练集: {sum(len(s) for s in stores)} 行, 各类别 {dict(zip(classes, counts.tolist()))}")
+
+    own_cache = cache_dir is None
+    cache_dir = cache_dir or tempfile.mkdtemp(prefix='xgb-cache-')
+    try:
+        train_iter = StoreIter(stores, chunk_rows, class_weights, sample_rates, seed,
+                               cache_prefix=os.path.join(cache_dir, 'train') if external else None)
+        dtrain = xgb.DMatrix(train_iter) if external else xgb.QuantileDMatrix(train_iter, max_bin=DEFAULT_PARAMS['max_bin'])
+        evals = [(dtrain, 'train')]
+        if eval_paths:
+            eval_stores = open_stores(eval_paths)
+            if eval_stores[0].classes != classes:
+                raise ValueError("验证集的类别与训练集不一致")
+            eval_iter = StoreIter(eval_stores, chunk_rows,
+                                  cache_prefix=os.path.join(cache_dir, 'eval') if external else None)
+            evals.append((xgb.DMatrix(eval_iter) if external else xgb.QuantileDMatrix(eval_iter, ref=dtrain), 'eval'))
+
+        train_params = dict(DEFAULT_PARAMS, num_class=len(classes), seed=seed)
+        train_params.update(params or {})
+        booster = xgb.train(train_params, dtrain, num_boost_round=num_boost_round, evals=evals,
+                            verbose_eval=max(num_boost_round // 10, 1) if verbose else False)
+        # 先释放DMatrix，XGBoost才会自行删除磁盘上的数据页
+        del dtrain, evals
+    finally:
+        if own_cache:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return booster, classes
+
+
+def to_classifier(booster):
+    """Booster -> XGBClassifier (实时监控程序和 tree_engine 读取的是joblib保存的XGBClassifier)"""
+    from xgboost import XGBClassifier
+    with tempfile.TemporaryDirectory() as tmp:
+        booster_path = os.path.join(tmp, 'model.ubj')
+        booster.save_model(booster_path)
+        model = XGBClassifier()
+        model.load_model(booster_path)
+    # 模型文件不含训练参数，另外带上训练配置 (model_update.py 继续训练时沿用学习率和树深)
+    model.get_booster().load_config(booster.save_config())
+    return model
+
+
+def _dump_atomic(obj, path):
+    """先写临时文件再替换，正在运行的程序任何时候读到的都是完整的旧文件或新文件"""
+    import joblib
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def export(booster, classes, model_path='xgboost_model.joblib', encoder_path='label_encoder.joblib',
+           bundle_path=None, idle_means=None, metadata=None):
+    """保存为 XGBClassifier + LabelEncoder (joblib)；给出 bundle_path 时同时写出模型包 (见 model_bundle.py)"""
+    from sklearn.preprocessing import LabelEncoder
+    label_encoder = LabelEncoder()
+    label_encoder.classes_ = np.array(classes, dtype=object)
+    _dump_atomic(label_encoder, encoder_path)
+    _dump_atomic(to_classifier(booster), model_path)
+    if bundle_path:
+        from model_bundle import save_bundle
+        save_bundle(bundle_path, booster, classes, idle_means=idle_means, metadata=metadata)
+
+
+def store_idle_means(paths):
+    """各数据集预处理时扣除的空闲基准，按行数加权平均；都没有记录时返回None"""
+    stores = [store for store in map(DatasetStore, paths) if store.idle_means]
+    if not stores:
+        return None
+    total = sum(len(store) for store in stores)
+    return {col: sum(store.idle_means[col] * len(store) for store in stores) / total
+            for col in stores[0].idle_means}
+
+
+def evaluate(booster, paths, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """按块预测并统计准确率"""
+    correct = total = 0
+    for store in open_stores(paths):
+        for start in range(0, len(store), chunk_rows):
+            X, y = store.read_chunk(start, start + chunk_rows)
+            proba = booster.predict(xgb.DMatrix(X, feature_names=store.feature_names))
+            correct += int((proba.argmax(axis=1) == y).sum())
+            total += len(y)
+    return correct / total if total else float('nan')
+
+
+# ---------- 内存上限测试 ----------
+def write_synthetic_store(path, n_rows, n_features, n_classes=4, chunk_rows=100_000, seed=0):
+    """分块写入一个合成数据集：类别不均衡，特征与类别相关，不在内存中生成整个矩阵"""
+    from dataset_store import StoreWriter
+    rng = np.random.default_rng(seed)
+    classes = [f'class{i}' for i in range(n_classes)]
+    writer = StoreWriter(path, classes, [f'f{i}' for i in range(n_features)])
+    prior = np.array([0.6, 0.25, 0.1, 0.05][:n_classes])
+    prior /= prior.sum()
+    centers = rng.normal(0, 1, (n_classes, n_features)).astype(np.float32)
+    for start in range(0, n_rows, chunk_rows):
+        n = min(chunk_rows, n_rows - start)
+        codes = rng.choice(n_classes, size=n, p=prior).astype(np.uint8)
+        X = centers[codes] + rng.normal(0, 2.0, (n, n_features)).astype(np.float32)
+        session = (start + np.arange(n)) // 3600
+        writer.append(X, codes, (start + np.arange(n)) * 1000, session, 'synthetic')
+    return writer.close()
+
+
+def _peak_rss_mb():
+    import resource
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _memory_cap_child(store_path, chunk_rows, rounds, result_path):
+    """子进程：记录训练前后的峰值常驻内存"""
+    import json
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    booster, _ = train([store_path], chunk_rows=chunk_rows, num_boost_round=rounds,
+                       params={'max_depth': 4, 'nthread': 1}, verbose=False)
+    elapsed = time.perf_counter() - start
+    accuracy = evaluate(booster, [store_path], chunk_rows)
+    with open(result_path, 'w') as f:
+        json.dump({'baseline_mb': baseline, 'peak_mb': _peak_rss_mb(), 'seconds': elapsed,
+                   'accuracy': accuracy}, f)
+
+
+def check_memory_cap(cap_mb=128, n_features=100, chunk_rows=50_000, rounds=5):
+    """
+    生成特征矩阵约为 cap_mb 两倍的合成数据集，在子进程中做外存训练，
+    检查训练期间常驻内存的增长不超过 cap_mb。
+    注意XGBoost每行仍需在内存中保存梯度和预测值 (约 类别数*12 字节/行)，这部分与行数成正比。
+    """
+    import json
+    import subprocess
+    import sys
+    n_rows = int(cap_mb * 2 * 1024 * 1024 / (4 * n_features))
+    with tempfile.TemporaryDirectory() as root:
+        store = write_synthetic_store(os.path.join(root, 'store'), n_rows, n_features)
+        data_mb = len(store) * n_features * 4 / (1024 * 1024)
+        result_path = os.path.join(root, 'result.json')
+        subprocess.run([sys.executable, '-c',
+                        f"import train_external; train_external._memory_cap_child("
+                        f"{store.path!r}, {chunk_rows}, {rounds}, {result_path!r})"],
+                       cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+        with open(result_path) as f:
+            result = json.load(f)
+    growth = result['peak_mb'] - result['baseline_mb']
+    print(f"合成数据集 {n_rows} 行 x {n_features} 列 = {data_mb:.0f} MiB (上限 {cap_mb} MiB)")
+    print(f"训练 {rounds} 轮耗时 {result['seconds']:.1f}s, 常驻内存增长 {growth:.0f} MiB, "
+          f"训练集准确率 {result['accuracy']:.3f}")
+    assert data_mb > cap_mb
+    assert growth < cap_mb, f"内存增长 {growth:.0f} MiB 超过上限 {cap_mb} MiB"
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在内存映射数据集上流式训练XGBoost (外存模式)")
+    parser.add_argument('--train', nargs='+', default=[os.path.join(STORE_DIR, 'train')], help="训练数据集目录")
+    parser.add_argument('--eval', nargs='*', default=None, help="验证数据集目录，默认为 dataset_store/test (若存在)")
+    parser.add_argument('--balance', choices=['weight', 'sample', 'none'], default='weight',
+                        help="类别不均衡的处理方式：按类别加权 / 分层抽样 / 不处理")
+    parser.add_argument('--per-class', type=int, default=None, help="分层抽样时每类约保留的行数")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--in-core', action='store_true', help="量化后的数据驻留内存 (QuantileDMatrix)")
+    parser.add_argument('--cache-dir', default=None, help="外存模式的数据页缓存目录，默认使用临时目录")
+    parser.add_argument('--output', default='xgboost_model.joblib')
+    parser.add_argument('--encoder', default='label_encoder.joblib')
+    parser.add_argument('--bundle', default='model.bundle', help="同时写出的模型包，为空字符串时不写")
+    parser.add_argument('--check-memory', action='store_true', help="运行合成数据集的内存上限测试")
+    args = parser.parse_args(argv)
+
+    if args.check_memory:
+        check_memory_cap()
+        return
+    eval_paths = args.eval
+    if eval_paths is None:
+        default_eval = os.path.join(STORE_DIR, 'test')
+        eval_paths = [default_eval] if os.path.exists(default_eval) else []
+    booster, classes = train(args.train, eval_paths, args.balance, args.per_class, args.chunk_rows,
+                             args.rounds, cache_dir=args.cache_dir, external=not args.in_core)
+    if eval_paths:
+        print(f"验证集准确率: {evaluate(booster, eval_paths, args.chunk_rows):.4f}")
+    metadata = {'trainer': 'train_external', 'train': args.train, 'eval': eval_paths, 'balance': args.balance,
+                'rounds': args.rounds}
+    export(booster, classes, args.output, args.encoder, args.bundle, store_idle_means(args.train), metadata)
+    print(f"模型已保存为 '{args.output}'，编码器已保存为 '{args.encoder}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import ctypes
+import ctypes.util
+import json
+import time
+import numpy as np
+
+from feature_engine import FINAL_FEATURE_COLUMNS
+
+
+class TreeEnsemble:
+    """
+    将XGBoost多分类模型的所有树展开为扁平的NumPy数组，直接对一行或一批特征打分，不依赖pandas/sklearn。
+    计算过程与XGBoost CPU预测器保持一致：float32输入、`x < threshold` 走左子树、缺失值走默认方向、
+    按树的顺序以float32累加叶子值，最后做softmax。
+    quantize() 可得到阈值/叶子值为float16，或阈值为整数分箱下标 (cuts 为每个特征排序后的阈值) 的紧凑版本。
+    """
+    def __init__(self, feature, threshold, left, right, default_left, leaf_value,
+                 roots, tree_class, base_margin, max_depth, classes=None, feature_names=None, cuts=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.default_left = default_left
+        self.leaf_value = leaf_value
+        self.roots = roots
+        self.tree_class = tree_class
+        self.base_margin = base_margin
+        self.max_depth = max_depth
+        self.num_class = len(base_margin)
+        self.classes = list(classes) if classes is not None else [str(i) for i in range(self.num_class)]
+        self.feature_names = list(feature_names) if feature_names is not None else list(FINAL_FEATURE_COLUMNS)
+        # (各特征阈值拼接成的数组, 各特征的起止偏移)；不为None时输入先转换为分箱下标
+        self.cuts = cuts
+
+        # 每个类别对应的树按轮次排列，便于按XGBoost的顺序累加
+        self._class_trees = [np.flatnonzero(tree_class == k) for k in range(self.num_class)]
+        self._single_row = np.zeros((1, len(self.feature_names)), dtype=np.float32)
+
+    # ---------- 构建 ----------
+    @classmethod
+    def from_model_dict(cls, model, classes=None):
+        """从 Booster.save_raw('json') 得到的字典构建"""
+        learner = model['learner']
+        objective = learner['objective']['name']
+        if objective not in ('multi:softprob', 'multi:softmax'):
+            raise ValueError(f"不支持的目标函数: {objective}")
+        params = learner['learner_model_param']
+        num_class = int(params['num_class'])
+        base_score = np.float32(float(params['base_score']))
+        trees = learner['gradient_booster']['model']['trees']
+        tree_info = learner['gradient_booster']['model']['tree_info']
+
+        feature, threshold, left, right, default_left, leaf_value, roots = [], [], [], [], [], [], []
+        max_depth = 0
+        offset = 0
+        for tree in trees:
+            if any(tree['split_type']):
+                raise ValueError("不支持类别型特征的分裂")
+            lc = np.asarray(tree['left_children'], dtype=np.int32)
+            rc = np.asarray(tree['right_children'], dtype=np.int32)
+            # 剪枝后的树中残留已删除的节点，只保留从根可达的节点并重新编号
+            keep = _reachable(lc, rc)
+            index = np.full(len(lc), -1, dtype=np.int32)
+            index[keep] = np.arange(len(keep), dtype=np.int32)
+            lc = np.where(lc[keep] == -1, -1, index[lc[keep]])
+            rc = np.where(rc[keep] == -1, -1, index[rc[keep]])
+            is_leaf = lc == -1
+            node_ids = np.arange(len(lc), dtype=np.int32)
+            # 叶子节点的左右子节点指向自身，这样所有样本都可以走固定的 max_depth 步
+            left.append(np.where(is_leaf, node_ids, lc) + offset)
+            right.append(np.where(is_leaf, node_ids, rc) + offset)
+            feature.append(np.where(is_leaf, 0, np.asarray(tree['split_indices'], dtype=np.int32)[keep]))
+            conditions = np.asarray(tree['split_conditions'], dtype=np.float32)[keep]
+            threshold.append(np.where(is_leaf, np.float32(0), conditions))
+            leaf_value.append(np.where(is_leaf, conditions, np.float32(0)))
+            default_left.append(np.asarray(tree['default_left'], dtype=bool)[keep])
+            roots.append(offset)
+            max_depth = max(max_depth, _tree_depth(lc, rc))
+            offset += len(lc)
+
+        return cls(
+            feature=np.concatenate(feature).astype(np.int32),
+            threshold=np.concatenate(threshold).astype(np.float32),
+            left=np.concatenate(left).astype(np.int32),
+            right=np.concatenate(right).astype(np.int32),
+            default_left=np.concatenate(default_left),
+            leaf_value=np.concatenate(leaf_value).astype(np.float32),
+            roots=np.asarray(roots, dtype=np.int32),
+            tree_class=np.asarray(tree_info, dtype=np.int32),
+            base_margin=np.full(num_class, base_score, dtype=np.float32),
+            max_depth=max_depth,
+            classes=classes,
+            feature_names=learner.get('feature_names') or None,
+        )
+
+    @classmethod
+    def from_booster(cls, booster, classes=None):
+        return cls.from_model_dict(json.loads(booster.save_raw('json')), classes=classes)
+
+    @classmethod
+    def from_joblib(cls, model_path, encoder_path=None):
+        """从现有的 xgboost_model.joblib / label_encoder.joblib 构建 (需要xgboost和sklearn)"""
+        import joblib
+        model = joblib.load(model_path)
+        classes = None
+        if encoder_path is not None:
+            classes = [str(c) for c in joblib.load(encoder_path).classes_]
+        return cls.from_booster(model.get_booster(), classes=classes)
+
+    # ---------- 量化 ----------
+    def quantize(self, mode):
+        """
+        mode='float16'：阈值和叶子值保存为float16 (阈值舍入后个别样本可能走到另一侧)；
+        mode='bins'：阈值换成该特征所有阈值中的下标 (uint8/uint16)，输入先按阈值分箱，结果与原模型完全一致。
+        """
+        if mode == 'float16':
+            # 超出float16范围 (65504) 的阈值截断到最大值，字节数等大数值特征的分裂会因此改变
+            limit = np.finfo(np.float16).max
+            return self._replace(threshold=np.clip(self.threshold, -limit, limit).astype(np.float16),
+                                 leaf_value=self.leaf_value.astype(np.float16))
+        if mode != 'bins':
+            raise ValueError(f"未知的量化方式: {mode}")
+        is_split = self.left != np.arange(len(self.left))
+        cut_values, offsets = [], [0]
+        threshold = np.zeros(len(self.threshold), dtype=np.int64)
+        for f in range(len(self.feature_names)):
+            nodes = np.flatnonzero(is_split & (self.feature == f))
+            cuts = np.unique(self.threshold[nodes])
+            # x < cuts[k] 等价于 bin(x) = searchsorted(cuts, x, 'right') <= k，即 bin(x) < k + 1
+            threshold[nodes] = np.searchsorted(cuts, self.threshold[nodes]) + 1
+            cut_values.append(cuts)
+            offsets.append(offsets[-1] + len(cuts))
+        dtype = np.uint8 if threshold.max() <= np.iinfo(np.uint8).max else np.uint16
+        cuts = (np.concatenate(cut_values).astype(np.float32), np.asarray(offsets, dtype=np.int32))
+        return self._replace(threshold=threshold.astype(dtype), cuts=cuts)
+
+    def _replace(self, **changes):
+        fields = dict(feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                      default_left=self.default_left, leaf_value=self.leaf_value, roots=self.roots,
+                      tree_class=self.tree_class, base_margin=self.base_margin, max_depth=self.max_depth,
+                      classes=self.classes, feature_names=self.feature_names, cuts=self.cuts)
+        fields.update(changes)
+        return TreeEnsemble(**fields)
+
+    def _bin(self, X):
+        """按各特征的阈值分箱，缺失值保持为NaN (仍走默认方向)"""
+        cut_values, offsets = self.cuts
+        binned = np.empty(X.shape, dtype=np.float32)
+        for f in range(X.shape[1]):
+            binned[:, f] = np.searchsorted(cut_values[offsets[f]:offsets[f + 1]], X[:, f], side='right')
+        binned[np.isnan(X)] = np.nan
+        return binned
+
+    # ---------- 序列化 ----------
+    def save(self, path_or_file):
+        extra = {}
+        if self.cuts is not None:
+            extra = {'cut_values': self.cuts[0], 'cut_offsets': self.cuts[1]}
+        np.savez(
+            path_or_file, feature=self.feature, threshold=self.threshold, left=self.left,
+            right=self.right, default_left=self.default_left, leaf_value=self.leaf_value,
+            roots=self.roots, tree_class=self.tree_class, base_margin=self.base_margin,
+            max_depth=np.int32(self.max_depth), classes=np.asarray(self.classes),
+            feature_names=np.asarray(self.feature_names), **extra,
+        )
+
+    @classmethod
+    def load(cls, path_or_file):
+        with np.load(path_or_file) as data:
+            cuts = (data['cut_values'], data['cut_offsets']) if 'cut_values' in data else None
+            return cls(
+                feature=data['feature'], threshold=data['threshold'], left=data['left'],
+                right=data['right'], default_left=data['default_left'], leaf_value=data['leaf_value'],
+                roots=data['roots'], tree_class=data['tree_class'], base_margin=data['base_margin'],
+                max_depth=int(data['max_depth']), classes=[str(c) for c in data['classes']],
+                feature_names=[str(c) for c in data['feature_names']], cuts=cuts,
+            )
+
+    # ---------- 预测 ----------
+    def _leaves(self, X):
+        rows = np.arange(X.shape[0])[:, None]
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots)))
+        for _ in range(self.max_depth):
+            values = X[rows, self.feature[nodes]]
+            go_left = np.where(np.isnan(values), self.default_left[nodes], values < self.threshold[nodes])
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.leaf_value[nodes]
+
+    def predict_margin(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        if self.cuts is not None:
+            X = self._bin(X)
+        leaves = self._leaves(X)
+        margin = np.empty((X.shape[0], self.num_class), dtype=np.float32)
+        for k, trees in enumerate(self._class_trees):
+            # 与XGBoost一致，从base_score开始按树的顺序逐棵累加 (float32，顺序相关)
+            stacked = np.concatenate([np.broadcast_to(self.base_margin[k], (X.shape[0], 1)), leaves[:, trees]], axis=1)
+            margin[:, k] = np.add.accumulate(stacked, axis=1, dtype=np.float32)[:, -1]
+        return margin
+
+    def predict_proba(self, X):
+        margin = self.predict_margin(X)
+        shifted = margin - margin.max(axis=1, keepdims=True)
+        exp = _expf(shifted)
+        total = np.zeros(margin.shape[0], dtype=np.float64)
+        for k in range(self.num_class):
+            total += exp[:, k]
+        return exp / total.astype(np.float32)[:, None]
+
+    def predict(self, X):
+        """返回类别标签字符串数组"""
+        index = self.predict_proba(X).argmax(axis=1)
+        return [self.classes[i] for i in index]
+
+    def predict_one(self, feature_vector):
+        """
+        对单行特征打分，feature_vector 可以是按 FINAL_FEATURE_COLUMNS 排序的数组，也可以是 {列名: 值} 的字典。
+        返回 (标签, 各类别概率)。
+        """
+        row = self._single_row
+        if isinstance(feature_vector, dict):
+            row[0] = [feature_vector[c] for c in self.feature_names]
+        else:
+            row[0] = feature_vector
+        proba = self.predict_proba(row)[0]
+        return self.classes[int(proba.argmax())], proba
+
+
+def _load_expf():
+    """
+    XGBoost的softmax调用C库的expf，而numpy的float32 exp使用自己的SIMD实现，两者末位可能不同。
+    优先通过ctypes调用同一个C库的expf，找不到时退回到double精度计算后舍入。
+    """
+    for name in (ctypes.util.find_library('m'), 'ucrtbase', 'msvcrt'):
+        if not name:
+            continue
+        try:
+            func = ctypes.CDLL(name).expf
+        except (OSError, AttributeError):
+            continue
+        func.restype = ctypes.c_float
+        func.argtypes = [ctypes.c_float]
+        ufunc = np.frompyfunc(func, 1, 1)
+        return lambda x: ufunc(x).astype(np.float32)
+    return lambda x: np.exp(x.astype(np.float64)).astype(np.float32)
+
+
+_expf = _load_expf()
+
+
+def _reachable(left_children, right_children):
+    """从根节点可达的节点编号 (升序，没有删除节点时即全部节点)"""
+    reachable = np.zeros(len(left_children), dtype=bool)
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        reachable[node] = True
+        if left_children[node] != -1:
+            stack += [left_children[node], right_children[node]]
+    return np.flatnonzero(reachable)
+
+
+def _tree_depth(left_children, right_children):
+    depth = np.zeros(len(left_children), dtype=np.int32)
+    for node in range(len(left_children)):
+        if left_children[node] != -1:
+            depth[left_children[node]] = depth[node] + 1
+            depth[right_children[node]] = depth[node] + 1
+    return int(depth.max())
+
+
+def check_exactness(model_path='xgboost_model.joblib', encoder_path='label_encoder.joblib',
+                    data_path='processed_system_test.csv'):
+    """与 XGBClassifier.predict_proba 逐位比较"""
+    import joblib
+    import pandas as pd
+    model = joblib.load(model_path)
+    engine = TreeEnsemble.from_joblib(model_path, encoder_path)
+    X = pd.read_csv(data_path)[FINAL_FEATURE_COLUMNS]
+    expected = model.predict_proba(X)
+    ours = engine.predict_proba(X.to_numpy())
+    mismatched = int((expected != ours).any(axis=1).sum())
+    assert mismatched == 0, f"{mismatched}/{len(X)} 行的概率与XGBoost不一致, 最大误差 {np.abs(expected - ours).max()}"
+    return len(X)
+
+
+def benchmark(model_path='xgboost_model.joblib', encoder_path='label_encoder.joblib', repeat=2000):
+    """单行预测延迟：旧路径(DataFrame + sklearn封装 + inverse_transform) 与扁平树引擎对比"""
+    import joblib
+    import pandas as pd
+    model = joblib.load(model_path)
+    label_encoder = joblib.load(encoder_path)
+    engine = TreeEnsemble.from_joblib(model_path, encoder_path)
+    rng = np.random.default_rng(0)
+    rows = rng.uniform(0, 100, (repeat, len(FINAL_FEATURE_COLUMNS)))
+    feature_vectors = [dict(zip(FINAL_FEATURE_COLUMNS, r)) for r in rows]
+
+    n_old = min(repeat, 300)
+    start = time.perf_counter()
+    for fv in feature_vectors[:n_old]:
+        model_input = pd.DataFrame([fv])[FINAL_FEATURE_COLUMNS]
+        label_encoder.inverse_transform(model.predict(model_input))[0]
+    old = (time.perf_counter() - start) / n_old
+
+    start = time.perf_counter()
+    for fv in feature_vectors:
+        engine.predict_one(fv)
+    new = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    engine.predict_proba(rows)
+    batch = (time.perf_counter() - start) / repeat
+
+    print(f"XGBClassifier + DataFrame: {old * 1e6:9.1f} us/行")
+    print(f"TreeEnsemble 单行        : {new * 1e6:9.1f} us/行")
+    print(f"TreeEnsemble 批量        : {batch * 1e6:9.1f} us/行")
+    return old, new, batch
+
+
+if __name__ == "__main__":
+    print(f"逐位一致性校验通过: {check_exactness()} 行")
+    benchmark()
@@ -0,0 +1,253 @@
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import xgboost as xgb
+from sklearn.model_selection import StratifiedGroupKFold
+
+from dataset_store import STORE_DIR, DatasetStore
+from train_external import DEFAULT_PARAMS, balanced_weights, export, store_idle_means
+
+# 每个参数的采样方式：(类型, 下限, 上限)，'log' 表示在对数尺度上均匀采样
+SEARCH_SPACE = {
+    'max_depth': ('int', 3, 10),
+    'learning_rate': ('log', 0.02, 0.3),
+    'min_child_weight': ('log', 0.5, 20),
+    'subsample': ('float', 0.5, 1.0),
+    'colsample_bytree': ('float', 0.4, 1.0),
+    'reg_lambda': ('log', 0.1, 10),
+    'gamma': ('float', 0.0, 2.0),
+}
+
+MAX_ROUNDS = 500
+EARLY_STOPPING_ROUNDS = 20
+# 已完成部分折的平均损失比当前最优试验差这么多 (相对值) 时提前放弃该试验
+PRUNE_TOLERANCE = 0.25
+
+
+def session_folds(store, n_splits=5, seed=0):
+    """按会话分组、按标签分层的折，同一会话的数据只会出现在一侧，避免相邻秒级数据泄漏"""
+    groups = store.groups()
+    n_splits = min(n_splits, len(np.unique(groups)))
+    splitter = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+    return list(splitter.split(np.zeros(len(store)), np.asarray(store.y), groups))
+
+
+def sample_params(trial, seed=0, space=SEARCH_SPACE):
+    """第 trial 次试验的超参数，只取决于 (seed, trial)，与并行度和完成顺序无关"""
+    rng = np.random.default_rng((seed, trial))
+    params = {}
+    for name, (kind, low, high) in space.items():
+        if kind == 'int':
+            params[name] = int(rng.integers(low, high + 1))
+        elif kind == 'log':
+            params[name] = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        else:
+            params[name] = float(rng.uniform(low, high))
+    return params
+
+
+# ---------- 工作进程 ----------
+# 每个工作进程只打开一次数据集，并在首次用到某一折时构建该折的量化矩阵，之后所有试验复用
+_worker = {}
+
+
+def _init_worker(store_path, folds, best_loss, nthread, max_rounds=MAX_ROUNDS):
+    store = DatasetStore(store_path)
+    _worker.update(store=store, folds=folds, best_loss=best_loss, nthread=nthread, max_rounds=max_rounds,
+                   matrices={})
+
+
+def _fold_matrices(k):
+    matrices = _worker['matrices']
+    if k not in matrices:
+        store = _worker['store']
+        train_rows, val_rows = _worker['folds'][k]
+        X_train, y_train = store.take(train_rows)
+        X_val, y_val = store.take(val_rows)
+        weight = balanced_weights(np.bincount(y_train, minlength=len(store.classes)))[y_train]
+        dtrain = xgb.QuantileDMatrix(X_train, y_train, weight=weight, max_bin=DEFAULT_PARAMS['max_bin'],
+                                     feature_names=store.feature_names, nthread=_worker['nthread'])
+        dval = xgb.QuantileDMatrix(X_val, y_val, ref=dtrain, feature_names=store.feature_names,
+                                   nthread=_worker['nthread'])
+        matrices[k] = (dtrain, dval, y_val)
+    return matrices[k]
+
+
+def run_trial(trial, params, prune=True):
+    """
+    在所有折上训练并评估一组参数，每折都在验证集上早停。
+    每完成一折，若已完成折的平均损失比当前最优试验差 PRUNE_TOLERANCE 以上，则放弃剩余的折。
+    """
+    store = _worker['store']
+    best_loss = _worker['best_loss']
+    train_params = dict(DEFAULT_PARAMS, num_class=len(store.classes), nthread=_worker['nthread'], seed=trial)
+    train_params.update(params)
+    start = time.perf_counter()
+    folds = []
+    status = 'complete'
+    for k in range(len(_worker['folds'])):
+        dtrain, dval, y_val = _fold_matrices(k)
+        history = {}
+        booster = xgb.train(train_params, dtrain, num_boost_round=_worker['max_rounds'], evals=[(dval, 'val')],
+                            early_stopping_rounds=EARLY_STOPPING_ROUNDS, evals_result=history, verbose_eval=False)
+        proba = booster.predict(dval, iteration_range=(0, booster.best_iteration + 1))
+        folds.append({
+            'fold': k,
+            'mlogloss': float(history['val']['mlogloss'][booster.best_iteration]),
+            'accuracy': float((proba.argmax(axis=1) == y_val).mean()),
+            'best_iteration': int(booster.best_iteration),
+        })
+        mean_loss = float(np.mean([f['mlogloss'] for f in folds]))
+        if prune and k + 1 < len(_worker['folds']) and mean_loss > best_loss.value * (1 + PRUNE_TOLERANCE):
+            status = 'pruned'
+            break
+    if status == 'complete':
+        with best_loss.get_lock():
+            best_loss.value = min(best_loss.value, mean_loss)
+    return {
+        'trial': trial,
+        'status': status,
+        'params': params,
+        'mlogloss': mean_loss,
+        'accuracy': float(np.mean([f['accuracy'] for f in folds])),
+        'best_iteration': int(np.mean([f['best_iteration'] for f in folds])),
+        'folds': folds,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def search(store_path, n_trials=20, n_splits=5, jobs=1, seed=0, prune=True, max_rounds=MAX_ROUNDS, verbose=True):
+    """
+    在进程池中并行运行 n_trials 次随机搜索，返回按平均验证损失排序的试验结果。
+    每个进程使用 (CPU核数 // jobs) 个线程，总线程数不超过核数，耗时随核数近似线性下降。
+    """
+    store = DatasetStore(store_path)
+    folds = session_folds(store, n_splits, seed)
+    jobs = max(1, min(jobs or os.cpu_count(), n_trials))
+    nthread = max(1, (os.cpu_count() or 1) // jobs)
+    best_loss = multiprocessing.Value('d', float('inf'))
+    if verbose:
+        print(f"{len(store)} 行, {len(store.sessions)} 个会话, {len(folds)} 折, "
+              f"{n_trials} 次试验, {jobs} 个进程 x {nthread} 线程")
+
+    results = []
+
+    def report(result):
+        results.append(result)
+        if verbose:
+            print(f"  试验 {result['trial']:3d} [{result['status']}] mlogloss={result['mlogloss']:.4f} "
+                  f"accuracy={result['accuracy']:.4f} ({result['seconds']:.1f}s)")
+
+    if jobs == 1:
+        _init_worker(store_path, folds, best_loss, nthread, max_rounds)
+        for trial in range(n_trials):
+            report(run_trial(trial, sample_params(trial, seed), prune))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs, initializer=_init_worker,
+                initargs=(store_path, folds, best_loss, nthread, max_rounds)) as executor:
+            futures = [executor.submit(run_trial, trial, sample_params(trial, seed), prune)
+                       for trial in range(n_trials)]
+            for future in concurrent.futures.as_completed(futures):
+                report(future.result())
+    # 被剪枝的试验只完成了部分折，排在完整试验之后
+    results.sort(key=lambda r: (r['status'] != 'complete', r['mlogloss']))
+    return results, folds
+
+
+def fit_best(store_path, best):
+    """用最优参数在全部训练数据上重新训练，轮数取交叉验证中早停轮数的平均值"""
+    store = DatasetStore(store_path)
+    X, y = store.take()
+    weight = balanced_weights(np.bincount(y, minlength=len(store.classes)))[y]
+    dtrain = xgb.QuantileDMatrix(X, y, weight=weight, max_bin=DEFAULT_PARAMS['max_bin'],
+                                 feature_names=store.feature_names)
+    params = dict(DEFAULT_PARAMS, num_class=len(store.classes))
+    params.update(best['params'])
+    booster = xgb.train(params, dtrain, num_boost_round=best['best_iteration'] + 1)
+    return booster, store.classes
+
+
+# ---------- 测试 ----------
+def check_search(n_rows=20_000, n_features=10, n_trials=6, jobs=2, max_rounds=60):
+    """合成数据集上检查：各折会话不重叠；并行与串行得到相同的试验结果；明显差的参数会被提前放弃；打印耗时"""
+    import tempfile
+    from train_external import write_synthetic_store
+    with tempfile.TemporaryDirectory() as root:
+        store = write_synthetic_store(os.path.join(root, 'store'), n_rows, n_features, chunk_rows=10_000)
+        groups = store.groups()
+        for train_rows, val_rows in session_folds(store):
+            assert not set(groups[train_rows]) & set(groups[val_rows]), "同一会话出现在训练折和验证折中"
+
+        timings = {}
+        outcomes = {}
+        for n_jobs in (1, jobs):
+            start = time.perf_counter()
+            results, _ = search(store.path, n_trials, 3, n_jobs, prune=False, max_rounds=max_rounds, verbose=False)
+            timings[n_jobs] = time.perf_counter() - start
+            outcomes[n_jobs] = {r['trial']: round(r['mlogloss'], 6) for r in results}
+        assert outcomes[1] == outcomes[jobs], "并行搜索的结果与串行不一致"
+        print(f"会话分组折检查通过；{n_trials} 次试验 x 3 折: 1 进程 {timings[1]:.1f}s, "
+              f"{jobs} 进程 {timings[jobs]:.1f}s (CPU核数 {os.cpu_count()})")
+
+        results, folds = search(store.path, n_trials, 3, 1, prune=True, max_rounds=max_rounds, verbose=False)
+        pruned = sum(r['status'] == 'pruned' for r in results)
+        print(f"开启剪枝: {pruned}/{n_trials} 次试验被提前放弃, 最优 mlogloss={results[0]['mlogloss']:.4f}")
+
+        # 故意设置的差参数 (学习率极小，max_rounds 轮内几乎学不到东西)：完成第一折后就应被放弃
+        best = results[0]
+        _init_worker(store.path, folds, multiprocessing.Value('d', best['mlogloss']), 1, max_rounds)
+        bad = run_trial(n_trials, dict(best['params'], learning_rate=1e-4))
+        assert bad['status'] == 'pruned' and len(bad['folds']) < len(folds), "差的试验没有被提前放弃"
+        unpruned = run_trial(n_trials, dict(best['params'], learning_rate=1e-4), prune=False)
+        assert unpruned['status'] == 'complete' and len(unpruned['folds']) == len(folds)
+        print(f"差参数 (mlogloss={bad['mlogloss']:.4f}) 在 {len(bad['folds'])}/{len(folds)} 折后被放弃, "
+              f"耗时 {bad['seconds']:.2f}s (不剪枝 {unpruned['seconds']:.2f}s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按会话分组交叉验证的XGBoost超参数搜索")
+    parser.add_argument('--store', default=os.path.join(STORE_DIR, 'train'), help="训练数据集目录")
+    parser.add_argument('--trials', type=int, default=30)
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--jobs', type=int, default=None, help="并行进程数，默认为CPU核数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-prune', action='store_true', help="不提前放弃表现差的试验")
+    parser.add_argument('--output', default='xgboost_model.joblib')
+    parser.add_argument('--encoder', default='label_encoder.joblib')
+    parser.add_argument('--bundle', default='model.bundle', help="同时写出的模型包，为空字符串时不写")
+    parser.add_argument('--results', default='tune_results.json', help="每次试验及每折指标的输出文件")
+    parser.add_argument('--check', action='store_true', help="在合成数据集上运行检查与并行耗时对比")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        check_search()
+        return
+    start = time.perf_counter()
+    results, folds = search(args.store, args.trials, args.folds, args.jobs, args.seed, not args.no_prune)
+    best = results[0]
+    print(f"搜索完成 ({time.perf_counter() - start:.1f}s)，最优试验 {best['trial']}: "
+          f"mlogloss={best['mlogloss']:.4f} accuracy={best['accuracy']:.4f}")
+    print(f"  参数: {best['params']}")
+    for fold in best['folds']:
+        print(f"  第 {fold['fold']} 折: mlogloss={fold['mlogloss']:.4f} accuracy={fold['accuracy']:.4f} "
+              f"早停轮数={fold['best_iteration'] + 1}")
+
+    with open(args.results, 'w', encoding='utf-8') as f:
+        json.dump({'store': args.store, 'folds': len(folds), 'seed': args.seed, 'best': best,
+                   'trials': results}, f, indent=1, ensure_ascii=False)
+    booster, classes = fit_best(args.store, best)
+    metadata = {'trainer': 'tune', 'train': [args.store], 'params': best['params'],
+                'rounds': best['best_iteration'] + 1, 'cv_folds': len(folds),
+                'cv_mlogloss': best['mlogloss'], 'cv_accuracy': best['accuracy']}
+    export(booster, classes, args.output, args.encoder, args.bundle, store_idle_means([args.store]), metadata)
+    print(f"模型已保存为 '{args.output}'，编码器已保存为 '{args.encoder}'，试验结果已保存到 '{args.results}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,22 +2,30 @@ import tkinter as tk
 import tkinter.font as tkfont
 import threading
 import time
-import psutil
 from pynput import keyboard, mouse
-import os
-import csv
 import datetime
 import pynvml
-import collections # 导入collections模块以使用deque
+import argparse
+from log_writer import LogWriter
+from ingest import IngestClient
+from input_aggregator import InputAggregator
+from system_probe import make_probe
+from probe_runner import CounterRates, Probe, ProbeRunner
+from scheduler import TickScheduler, RowAggregator
+from feature_engine import COUNTER_MASK
+from metrics import Metrics, probe_collector
 
 class Recorder:
     """
     一个用于记录系统状态和用户输入的类。
     它在后台线程中运行，以避免阻塞GUI。
     """
-    def __init__(self, label_var, status_var):
+    def __init__(self, label_var, status_var, sample_hz=1, output_format='csv', output_dir="train_data",
+                 flush_interval=1.0, compress=False, metrics=None, ingest=None):
         self.label_var = label_var
         self.status_var = status_var
+        self.sample_hz = sample_hz # 每秒采样次数，多次采样合并为一行
+        self.output_format = output_format # 'csv' 或 'columnar' (列式二进制日志段，见 columnar_log.py)
         
         # 线程和监听器
         self.mouse_listener = None
@@ -27,29 +35,20 @@ class Recorder:
         
         # 状态与配置
         self.running = False
-        self.output_filename = "train_data/system_log_9_24.csv"
+        # 日志按大小/日期轮转为 output_dir/system_log_<日期>_<时间>.csv 等多个段
+        self.output_dir = output_dir
+        self.flush_interval = flush_interval # 落盘间隔 (秒)，进程被强行结束时最多丢失这段时间的数据
+        self.compress = compress # 是否gzip压缩已关闭的CSV段
+        self.metrics = metrics # metrics.Metrics，为None时不记录性能指标
+        self.ingest = ingest # 入库服务地址 host:port，设置后同时把数据发送到 ingest.py 服务端
         
-        # 数据采集变量
-        self.mouse_locations = []
-        self.mouse_left_clicks = 0
-        self.mouse_right_clicks = 0
-        self.mouse_scroll_amount = 0
-        self.keyboard_counts = 0
+        # 用户输入聚合 (监听线程无锁累加，采样线程按周期取增量)
+        self.input_aggregator = InputAggregator(throttle_time=0.1)
         
-        self.data_buffer = collections.deque(maxlen=5)
-        
-        # 性能与同步
-        self.data_lock = threading.Lock()
-        self.last_move_time = 0
-        self.throttle_time = 0.1
-
-        # 网络与磁盘
-        self.bytes_sent_prev = 0
-        self.bytes_recv_prev = 0
-        self.packets_sent_prev = 0
-        self.packets_recv_prev = 0
-        self.read_bytes_prev = 0
-        self.write_bytes_prev = 0
+        # 网络与磁盘 (CPU/内存/网络/磁盘由同一个采集后端一次性读取)
+        self.system_probe = make_probe()
+        self.counter_rates = CounterRates(6) # 网络/磁盘累计计数 -> 每次采集之间的增量
+        self.last_sample_time = None
 
         # GPU 初始化
         self.gpu_handle = None
@@ -60,124 +59,124 @@ class Recorder:
         except Exception as e:
             print(f"Warning: Could not initialize NVIDIA GPU monitoring. Error: {e}")
 
-    def on_click(self, x, y, button, pressed):
-        if pressed:
-            with self.data_lock:
-                if button == mouse.Button.left:
-                    self.mouse_left_clicks += 1
-                elif button == mouse.Button.right:
-                    self.mouse_right_clicks += 1
-
-    def on_move(self, x, y):
-        current_time = time.time()
-        if current_time - self.last_move_time < self.throttle_time:
-            return
-        self.last_move_time = current_time
-        with self.data_lock:
-            self.mouse_locations.append((x, y))
+        # 各采集项在线程池中并发执行，单个慢调用不会拖慢整个采样；等待时间不超过采样间隔的80%
+        deadline = min(0.2, 0.8 / sample_hz)
+        probes = [
+            Probe('system', self.system_probe.snapshot, deadline=deadline, default=(0.0, 0.0, 0, 0, 0, 0, 0, 0)),
+            Probe('gpu', self.read_gpu, deadline=deadline, default=(-1, -1)),
+        ]
+        self.probe_runner = ProbeRunner(probes)
+        self.probe_results = {}
+        if self.metrics is not None:
+            self.metrics.add_collector(probe_collector(self.probe_runner))
+
+    def read_gpu(self):
+        """读取GPU使用率和显存占用率，不可用时为-1"""
+        gpu_usage, gpu_vram_usage = -1, -1 # 默认为-1，表示不可用
+        if self.gpu_handle:
+            try:
+                gpu_util = pynvml.nvmlDeviceGetUtilizationRates(self.gpu_handle)
+                gpu_usage = gpu_util.gpu
+                mem_info = pynvml.nvmlDeviceGetMemoryInfo(self.gpu_handle)
+                gpu_vram_usage = (mem_info.used / mem_info.total) * 100 if mem_info.total > 0 else 0
+            except pynvml.NVMLError as e:
+                print(f"Could not get GPU info: {e}")
+        return gpu_usage, gpu_vram_usage
+
+    def collect_sample(self):
+        """
+        采集一次原始数据，返回 (按 RAW_DATA_COLUMNS 排列的数据, 距上次采集经过的秒数)。
+        计数类字段为本次与上次采集之间的增量，尚未换算为每秒速率；首次采集时经过时间为None。
+        """
+        # 1. 并发采集系统性能数据与GPU数据，超时的采集项沿用上一次的值并标记为stale
+        self.probe_results = self.probe_runner.collect()
+        (cpu_usage, ram_usage, bytes_sent, bytes_recv, packets_sent, packets_recv,
+         read_bytes, write_bytes) = self.probe_results['system'].value
+        gpu_usage, gpu_vram_usage = self.probe_results['gpu'].value
+
+        # 2. 采集用户输入数据
+        mouse_distance_sum, left_clicks, right_clicks, scroll_amount, keyboard_hits = self.input_aggregator.get_and_reset()
 
-    def on_press(self, key):
-        with self.data_lock:
-            self.keyboard_counts += 1
+        now = time.monotonic()
+        elapsed = now - self.last_sample_time if self.last_sample_time is not None else None
+        self.last_sample_time = now
 
-    def on_scroll(self, x, y, dx, dy):
-        with self.data_lock:
-            self.mouse_scroll_amount += abs(dy)
+        (bytes_sent_delta, bytes_recv_delta, packets_sent_delta, packets_recv_delta,
+         read_bytes_delta, write_bytes_delta) = self.counter_rates.update(
+            self.probe_results['system'],
+            (bytes_sent, bytes_recv, packets_sent, packets_recv, read_bytes, write_bytes), elapsed)
+
+        return [
+            mouse_distance_sum, left_clicks, right_clicks, scroll_amount,
+            keyboard_hits, cpu_usage, ram_usage, gpu_usage, gpu_vram_usage, bytes_sent_delta, bytes_recv_delta, packets_sent_delta, packets_recv_delta,
+            read_bytes_delta, write_bytes_delta,
+        ], elapsed
 
     def system_stats_worker(self):
-        """后台线程，每秒采集一次数据并写入文件。"""
-        # 使用'a'模式打开文件，确保在程序多次启动和停止时不会覆盖旧数据
+        """后台线程，按 sample_hz 采样，每秒合并为一行每秒速率数据，交给后台写入线程批量落盘。"""
+        # 每次开始记录都写入新的日志段，不会覆盖旧数据；启动时先恢复上次异常退出留下的段
         try:
-            file = open(self.output_filename, 'a', newline='', encoding='utf-8')
-            writer = csv.writer(file)
-        except IOError as e:
-            error_msg = f"错误: 无法打开文件 {self.output_filename}"
+            writer = LogWriter(self.output_dir, fmt=self.output_format, flush_interval=self.flush_interval,
+                               compress=self.compress).start()
+        except (IOError, ValueError) as e:
+            error_msg = f"错误: 无法写入目录 {self.output_dir}"
             self.status_var.set(error_msg)
             print(f"{error_msg}. Reason: {e}")
-            return # 如果文件无法打开，则终止工作线程
+            return # 如果无法写入，则终止工作线程
+        ingest_client = IngestClient(self.ingest).start() if self.ingest else None
+
+        # 固定时刻触发，采样耗时不会让周期漂移
+        scheduler = TickScheduler(1.0 / self.sample_hz)
+        aggregator = RowAggregator(COUNTER_MASK)
+        self.last_sample_time = None
+        self.collect_sample() # 建立网络/磁盘计数的基准
+        current_row = 0
 
+        metrics = self.metrics
         while not self.stop_event.is_set():
-            # 1. 采集系统数据 (为了避免等待1秒，我们将interval设为None，然后在循环末尾sleep)
-            cpu_usage = psutil.cpu_percent(interval=None) 
-            ram_usage = psutil.virtual_memory().percent
-            gpu_usage, gpu_vram_usage = -1, -1
-            if self.gpu_handle:
-                try:
-                    gpu_util = pynvml.nvmlDeviceGetUtilizationRates(self.gpu_handle)
-                    gpu_usage = gpu_util.gpu
-                    mem_info = pynvml.nvmlDeviceGetMemoryInfo(self.gpu_handle)
-                    gpu_vram_usage = (mem_info.used / mem_info.total) * 100 if mem_info.total > 0 else 0
-                except pynvml.NVMLError as e:
-                    print(f"Could not get GPU info: {e}")
-
-            # 2. 采集用户输入数据
-            with self.data_lock:
-                mouse_distance_sum = sum(((p2[0] - p1[0])**2 + (p2[1] - p1[1])**2)**0.5 for p1, p2 in zip(self.mouse_locations, self.mouse_locations[1:]))
-                left_clicks = self.mouse_left_clicks
-                right_clicks = self.mouse_right_clicks
-                scroll_amount = self.mouse_scroll_amount
-                keyboard_hits = self.keyboard_counts
-                
-                # 重置数据
-                self.mouse_locations.clear()
-                self.mouse_left_clicks = 0
-                self.mouse_right_clicks = 0
-                self.mouse_scroll_amount = 0
-                self.keyboard_counts = 0
-            
-            net_io_now = psutil.net_io_counters()
-            disk_io_now = psutil.disk_io_counters()
-            
-            if self.bytes_recv_prev == 0:
-                bytes_sent_per_sec = 0
-                bytes_recv_per_sec = 0
-                packets_sent_per_sec = 0
-                packets_recv_per_sec = 0
-                read_bytes_per_sec = 0
-                write_bytes_per_sec = 0
-            else:
-                bytes_sent_per_sec = net_io_now.bytes_sent - self.bytes_sent_prev
-                bytes_recv_per_sec = net_io_now.bytes_recv - self.bytes_recv_prev
-                packets_sent_per_sec = net_io_now.packets_sent - self.packets_sent_prev
-                packets_recv_per_sec = net_io_now.packets_recv - self.packets_recv_prev
-                read_bytes_per_sec = disk_io_now.read_bytes - self.read_bytes_prev
-                write_bytes_per_sec = disk_io_now.write_bytes - self.write_bytes_prev
-            self.bytes_sent_prev = net_io_now.bytes_sent
-            self.bytes_recv_prev = net_io_now.bytes_recv
-            self.packets_sent_prev = net_io_now.packets_sent
-            self.packets_recv_prev = net_io_now.packets_recv
-            self.read_bytes_prev = disk_io_now.read_bytes
-            self.write_bytes_prev = disk_io_now.write_bytes
+            tick = scheduler.wait()
+            start = time.perf_counter()
+            sample, elapsed = self.collect_sample()
+            aggregator.add(sample, elapsed)
+            if metrics is not None:
+                metrics.lap('probe', start)
+                metrics.count('ticks_total')
+                if tick.missed:
+                    metrics.count('missed_ticks_total', tick.missed)
+                if tick.lateness > scheduler.late_threshold:
+                    metrics.count('late_ticks_total')
+            if tick.missed:
+                print(f"Warning: sampler fell behind, skipped {tick.missed} tick(s)")
+
+            # 每 sample_hz 个采样 (即1秒) 合并为一行
+            row_index = tick.index // self.sample_hz
+            if row_index == current_row:
+                continue
+            current_row = row_index
+            row = aggregator.emit()
+            if row is None:
+                continue
 
             # 3. 准备数据行
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            timestamp = datetime.datetime.now().replace(microsecond=0)
             current_label = self.label_var.get()
-            data_row = [
-                timestamp, mouse_distance_sum, left_clicks, right_clicks, scroll_amount, 
-                keyboard_hits, cpu_usage, ram_usage, gpu_usage, gpu_vram_usage,bytes_sent_per_sec, bytes_recv_per_sec, packets_sent_per_sec, packets_recv_per_sec,
-                read_bytes_per_sec, write_bytes_per_sec,
-                current_label
-            ]
-            
-            # 如果缓冲区已满 (5条记录)，则将最旧的记录写入文件
-            if len(self.data_buffer) == self.data_buffer.maxlen:
-                oldest_data = self.data_buffer[0] # 获取最旧的数据
-                writer.writerow(oldest_data)
-                self.status_var.set(f"数据已记录于 {oldest_data[0]}")
-                print(f"Data recorded: {oldest_data}")
-
-            # 将新数据添加到缓冲区的右侧
-            self.data_buffer.append(data_row)
-            
-            # 等待1秒钟，完成每秒采集一次的循环
-            time.sleep(1)
+            data_row = [timestamp] + row + [current_label]
+            start = time.perf_counter()
+            writer.write(data_row)
+            if ingest_client is not None:
+                ingest_client.write(data_row)
+            if metrics is not None:
+                metrics.lap('write', start)
+            self.status_var.set(f"数据已记录于 {timestamp}")
+            print(f"Data recorded: {data_row}")
 
-        print("Flushing remaining data from buffer...")
-        for row in self.data_buffer:
-            writer.writerow(row)
-            print(f"Flushed data: {row}")
-        self.data_buffer.clear()
-        file.close() # 关闭文件
+        print("Flushing remaining data...")
+        writer.close() # 写完剩余的行并关闭日志段
+        print(f"Data written to: {writer.segments}")
+        if ingest_client is not None:
+            ingest_client.close()
+            print(f"Ingest: {ingest_client.rows_acked} rows acknowledged, {ingest_client.pending_rows} unsent")
+        print(f"Sampler stats: {scheduler.stats()}")
 
     def _delayed_start_worker(self):
         """在后台等待5秒，然后启动监听器和数据采集线程。"""
@@ -200,16 +199,13 @@ class Recorder:
         self.status_var.set(f"开始记录 '{self.label_var.get()}'...")
         print(f"Recorder started with label '{self.label_var.get()}'")
 
-        # 启动监听器
-        self.mouse_listener = mouse.Listener(on_click=self.on_click, on_move=self.on_move, on_scroll=self.on_scroll)
-        self.keyboard_listener = keyboard.Listener(on_press=self.on_press)
+        # 启动监听器 (丢弃上一次记录残留的输入计数)
+        self.input_aggregator.reset()
+        self.mouse_listener = mouse.Listener(on_click=self.input_aggregator.on_click, on_move=self.input_aggregator.on_move, on_scroll=self.input_aggregator.on_scroll)
+        self.keyboard_listener = keyboard.Listener(on_press=self.input_aggregator.on_press)
         self.mouse_listener.start()
         self.keyboard_listener.start()
 
-        #网络、磁盘
-        self.net_io = psutil.net_io_counters()
-        self.disk_io = psutil.disk_io_counters()
-        
         # 启动数据采集线程
         self.stats_thread = threading.Thread(target=self.system_stats_worker, daemon=True)
         self.stats_thread.start()
@@ -218,19 +214,7 @@ class Recorder:
         if self.running: return
         self.running = True
         
-        # 确保CSV文件头存在
-        if not os.path.exists(self.output_filename):
-            with open(self.output_filename, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    'timestamp', 'mouse_distance', 'mouse_left_click', 'mouse_right_click', 'mouse_scroll',
-                    'keyboard_counts','cpu_percent', 'ram_percent', 'gpu_percent','gpu_vram_percent','bytes_sent_per_sec', 'bytes_recv_per_sec', 'packets_sent_per_sec', 'packets_recv_per_sec',
-                    'read_bytes_per_sec', 'write_bytes_per_sec',
-                    'label'
-                ])
-        
         self.stop_event.clear()
-        self.data_buffer.clear() # 每次开始前清空缓冲区
         
         # 启动一个新线程来处理5秒的延迟，以避免阻塞GUI
         delay_thread = threading.Thread(target=self._delayed_start_worker, daemon=True)
@@ -244,7 +228,7 @@ class Recorder:
         self.stop_event.set()
         if self.mouse_listener: self.mouse_listener.stop()
         if self.keyboard_listener: self.keyboard_listener.stop()
-        if self.stats_thread: self.stats_thread.join(timeout=2) # 等待线程将缓冲区数据写完
+        if self.stats_thread: self.stats_thread.join(timeout=2 + self.flush_interval) # 等待线程将剩余数据写完
         
         if self.gpu_handle:
             try:
@@ -270,6 +254,24 @@ def on_resize(event):
     on_off_button.config(padx=max(5, int(event.width * 0.05)), pady=max(5, int(event.height * 0.05)))
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="数据采集程序")
+    parser.add_argument('--format', choices=['csv', 'columnar'], default='csv', help="输出格式")
+    parser.add_argument('--sample-hz', type=int, default=1, help="每秒采样次数 (如5或10)，每秒的采样合并为一行")
+    parser.add_argument('--output-dir', default='train_data', help="日志目录")
+    parser.add_argument('--flush-interval', type=float, default=1.0, help="落盘间隔 (秒)")
+    parser.add_argument('--compress', action='store_true', help="gzip压缩已轮转的CSV日志段")
+    parser.add_argument('--metrics-port', type=int, default=0, help="在本机该端口提供Prometheus格式的性能指标 (/metrics)")
+    parser.add_argument('--metrics-json', default=None, help="定期把性能指标写到该JSON文件")
+    parser.add_argument('--ingest', default=None, help="同时把数据发送到入库服务 (host:port，见 ingest.py)")
+    args = parser.parse_args()
+
+    metrics = Metrics() if args.metrics_port or args.metrics_json else None
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+        print(f"Metrics endpoint: http://127.0.0.1:{args.metrics_port}/metrics")
+    if args.metrics_json:
+        metrics.start_dump(args.metrics_json)
+
     root = tk.Tk()
     root.title("数据采集程序")
     root.geometry("500x350")
@@ -290,7 +292,9 @@ if __name__ == "__main__":
     status_bar = tk.Label(root, textvariable=status_var, relief=tk.SUNKEN, anchor="w", bd=1, padx=5)
     status_bar.pack(side="bottom", fill="x")
 
-    recorder = Recorder(selected_label, status_var)
+    recorder = Recorder(selected_label, status_var, sample_hz=args.sample_hz, output_format=args.format,
+                        output_dir=args.output_dir, flush_interval=args.flush_interval, compress=args.compress,
+                        metrics=metrics, ingest=args.ingest)
 
     def switch_record_cb():
         on_off_button.config(state="disabled")
@@ -306,6 +310,8 @@ if __name__ == "__main__":
 
     def on_close():
         recorder.stop()
+        if metrics is not None:
+            metrics.close(args.metrics_json)
         root.destroy()
 
     root.protocol("WM_DELETE_WINDOW", on_close)
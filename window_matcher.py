@@ -0,0 +1,178 @@
+import collections
+import time
+
+WINDOWS_LABEL_PATH = 'windows_label.csv'
+
+
+def load_windows_dictionary(path=WINDOWS_LABEL_PATH):
+    """读取字典规则 (title,label) 为 {关键词: 标签}，文件不存在时返回空字典"""
+    import pandas as pd
+    try:
+        return pd.read_csv(path).set_index('title')['label'].to_dict()
+    except FileNotFoundError:
+        print(f"Warning: '{path}' 未找到，不使用字典规则")
+        return {}
+
+
+class WindowMatcher:
+    """
+    窗口标题/进程名字典规则匹配器。
+    所有关键词编译为一个Aho-Corasick自动机，一次扫描即可找出全部命中的规则，耗时与规则数量无关；
+    字典变化时才重新编译。前景窗口很少切换，因此 (标题, 进程名) -> 字典标签 的结果用有界LRU缓存。
+    """
+    def __init__(self, rules=None, cache_size=256):
+        self.cache_size = cache_size
+        self.update(rules or {})
+
+    def update(self, rules):
+        """根据 {关键词: 标签} 字典重建自动机，并清空缓存"""
+        labels = list(rules.values())
+        goto = [{}]      # 每个状态的转移表
+        fail = [0]
+        output = [[]]    # 每个状态命中的规则序号 (含fail链上的)
+
+        for index, key in enumerate(rules.keys()):
+            key = key.lower()
+            if not key:
+                continue
+            state = 0
+            for ch in key:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    fail.append(0)
+                    output.append([])
+                state = nxt
+            output[state].append(index)
+
+        # 广度优先构建fail指针
+        queue = collections.deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                if state:
+                    f = fail[state]
+                    while f and ch not in goto[f]:
+                        f = fail[f]
+                    fail[nxt] = goto[f].get(ch, 0)
+                output[nxt] = output[nxt] + output[fail[nxt]]
+
+        # 自动机和缓存放在同一个元组中一次赋值：预测线程只读取一次，旧字典的结果只会写入旧缓存
+        self._state = ((labels, goto, fail, output), collections.OrderedDict())
+
+    def _scan(self, automaton, text, hits):
+        _, goto, fail, output = automaton
+        state = 0
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                hits.update(output[state])
+
+    def match(self, window_title, process_name=""):
+        """
+        返回字典规则给出的标签，没有命中时返回空字符串。
+        与原逻辑一致：命中的规则中只要有 video 就取 video，否则取字典中排在最后的命中规则。
+        """
+        automaton, cache = self._state
+        key = (window_title, process_name)
+        label = cache.get(key)
+        if label is not None:
+            cache.move_to_end(key)
+            return label
+
+        hits = set()
+        self._scan(automaton, window_title, hits)
+        if process_name:
+            self._scan(automaton, process_name, hits)
+
+        label = ""
+        if hits:
+            labels = automaton[0]
+            matched_labels = [labels[i] for i in sorted(hits)]
+            label = 'video' if 'video' in matched_labels else matched_labels[-1]
+
+        cache[key] = label
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return label
+
+    def decide(self, model_prediction, window_title, process_name=""):
+        """字典规则优先，模型兜底；字典判为 gaming 而模型判为 video 时以 video 为准"""
+        dict_label = self.match(window_title, process_name)
+        if not dict_label:
+            return model_prediction
+        if dict_label == 'gaming' and model_prediction == 'video':
+            return 'video'
+        return dict_label
+
+
+def _reference_decide(windows_dictionary, model_prediction, window_title):
+    """旧版 predict_loop 中逐条遍历字典的实现，仅用于一致性校验"""
+    dict_label_find = []
+    dict_label = ""
+    for key_title, label in windows_dictionary.items():
+        if key_title.lower() in window_title.lower():
+            dict_label_find.append(label)
+    if dict_label_find:
+        for label in dict_label_find:
+            if label == 'video':
+                dict_label = 'video'
+                break
+            else:
+                dict_label = label
+        if dict_label == 'gaming' and model_prediction == 'video':
+            dict_label = 'video'
+        return dict_label
+    return model_prediction
+
+
+def check_parity(n_rules=500, n_titles=5000, seed=0):
+    import random
+    rng = random.Random(seed)
+    alphabet = "abcdeABCDE -_"
+    labels = ['coding', 'video', 'gaming', 'idle']
+    rules = {}
+    while len(rules) < n_rules:
+        rules["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 6)))] = rng.choice(labels)
+    matcher = WindowMatcher(rules)
+    for _ in range(n_titles):
+        title = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        model_prediction = rng.choice(labels)
+        expected = _reference_decide(rules, model_prediction, title)
+        assert matcher.decide(model_prediction, title) == expected, (title, model_prediction)
+    return n_titles
+
+
+def benchmark(n_rules=500, repeat=2000):
+    rules = {f"keyword_{i}": ['coding', 'video', 'gaming', 'idle'][i % 4] for i in range(n_rules)}
+    titles = [f"Some Window Title {i % 7} - keyword_{i % n_rules} - Editor" for i in range(repeat)]
+    matcher = WindowMatcher(rules)
+
+    start = time.perf_counter()
+    for title in titles:
+        _reference_decide(rules, 'coding', title)
+    old = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for title in titles:
+        matcher.decide('coding', title)
+    cold = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for title in titles:
+        matcher.decide('coding', titles[0])
+    hot = (time.perf_counter() - start) / repeat
+
+    print(f"逐条遍历 ({n_rules} 条规则): {old * 1e6:8.1f} us/次")
+    print(f"自动机 (未命中缓存)      : {cold * 1e6:8.1f} us/次")
+    print(f"自动机 (标题未变化)      : {hot * 1e6:8.1f} us/次")
+
+
+if __name__ == "__main__":
+    print(f"一致性校验通过: {check_parity()} 个标题")
+    benchmark()